@@ -0,0 +1,233 @@
+"""
+Análise entre vigências (ex.: 2025 x 2026) sobre o relatório ou o histórico SQLite.
+
+Carrega tudo em colunas (pandas/NumPy), converte a alíquota do formato brasileiro
+("1,0000") uma única vez de forma vetorizada e gera:
+  - deltas por estabelecimento (alíquota de/para, variação absoluta e %);
+  - agregados por UF, município e CNPJ raiz;
+  - outliers (variação fora do padrão por z-score robusto, ou alíquota fora de 0,5–2,0).
+
+    py analytics.py --relatorio relatorio_fap.xlsx --de 2025 --para 2026 --saida analise_fap.xlsx
+    py analytics.py --db relatorio_fap.db --saida analise_fap.xlsx
+
+Requer pandas (e openpyxl para .xlsx); sem pandas o comando avisa e sai.
+"""
+import os
+import time
+import sqlite3
+import logging
+import argparse
+from typing import Dict
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:  # dependência opcional
+    np = pd = None
+
+from report_utils import REPORT_HEADERS
+from store_utils import latest_sql, DEFAULT_DB_PATH
+
+LOG = logging.getLogger("fapbot")
+
+# Faixa legal do FAP (multiplicador); fora disso é erro de leitura/extração
+FAP_MIN, FAP_MAX = 0.5, 2.0
+# |z| robusto (mediana/MAD) acima disso = variação atípica
+OUTLIER_Z = 3.5
+
+_ATTRS = ["CNPJ_Raiz", "Razao_Social", "UF", "Municipio"]
+
+
+def _require_pandas():
+    if pd is None:
+        raise RuntimeError("pandas/numpy não instalados: py -m pip install pandas numpy")
+
+
+def parse_aliquota(s: "pd.Series") -> "pd.Series":
+    """'1,0000' / '1.234,5' / '1.0000' -> float (NaN se não numérico), vetorizado."""
+    s = s.astype("string").str.strip()
+    comma = s.str.contains(",", regex=False).fillna(False)
+    # vírgula decimal: ponto só como separador de milhar
+    s = s.where(~comma, s.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(s, errors="coerce")
+
+
+def _digits(s: "pd.Series", width: int) -> "pd.Series":
+    """Só dígitos, com zeros à esquerda repostos (o Excel guarda CNPJ como número); vazio vira NA."""
+    d = s.astype("string").str.replace(r"\.0$", "", regex=True).str.replace(r"\D", "", regex=True)
+    return d.mask(d == "").str.zfill(width)
+
+
+def normalize(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Padroniza colunas/tipos e mantém só a consulta mais recente de cada (CNPJ_Estab, Vigencia)."""
+    _require_pandas()
+    for h in REPORT_HEADERS:
+        if h not in df.columns:
+            df[h] = pd.NA
+    # o histórico já traz a alíquota convertida (aliquota_num)
+    df = df[REPORT_HEADERS + [c for c in ("aliquota_num",) if c in df.columns]].copy()
+    df["CNPJ_Raiz"] = _digits(df["CNPJ_Raiz"], 8)
+    df["CNPJ_Estab"] = _digits(df["CNPJ_Estab"], 14)
+    df["Vigencia"] = df["Vigencia"].astype("string").str.replace(r"\.0$", "", regex=True).str.strip()
+    if "aliquota_num" not in df.columns:
+        df["aliquota_num"] = parse_aliquota(df["Aliquota"])
+    df["_ts"] = pd.to_datetime(df["Data_Consulta"], format="%d/%m/%Y %H:%M:%S", errors="coerce")
+    df = df.sort_values("_ts", kind="stable").drop_duplicates(["CNPJ_Estab", "Vigencia"], keep="last")
+    return df.drop(columns="_ts").reset_index(drop=True)
+
+
+def load_report(path: str) -> "pd.DataFrame":
+    """Relatório .xlsx/.csv (append_row_to_excel ou ReportUpsertWriter)."""
+    _require_pandas()
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig") as f:
+            head = f.readline()
+        sep = ";" if head.count(";") > head.count(",") else ","
+        df = pd.read_csv(path, dtype=str, sep=sep, encoding="utf-8-sig")
+    else:
+        try:
+            # python-calamine (se instalado) lê .xlsx grandes bem mais rápido que o openpyxl
+            df = pd.read_excel(path, dtype=str, engine="calamine")
+        except (ImportError, ValueError):
+            df = pd.read_excel(path, dtype=str)
+    return normalize(df)
+
+
+def load_store(db_path: str = DEFAULT_DB_PATH) -> "pd.DataFrame":
+    """Posição mais recente do histórico SQLite (alíquota já convertida no banco)."""
+    _require_pandas()
+    sql, params = latest_sql()
+    conn = sqlite3.connect(db_path)
+    try:
+        raw = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+    df = raw.rename(columns={
+        "cnpj_raiz": "CNPJ_Raiz", "razao_social": "Razao_Social", "cnpj_estab": "CNPJ_Estab", "uf": "UF",
+        "municipio": "Municipio", "vigencia": "Vigencia", "aliquota": "Aliquota", "data_consulta": "Data_Consulta",
+    })
+    return normalize(df)
+
+
+def deltas(df: "pd.DataFrame", de: str, para: str) -> "pd.DataFrame":
+    """Uma linha por estabelecimento: alíquota em `de` e `para`, variação e situação."""
+    de, para = str(de), str(para)
+    sub = df[df["Vigencia"].isin([de, para])]
+    wide = sub.set_index(["CNPJ_Estab", "Vigencia"])["aliquota_num"].unstack("Vigencia")
+    for v in (de, para):
+        if v not in wide.columns:
+            wide[v] = np.nan
+    # atributos da vigência mais nova disponível
+    attrs = sub.sort_values("Vigencia").drop_duplicates("CNPJ_Estab", keep="last").set_index("CNPJ_Estab")[_ATTRS]
+    out = attrs.join(wide[[de, para]].rename(columns={de: f"aliquota_{de}", para: f"aliquota_{para}"}), how="outer")
+    a, b = out[f"aliquota_{de}"].to_numpy(dtype=float), out[f"aliquota_{para}"].to_numpy(dtype=float)
+    delta = b - a
+    out["delta"] = delta
+    out["delta_pct"] = np.where(a > 0, delta / a * 100.0, np.nan)
+    out["situacao"] = np.select(
+        [np.isnan(a) & ~np.isnan(b), ~np.isnan(a) & np.isnan(b), delta > 1e-9, delta < -1e-9],
+        [f"só {para}", f"só {de}", "subiu", "caiu"],
+        default="igual",
+    )
+    return out.reset_index().rename(columns={"index": "CNPJ_Estab"})
+
+
+def aggregates(d: "pd.DataFrame", de: str, para: str) -> Dict[str, "pd.DataFrame"]:
+    """Agregados por UF, município (UF+município) e CNPJ raiz."""
+    d = d.assign(_subiu=(d["situacao"] == "subiu").astype(int), _caiu=(d["situacao"] == "caiu").astype(int))
+    spec = dict(
+        estabelecimentos=("CNPJ_Estab", "size"),
+        **{f"media_{de}": (f"aliquota_{de}", "mean"), f"media_{para}": (f"aliquota_{para}", "mean")},
+        delta_medio=("delta", "mean"),
+        delta_min=("delta", "min"),
+        delta_max=("delta", "max"),
+        subiram=("_subiu", "sum"),
+        cairam=("_caiu", "sum"),
+    )
+    out = {}
+    for name, keys in (("por_uf", ["UF"]), ("por_municipio", ["UF", "Municipio"]), ("por_raiz", ["CNPJ_Raiz"])):
+        extra = {"Razao_Social": ("Razao_Social", "first")} if name == "por_raiz" else {}
+        agg = d.groupby(keys, dropna=False).agg(**extra, **spec)
+        out[name] = agg.round(4).reset_index().sort_values("estabelecimentos", ascending=False)
+    return out
+
+
+def outliers(d: "pd.DataFrame", de: str, para: str, z: float = OUTLIER_Z) -> "pd.DataFrame":
+    """Variações atípicas (z robusto) e alíquotas fora da faixa legal."""
+    delta = d["delta"].to_numpy(dtype=float)
+    fin = delta[np.isfinite(delta)]
+    med = float(np.median(fin)) if fin.size else 0.0
+    dev = np.abs(fin - med)
+    mad = float(np.median(dev)) if fin.size else 0.0
+    if mad == 0 and (dev > 1e-9).any():
+        # a maioria não mudou (MAD zero): a escala passa a ser a variação típica de quem mudou
+        mad = float(np.median(dev[dev > 1e-9]))
+    scale = 1.4826 * mad
+    zs = (delta - med) / scale if scale > 0 else np.zeros_like(delta)
+    vals = d[[f"aliquota_{de}", f"aliquota_{para}"]].to_numpy(dtype=float)
+    out_of_range = ((vals < FAP_MIN) | (vals > FAP_MAX)).any(axis=1)
+    atypical = np.abs(np.nan_to_num(zs)) > z
+    res = d.assign(z_robusto=np.round(zs, 2))
+    res["motivo"] = np.select([out_of_range, atypical], ["fora de 0,5-2,0", "variação atípica"], default="")
+    res = res[out_of_range | atypical]
+    return res.reindex(res["z_robusto"].abs().sort_values(ascending=False).index)
+
+
+def export(tables: Dict[str, "pd.DataFrame"], path: str) -> str:
+    """Uma aba por tabela (.xlsx) ou um .csv por tabela (pasta/prefixo)."""
+    if path.lower().endswith(".xlsx"):
+        try:
+            with pd.ExcelWriter(path, engine="openpyxl") as xw:
+                for name, t in tables.items():
+                    t.to_excel(xw, sheet_name=name[:31], index=False)
+            return path
+        except ImportError:
+            path = path[:-5]
+    base = path[:-4] if path.lower().endswith(".csv") else path
+    for name, t in tables.items():
+        t.to_csv(f"{base}_{name}.csv", index=False, sep=";", decimal=",", encoding="utf-8-sig")
+    return base + "_*.csv"
+
+
+def analyze(df: "pd.DataFrame", de: str, para: str, z: float = OUTLIER_Z) -> Dict[str, "pd.DataFrame"]:
+    d = deltas(df, de, para)
+    tables = {"deltas": d}
+    tables.update(aggregates(d, de, para))
+    tables["outliers"] = outliers(d, de, para, z)
+    return tables
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Compara alíquotas FAP entre vigências (deltas, agregados, outliers)")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--relatorio", help="relatório .xlsx/.csv")
+    src.add_argument("--db", help=f"histórico SQLite (padrão: {DEFAULT_DB_PATH})")
+    ap.add_argument("--de", default="2025")
+    ap.add_argument("--para", default="2026")
+    ap.add_argument("--saida", default="analise_fap.xlsx")
+    ap.add_argument("--z", type=float, default=OUTLIER_Z, help="limite do z-score robusto para outliers")
+    args = ap.parse_args(argv)
+    if pd is None:
+        ap.error("pandas/numpy não instalados: py -m pip install pandas numpy")
+
+    t0 = time.perf_counter()
+    if args.relatorio:
+        df = load_report(args.relatorio)
+    else:
+        db = args.db or DEFAULT_DB_PATH
+        if not os.path.exists(db):
+            ap.error(f"banco não encontrado: {db}")
+        df = load_store(db)
+    t1 = time.perf_counter()
+    tables = analyze(df, args.de, args.para, args.z)
+    t2 = time.perf_counter()
+    out = export(tables, args.saida)
+
+    sit = tables["deltas"]["situacao"].value_counts().to_dict()
+    print(f"{len(df)} linhas carregadas em {t1 - t0:.1f}s; análise em {t2 - t1:.2f}s")
+    print(f"{args.de} -> {args.para}: " + ", ".join(f"{k}: {v}" for k, v in sit.items()))
+    print(f"{len(tables['outliers'])} outliers; resultado em {out}")
+
+
+if __name__ == "__main__":
+    _cli()
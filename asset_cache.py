@@ -0,0 +1,366 @@
+"""
+Cache local de estáticos do portal via CDP (Fetch.requestPaused).
+
+Cada navegação para consultar-fap (inclusive as reaberturas de aba em _ensure_window,
+open_dropdown e na reciclagem) baixaria de novo o bundle da SPA pelos IPs pinnados.
+Com o cache ativo, JS/CSS/fontes com hash no nome (imutáveis) são servidos do disco
+(Fetch.fulfillRequest); o resto — inclusive as chamadas de API — segue para a rede.
+
+O Selenium não recebe eventos CDP, então o interceptador abre a sua própria sessão
+WebSocket na aba (websocket-client, opcional; sem ele o cache fica desligado).
+As sessões Fetch por aba (FetchSession) também servem à gravação/reprodução (replay.py).
+"""
+import os
+import re
+import abc
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+LOG = logging.getLogger("fapbot")
+
+DEFAULT_CACHE_DIR = "cache_estatico"
+DEFAULT_MAX_MB = 200
+# Só o que vem destes hosts é interceptado
+CACHE_HOSTS = ("fap.dataprev.gov.br",)
+CACHE_RESOURCE_TYPES = ("Script", "Stylesheet", "Font")
+_HASHED_NAME = re.compile(r"[.\-_][0-9a-f]{8,}\.(?:js|mjs|css|woff2?|ttf|otf|eot)(?:\?|$)")
+_FONT_EXT = (".woff", ".woff2", ".ttf", ".otf", ".eot")
+# Cabeçalhos repassados ao servir do cache
+_KEEP_HEADERS = ("content-type", "cache-control", "etag", "last-modified", "access-control-allow-origin")
+
+
+def is_immutable(url: str) -> bool:
+    """Arquivo com hash no nome (ex.: main.3f9c1a2b.js) ou fonte: o conteúdo não muda para a mesma URL."""
+    path = url.split("#")[0]
+    return bool(_HASHED_NAME.search(path)) or path.split("?")[0].lower().endswith(_FONT_EXT)
+
+
+class AssetCache:
+    """
+    Cache em disco com índice LRU (index.json) limitado a `max_bytes`.
+    Chave = sha256 da URL; o índice guarda também o sha256 do conteúdo e o tempo
+    de download original (para estimar o tempo economizado em cada hit).
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_mb: float = DEFAULT_MAX_MB):
+        self.dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.index: "OrderedDict[str, Dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+        self.saved_bytes = 0
+        self._unsaved = 0
+        os.makedirs(self.dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.dir, key[:2], key)
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.dir, "index.json"), encoding="utf-8") as f:
+                items = json.load(f)
+        except (OSError, ValueError):
+            return
+        # mais antigo primeiro, como no OrderedDict em uso
+        for it in sorted(items, key=lambda x: x.get("usado_em", 0)):
+            if os.path.exists(self._path(it["key"])):
+                self.index[it["key"]] = it
+
+    def save_index(self):
+        with self.lock:
+            items = list(self.index.values())
+            self._unsaved = 0
+        tmp = os.path.join(self.dir, "index.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.dir, "index.json"))
+
+    @property
+    def size(self) -> int:
+        return sum(it["bytes"] for it in self.index.values())
+
+    def get(self, url: str):
+        """(corpo, cabeçalhos) ou None. Marca o item como usado recentemente."""
+        k = self.key(url)
+        with self.lock:
+            it = self.index.get(k)
+            if it is None:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(k), "rb") as f:
+                    body = f.read()
+            except OSError:
+                self.index.pop(k, None)
+                self.misses += 1
+                return None
+            self.index.move_to_end(k)
+            it["usado_em"] = time.time()
+            self.hits += 1
+            self.saved_ms += it.get("ms", 0.0)
+            self.saved_bytes += len(body)
+            return body, it["headers"]
+
+    def put(self, url: str, body: bytes, headers: Dict[str, str], ms: float):
+        k = self.key(url)
+        p = self._path(k)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, "wb") as f:
+            f.write(body)
+        with self.lock:
+            self.index[k] = {
+                "key": k, "url": url, "bytes": len(body), "ms": round(ms, 1),
+                "sha256": hashlib.sha256(body).hexdigest(), "headers": headers, "usado_em": time.time(),
+            }
+            self.index.move_to_end(k)
+            self._evict()
+            self._unsaved += 1
+            save = self._unsaved >= 20
+        if save:
+            self.save_index()
+
+    def _evict(self):
+        total = self.size
+        while total > self.max_bytes and len(self.index) > 1:
+            k, it = self.index.popitem(last=False)
+            total -= it["bytes"]
+            try:
+                os.remove(self._path(k))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        n = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": round(self.hits / n, 3) if n else 0.0,
+            "kb_economizados": round(self.saved_bytes / 1024),
+            "s_economizados": round(self.saved_ms / 1000, 1),
+            "itens": len(self.index),
+            "mb_em_disco": round(self.size / (1024 * 1024), 1),
+        }
+
+
+class FetchSession(threading.Thread, abc.ABC):
+    """
+    Sessão CDP própria (WebSocket) na aba `target_id` com o domínio Fetch habilitado
+    para `patterns()`; cada Fetch.requestPaused vai para on_paused() nesta thread.
+    Base do cache de estáticos e da gravação/reprodução de sessões (replay.py).
+    """
+
+    label = "Fetch"
+
+    def __init__(self, debugger_addr: str, target_id: str):
+        super().__init__(name=f"fetch-{target_id[:8]}", daemon=True)
+        self.url = f"ws://{debugger_addr}/devtools/page/{target_id}"
+        self.stop_event = threading.Event()
+        self.ws = None
+        self._id = 0
+        self._send_lock = threading.Lock()
+        self._pending: deque = deque()
+
+    @abc.abstractmethod
+    def patterns(self) -> List[Dict]:
+        """Padrões do Fetch.enable (urlPattern/resourceType/requestStage)."""
+
+    @abc.abstractmethod
+    def on_paused(self, p: Dict):
+        """Trata um Fetch.requestPaused (continuar, responder do cache, falhar...)."""
+
+    def _send(self, method: str, params: Optional[Dict] = None, wait: bool = False) -> Optional[Dict]:
+        """Envia um comando; com wait=True (só nesta thread) aguarda a resposta guardando os eventos."""
+        with self._send_lock:
+            self._id += 1
+            mid = self._id
+            self.ws.send(json.dumps({"id": mid, "method": method, "params": params or {}}))
+        if not wait:
+            return None
+        while True:
+            msg = json.loads(self.ws.recv())
+            if msg.get("id") == mid:
+                return msg.get("result") or {}
+            if "method" in msg:
+                self._pending.append(msg)
+
+    def connect(self) -> bool:
+        import websocket  # websocket-client (opcional)
+        self.ws = websocket.create_connection(self.url, timeout=10, suppress_origin=True)
+        self._send("Fetch.enable", {"patterns": self.patterns()}, wait=True)
+        self.ws.settimeout(1.0)
+        return True
+
+    def run(self):
+        import websocket
+        while not self.stop_event.is_set():
+            try:
+                msg = self._pending.popleft() if self._pending else json.loads(self.ws.recv())
+            except websocket.WebSocketTimeoutException:
+                continue
+            except Exception:
+                break  # aba fechada / navegador encerrado
+            if msg.get("method") == "Fetch.requestPaused":
+                try:
+                    self.on_paused(msg["params"])
+                except Exception as e:
+                    LOG.debug(f"{self.label}: erro tratando requisição: {e}")
+            elif msg.get("method") == "Inspector.detached":
+                break
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class FetchInterceptor(FetchSession):
+    """
+    Cache de estáticos: Fetch no estágio de request para scripts/CSS/fontes do portal;
+    hit -> Fetch.fulfillRequest; miss -> continueRequest com interceptResponse, e no
+    estágio de resposta o corpo (200) vai para o cache.
+    """
+
+    label = "Cache estático"
+
+    def __init__(self, cache: AssetCache, debugger_addr: str, target_id: str):
+        super().__init__(debugger_addr, target_id)
+        self.cache = cache
+        self._started: Dict[str, float] = {}
+
+    def patterns(self) -> List[Dict]:
+        return [
+            {"urlPattern": f"*://{h}/*", "resourceType": rt, "requestStage": "Request"}
+            for h in CACHE_HOSTS for rt in CACHE_RESOURCE_TYPES
+        ]
+
+    def on_paused(self, p: Dict):
+        rid = p["requestId"]
+        url = p["request"]["url"]
+        if "responseStatusCode" not in p:
+            # estágio de request
+            if is_immutable(url):
+                hit = self.cache.get(url)
+                if hit is not None:
+                    body, headers = hit
+                    self._send("Fetch.fulfillRequest", {
+                        "requestId": rid, "responseCode": 200,
+                        "responseHeaders": [{"name": k, "value": v} for k, v in headers.items()],
+                        "body": base64.b64encode(body).decode("ascii"),
+                    })
+                    return
+                self._started[rid] = time.monotonic()
+                self._send("Fetch.continueRequest", {"requestId": rid, "interceptResponse": True})
+                return
+            self._send("Fetch.continueRequest", {"requestId": rid})
+            return
+        # estágio de resposta (só chega aqui quem pediu interceptResponse)
+        t0 = self._started.pop(rid, None)
+        if p.get("responseStatusCode") == 200:
+            try:
+                res = self._send("Fetch.getResponseBody", {"requestId": rid}, wait=True)
+                body = base64.b64decode(res["body"]) if res.get("base64Encoded") else res.get("body", "").encode("utf-8")
+                headers = {h["name"].lower(): h["value"] for h in p.get("responseHeaders") or []
+                           if h["name"].lower() in _KEEP_HEADERS}
+                ms = (time.monotonic() - t0) * 1000 if t0 else 0.0
+                self.cache.put(url, body, headers, ms)
+            except Exception as e:
+                LOG.debug(f"Cache estático: não armazenado {url}: {e}")
+        self._send("Fetch.continueRequest", {"requestId": rid})
+
+
+# ===== Sessões Fetch por aba =====
+# driver._fap_fetch_factories: {tipo: factory(handle) -> FetchSession}
+# driver._fap_fetch_sessions: {(tipo, handle): FetchSession}
+def register_fetch_session(driver, kind: str, factory: Callable[[str], FetchSession]) -> bool:
+    """Registra um tipo de sessão Fetch (vale para a aba atual e as próximas) e a abre já."""
+    try:
+        import websocket  # noqa: F401
+    except ImportError:
+        LOG.warning(f"{kind}: websocket-client não instalado; recurso desativado.")
+        return False
+    factories = getattr(driver, "_fap_fetch_factories", {})
+    factories[kind] = factory
+    driver._fap_fetch_factories = factories
+    return ensure_fetch_sessions(driver)
+
+
+def ensure_fetch_sessions(driver) -> bool:
+    """Abre, na aba atual, as sessões Fetch registradas que ainda não estão ativas (novas abas/reaberturas)."""
+    factories = getattr(driver, "_fap_fetch_factories", None)
+    if not factories:
+        return False
+    sessions = getattr(driver, "_fap_fetch_sessions", {})
+    driver._fap_fetch_sessions = sessions
+    try:
+        h = driver.current_window_handle
+    except Exception:
+        return False
+    ok = True
+    for kind, factory in factories.items():
+        cur = sessions.get((kind, h))
+        if cur is not None and cur.is_alive():
+            continue
+        it = factory(h)
+        try:
+            it.connect()
+        except Exception as e:
+            LOG.warning(f"{it.label}: falha ao abrir sessão CDP ({e}); seguindo sem ela nesta aba.")
+            ok = False
+            continue
+        it.start()
+        sessions[(kind, h)] = it
+        LOG.info(f"{it.label}: ativo na aba {h[:8]}.")
+    return ok
+
+
+def stop_fetch_sessions(driver, kind: Optional[str] = None):
+    """Encerra as sessões (de um tipo ou todas) e deixa de abri-las em novas abas."""
+    factories = getattr(driver, "_fap_fetch_factories", {})
+    sessions = getattr(driver, "_fap_fetch_sessions", {})
+    for (k, h), it in list(sessions.items()):
+        if kind is None or k == kind:
+            it.stop()
+            sessions.pop((k, h), None)
+    for k in list(factories):
+        if kind is None or k == kind:
+            factories.pop(k, None)
+
+
+def enable_asset_cache(driver, debugger_addr: str, cache: Optional[AssetCache] = None) -> bool:
+    """Liga o cache na aba atual e nas próximas (handle do WebDriver = targetId do CDP)."""
+    cache = cache or AssetCache()
+    driver._fap_asset_cache = cache
+    ok = register_fetch_session(driver, "cache", lambda h: FetchInterceptor(cache, debugger_addr, h))
+    if ok:
+        LOG.info(f"Cache estático: {cache.stats()['itens']} itens em {cache.dir}.")
+    return ok
+
+
+def asset_cache_report(driver) -> Optional[Dict]:
+    """Encerra os interceptadores, grava o índice e devolve as estatísticas (ou None se inativo)."""
+    cache = getattr(driver, "_fap_asset_cache", None)
+    if cache is None:
+        return None
+    stop_fetch_sessions(driver, "cache")
+    cache.save_index()
+    st = cache.stats()
+    LOG.info(
+        f"Cache estático: {st['hits']} hits / {st['hits'] + st['misses']} ({st['taxa_acerto']:.0%}), "
+        f"{st['kb_economizados']} KB e ~{st['s_economizados']}s de download economizados"
+    )
+    return st
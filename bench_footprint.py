@@ -0,0 +1,217 @@
+"""
+Custo por instância do navegador lançado pelo bot (quantos workers cabem numa máquina).
+
+Sobe uma página local (http.server), lança N instâncias headless com user-data-dir
+temporário, uma após a outra, e mede por instância:
+
+    inicio_s   do spawn até a página local avisar que carregou (fetch /pronto no onload)
+    rss_mb     RSS somado do processo do navegador e filhos, depois de todas no ar
+    cpu_s      CPU (usuário+sistema) da árvore de processos, do spawn ao fim da espera
+    procs      quantidade de processos da árvore
+
+Com --comparar roda o preset enxuto (browser_config.lean_args) e o padrão, lado a lado.
+RSS/CPU usam psutil se instalado; sem ele, /proc (só Linux).
+
+    python bench_footprint.py -n 4
+    python bench_footprint.py -n 6 --comparar --espera 10
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from statistics import mean
+from typing import Dict, List, Optional, Tuple
+
+from browser_config import HEADLESS_WINDOW_SIZE, lean_args, linux_browser_path, brave_path
+
+SETTLE_SECONDS = 5.0
+START_TIMEOUT = 30.0
+
+PAGE = b"""<!doctype html><html><head><meta charset="utf-8"><title>fapbot bench</title></head>
+<body><h1>bench</h1><select id="cnpjRaiz"><option>00.000.000</option></select>
+<script>window.addEventListener('load', () => fetch('/pronto' + location.search));</script></body></html>"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    ready: Dict[str, float] = {}
+
+    def do_GET(self):
+        if self.path.startswith("/pronto"):
+            self.ready[self.path.partition("?i=")[2]] = time.perf_counter()
+            body = b"ok"
+        else:
+            body = PAGE
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+
+# -- árvore de processos (psutil ou /proc) --
+def _proc_children() -> Dict[int, List[int]]:
+    kids: Dict[int, List[int]] = {}
+    for d in os.listdir("/proc"):
+        if not d.isdigit():
+            continue
+        try:
+            with open(f"/proc/{d}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            kids.setdefault(ppid, []).append(int(d))
+        except (OSError, ValueError, IndexError):
+            continue
+    return kids
+
+
+def tree_usage(pid: int) -> Dict[str, float]:
+    """{rss_mb, cpu_s, procs} do processo e descendentes; zeros se não houver como medir."""
+    try:
+        import psutil
+        try:
+            root = psutil.Process(pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return {"rss_mb": 0.0, "cpu_s": 0.0, "procs": 0}
+        rss = cpu = 0.0
+        for p in procs:
+            try:
+                rss += p.memory_info().rss
+                t = p.cpu_times()
+                cpu += t.user + t.system
+            except psutil.Error:
+                pass
+        return {"rss_mb": rss / (1024 * 1024), "cpu_s": cpu, "procs": len(procs)}
+    except ImportError:
+        pass
+    if not os.path.isdir("/proc"):
+        return {"rss_mb": 0.0, "cpu_s": 0.0, "procs": 0}
+    kids = _proc_children()
+    tick = os.sysconf("SC_CLK_TCK")
+    page_kb = os.sysconf("SC_PAGE_SIZE") / 1024
+    todo, seen = [pid], []
+    while todo:
+        p = todo.pop()
+        seen.append(p)
+        todo.extend(kids.get(p, []))
+    rss_kb = cpu = 0.0
+    for p in seen:
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / tick   # utime, stime
+            rss_kb += int(fields[21]) * page_kb                 # rss em páginas
+        except (OSError, ValueError, IndexError):
+            pass
+    return {"rss_mb": rss_kb / 1024, "cpu_s": cpu, "procs": len(seen)}
+
+
+def available_mb() -> Optional[float]:
+    try:
+        import psutil
+        return psutil.virtual_memory().available / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+# -- execução --
+def _browser() -> str:
+    return brave_path() if sys.platform == "win32" else linux_browser_path()
+
+
+def _launch(binary: str, url: str, lean: bool, headless: bool) -> Tuple[subprocess.Popen, str]:
+    data = tempfile.mkdtemp(prefix="fapbot-bench-")
+    args = [binary, f"--user-data-dir={data}", "--no-first-run", "--password-store=basic",
+            f"--window-size={HEADLESS_WINDOW_SIZE}", "--disable-dev-shm-usage"]
+    if headless:
+        args.append("--headless=new")
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        args.append("--no-sandbox")
+    if lean:
+        args += lean_args()
+    args.append(url)
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return proc, data
+
+
+def run_preset(n: int, lean: bool, settle: float = SETTLE_SECONDS, headless: bool = True) -> List[Dict]:
+    _Handler.ready = {}
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{srv.server_address[1]}/"
+    binary = _browser()
+    rows: List[Dict] = []
+    launched = []
+    try:
+        for i in range(n):
+            t0 = time.perf_counter()
+            proc, data = _launch(binary, f"{base}?i={i}", lean, headless)
+            launched.append((proc, data))
+            while str(i) not in _Handler.ready and time.perf_counter() - t0 < START_TIMEOUT:
+                if proc.poll() is not None:
+                    break
+                time.sleep(0.02)
+            ready = _Handler.ready.get(str(i))
+            rows.append({"instancia": i + 1, "pid": proc.pid, "inicio_s": (ready - t0) if ready else None})
+        time.sleep(settle)
+        for row, (proc, _) in zip(rows, launched):
+            row.update(tree_usage(proc.pid))
+    finally:
+        for proc, data in launched:
+            proc.terminate()
+        for proc, data in launched:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            shutil.rmtree(data, ignore_errors=True)
+        srv.shutdown()
+    return rows
+
+
+def _report(name: str, rows: List[Dict]):
+    print(f"\n== preset {name} ==")
+    print(f"{'inst':>4} {'início(s)':>10} {'RSS(MB)':>9} {'CPU(s)':>7} {'procs':>6}")
+    for r in rows:
+        ini = f"{r['inicio_s']:.2f}" if r["inicio_s"] is not None else "falhou"
+        print(f"{r['instancia']:>4} {ini:>10} {r['rss_mb']:>9.0f} {r['cpu_s']:>7.2f} {r['procs']:>6}")
+    ok = [r for r in rows if r["inicio_s"] is not None]
+    if not ok:
+        return
+    rss = mean(r["rss_mb"] for r in ok)
+    print(f"média: início {mean(r['inicio_s'] for r in ok):.2f}s, RSS {rss:.0f} MB, CPU {mean(r['cpu_s'] for r in ok):.2f}s")
+    free = available_mb()
+    if rss and free:
+        print(f"memória disponível {free:.0f} MB -> cabem ~{int(free // rss)} instâncias a mais neste preset")
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Custo (RSS, CPU, tempo de início) por instância do navegador")
+    ap.add_argument("-n", "--instancias", type=int, default=3)
+    ap.add_argument("--espera", type=float, default=SETTLE_SECONDS, help="segundos com todas no ar antes de medir")
+    ap.add_argument("--padrao", action="store_true", help="sem o preset enxuto")
+    ap.add_argument("--comparar", action="store_true", help="roda o preset enxuto e o padrão")
+    ap.add_argument("--com-janela", action="store_true", help="não usa --headless")
+    args = ap.parse_args(argv)
+    presets = [("enxuto", True), ("padrão", False)] if args.comparar else [("padrão" if args.padrao else "enxuto", not args.padrao)]
+    for name, lean in presets:
+        _report(name, run_preset(args.instancias, lean, args.espera, headless=not args.com_janela))
+
+
+if __name__ == "__main__":
+    _cli()
@@ -1,11 +1,16 @@
 from pathlib import Path
-from typing import Optional, Dict
-import os, json, urllib.request  # <- add
+from typing import Optional, Dict, List
+import os, sys, json, time, shutil, logging, subprocess, urllib.request  # <- add
 from selenium import webdriver
+from selenium.common.exceptions import SessionNotCreatedException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 
+from profile_snapshot import cert_rules
+
+LOG = logging.getLogger("fapbot")
+
 
 # Configurações do browser (apenas o que é de navegador)
 PROFILE_DIR_OVERRIDE: Optional[str] = "Pessoal"
@@ -14,6 +19,137 @@ KEEP_OPEN = True
 # Anexar no Brave já aberto pelo ex_brave.bat
 ATTACH_DEBUGGER: Optional[str] = "127.0.0.1:9222"
 PROXY_URL: Optional[str] = None  # sem proxy
+# Modo leve: bloqueia imagens/fontes/analytics e desliga animações via CDP (ver cdp_utils)
+LIGHT_MODE = False
+# Log de performance do ChromeDriver (eventos Network.*): permite ler os status HTTP
+# das respostas do portal (cdp_utils.drain_http_statuses) para o limitador de taxa.
+# Só quem drena o log deve ligá-lo (o main passa capture_http=RATE_LIMIT_ENABLED): sem
+# leitura, os eventos se acumulam no chromedriver durante toda a varredura
+CAPTURE_HTTP_STATUS = True
+# Cache local de JS/CSS/fontes do portal via CDP Fetch (ver asset_cache); requer websocket-client
+ASSET_CACHE = False
+ASSET_CACHE_DIR = "cache_estatico"
+ASSET_CACHE_MAX_MB = 200
+# Início "morno": reaproveita a aba consultar-fap já aberta/autenticada (DevTools /json/list)
+# e mantém um chromedriver persistente na porta abaixo entre execuções (sem subir um
+# Service novo nem consultar o webdriver-manager a cada run)
+WARM_ATTACH = True
+CHROMEDRIVER_PORT = 9515
+CHROMEDRIVER_CACHE = ".chromedriver.json"   # caminho do chromedriver por versão do navegador
+CHROMEDRIVER_SERVICE_STATE = ".chromedriver_servico.json"  # binário/pid do chromedriver persistente
+# Servidor Linux (sem anexar): Chromium headless lançado pelo bot a partir de um snapshot
+# mínimo do perfil (ver profile_snapshot), copiado para uma pasta temporária a cada execução
+HEADLESS = sys.platform.startswith("linux")
+PROFILE_SNAPSHOT_DIR = os.environ.get("FAPBOT_PROFILE_SNAPSHOT") or "perfil_base"
+LINUX_BROWSERS = ("chromium", "chromium-browser", "google-chrome", "google-chrome-stable", "brave-browser")
+HEADLESS_WINDOW_SIZE = "1366,900"
+# Preset enxuto para navegadores lançados pelo bot (não afeta o Brave anexado): sem
+# extensões/GPU/tráfego de fundo/atualização de componentes, cache menor e poucos
+# processos de renderização. Medir com bench_footprint.py.
+LEAN_LAUNCH = True
+LEAN_DISK_CACHE_MB = 32
+LEAN_RENDERER_LIMIT = 2
+
+
+# Registro de perfis/certificados: cada perfil roda num Brave próprio, com sua porta de
+# debug e sua partição de saída (saida/<perfil>/). Perfis simultâneos precisam de
+# user-data-dir distintos (o Brave usa um único processo por user-data-dir).
+PROFILES: Dict[str, Dict] = {
+    "Pessoal": {
+        "profile_dir": "Pessoal",
+        "user_data_dir": None,          # None = pasta padrão do Brave
+        "debug_port": 9222,
+        "cert_issuer_cn": "AC SOLUTI Multipla v5",
+    },
+    # "Empresa": {
+    #     "profile_dir": "Default",
+    #     "user_data_dir": r"C:\BravePerfis\Empresa",
+    #     "debug_port": 9223,
+    #     "cert_issuer_cn": "AC SERASA RFB v5",
+    # },
+}
+OUTPUT_ROOT = "saida"
+
+# Hosts "pinnados" para IPs (mesmos do ex_brave.bat / brave-pinned.ps1)
+BIND_DEST_IPS: Dict[str, str] = {
+    "sso.acesso.gov.br": "161.148.168.40",
+    "fap.dataprev.gov.br": "200.152.35.17",
+}
+
+
+def get_profile(name: str) -> Dict:
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise RuntimeError(f"Perfil '{name}' não está em PROFILES (browser_config.py). Disponíveis: {', '.join(PROFILES)}")
+
+
+def profile_debugger(profile: Dict) -> str:
+    return f"127.0.0.1:{profile['debug_port']}"
+
+
+def profile_output_dir(name: str) -> Path:
+    out = Path(OUTPUT_ROOT) / name
+    out.mkdir(parents=True, exist_ok=True)
+    return out
+
+
+def _auto_select_cert_arg(cert_issuer_cn: str) -> str:
+    return "--auto-select-certificate-for-urls=" + json.dumps(cert_rules(cert_issuer_cn), separators=(",", ":"))
+
+
+def host_resolver_arg(host_ip_map: Dict[str, str]) -> str:
+    rules = ",".join([f"MAP {h} {ip}" for h, ip in host_ip_map.items()] + ["EXCLUDE localhost"])
+    return f"--host-resolver-rules={rules}"
+
+
+def lean_args(disk_cache_mb: int = LEAN_DISK_CACHE_MB, renderer_limit: int = LEAN_RENDERER_LIMIT) -> List[str]:
+    """Argumentos do preset enxuto (LEAN_LAUNCH)."""
+    return [
+        "--disable-extensions",
+        "--disable-gpu",
+        "--disable-background-networking",
+        "--disable-component-update",
+        "--disable-sync",
+        "--disable-default-apps",
+        "--no-first-run",
+        "--no-default-browser-check",
+        "--mute-audio",
+        "--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication",
+        f"--disk-cache-size={disk_cache_mb * 1024 * 1024}",
+        f"--renderer-process-limit={renderer_limit}",
+    ]
+
+
+def wait_devtools(addr: str, timeout: float = 60.0) -> bool:
+    """Espera o DevTools responder em `addr` (True se ficou pronto dentro do prazo)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if _devtools_ready(addr, timeout=2.0):
+            return True
+        time.sleep(1.0)
+    return False
+
+
+def launch_brave_profile(profile: Dict, host_ip_map: Optional[Dict[str, str]] = None,
+                         extra_args: Optional[List[str]] = None) -> Optional[subprocess.Popen]:
+    """Abre o Brave do perfil com DevTools na porta dele (como o ex_brave.bat); None se já estiver no ar."""
+    addr = profile_debugger(profile)
+    if _devtools_ready(addr, timeout=1.0):
+        return None
+    args = [
+        brave_path(),
+        f"--remote-debugging-port={profile['debug_port']}",
+        f"--user-data-dir={profile.get('user_data_dir') or brave_user_data_dir()}",
+        f"--profile-directory={profile.get('profile_dir') or 'Default'}",
+        "--disable-popup-blocking",
+    ]
+    if host_ip_map:
+        args.append(host_resolver_arg(host_ip_map))
+    if profile.get("cert_issuer_cn"):
+        args.append(_auto_select_cert_arg(profile["cert_issuer_cn"]))
+    args += list(extra_args or [])
+    return subprocess.Popen(args)
 
 
 def brave_path() -> str:
@@ -30,6 +166,38 @@ def brave_user_data_dir() -> Path:
     return Path(os.getenv("LOCALAPPDATA", "")) / "BraveSoftware" / "Brave-Browser" / "User Data"
 
 
+def linux_browser_path() -> str:
+    """Chromium/Chrome/Brave do PATH (FAPBOT_BROWSER tem prioridade)."""
+    env = os.environ.get("FAPBOT_BROWSER")
+    if env:
+        return env
+    for name in LINUX_BROWSERS:
+        p = shutil.which(name)
+        if p:
+            return p
+    raise RuntimeError(f"Nenhum navegador encontrado no PATH ({', '.join(LINUX_BROWSERS)}); defina FAPBOT_BROWSER")
+
+
+def _headless_options(opts: Options, snapshot_dir: str, cert_issuer_cn: Optional[str]) -> str:
+    """Chromium headless sobre uma cópia descartável do snapshot; devolve a pasta da cópia."""
+    from profile_snapshot import copy_snapshot, read_manifest, SNAPSHOT_PROFILE
+
+    work = copy_snapshot(snapshot_dir)
+    opts.binary_location = linux_browser_path()
+    opts.add_argument("--headless=new")
+    opts.add_argument(f"--user-data-dir={work}")
+    opts.add_argument(f"--profile-directory={SNAPSHOT_PROFILE}")
+    opts.add_argument("--password-store=basic")     # mesma chave dos cookies do snapshot
+    opts.add_argument(f"--window-size={HEADLESS_WINDOW_SIZE}")
+    opts.add_argument("--disable-dev-shm-usage")     # /dev/shm pequeno em contêiner
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        opts.add_argument("--no-sandbox")
+    cn = cert_issuer_cn or read_manifest(snapshot_dir).get("cert_issuer_cn")
+    if cn:
+        opts.add_argument(_auto_select_cert_arg(cn))
+    return work
+
+
 def _devtools_ready(addr: str, timeout: float = 5.0) -> bool:
     try:
         with urllib.request.urlopen(f"http://{addr}/json/version", timeout=timeout) as r:
@@ -39,13 +207,185 @@ def _devtools_ready(addr: str, timeout: float = 5.0) -> bool:
         return False
 
 
+def _devtools_json(addr: str, path: str, timeout: float = 2.0):
+    with urllib.request.urlopen(f"http://{addr}{path}", timeout=timeout) as r:
+        return json.loads(r.read().decode("utf-8", "ignore"))
+
+
+def find_tab(addr: str, url_part: str) -> Optional[Dict]:
+    """Primeira aba (type=page) do DevTools cuja URL contém `url_part`, ou None."""
+    try:
+        targets = _devtools_json(addr, "/json/list")
+    except Exception:
+        return None
+    for t in targets:
+        if t.get("type") == "page" and url_part in (t.get("url") or ""):
+            return t
+    return None
+
+
+def _browser_major(addr: Optional[str]) -> str:
+    """Versão principal do navegador anexado ('Chrome/141.0...' -> '141'); '' se desconhecida."""
+    if not addr:
+        return ""
+    try:
+        return _devtools_json(addr, "/json/version").get("Browser", "").split("/")[-1].split(".")[0]
+    except Exception:
+        return ""
+
+
+def _binary_major(binary: Optional[str]) -> str:
+    """Versão principal de um executável pelo `--version` ('Chromium 141.0.7390.54' -> '141'); '' se não der."""
+    # no Windows o --version abre uma janela em vez de imprimir: fica a renovação por SessionNotCreated
+    if not binary or sys.platform == "win32":
+        return ""
+    try:
+        out = subprocess.run([binary, "--version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return ""
+    for tok in out.split():
+        if tok[:1].isdigit() and "." in tok:
+            return tok.split(".")[0]
+    return ""
+
+
+def chromedriver_path(browser_major: str = "", refresh: bool = False) -> str:
+    """
+    Caminho do chromedriver, lembrado por versão principal do navegador em CHROMEDRIVER_CACHE:
+    o webdriver-manager (que consulta a rede) só roda quando a versão muda (ou com `refresh`,
+    quando o chromedriver lembrado não abriu sessão).
+    """
+    cache = {}
+    try:
+        with open(CHROMEDRIVER_CACHE, encoding="utf-8") as f:
+            cache = json.load(f)
+    except Exception:
+        pass
+    key = browser_major or "padrao"
+    path = cache.get(key)
+    if path and os.path.exists(path) and not refresh:
+        return path
+    path = ChromeDriverManager().install()
+    cache[key] = path
+    try:
+        with open(CHROMEDRIVER_CACHE, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=1)
+    except OSError:
+        pass
+    return path
+
+
+def _driver_service_ready(port: int, timeout: float = 1.0) -> bool:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=timeout) as r:
+            return bool(json.loads(r.read().decode("utf-8", "ignore")).get("value", {}).get("ready", True))
+    except Exception:
+        return False
+
+
+def _service_state() -> Dict:
+    try:
+        with open(CHROMEDRIVER_SERVICE_STATE, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def stop_driver_service(port: int = CHROMEDRIVER_PORT, timeout: float = 5.0):
+    """Derruba o chromedriver persistente em `port` (/shutdown; se não sair, mata o pid registrado)."""
+    try:
+        urllib.request.urlopen(f"http://127.0.0.1:{port}/shutdown", timeout=2.0).close()
+    except Exception:
+        pass
+    deadline = time.time() + timeout
+    while time.time() < deadline and _driver_service_ready(port, timeout=0.5):
+        time.sleep(0.1)
+    st = _service_state()
+    if _driver_service_ready(port, timeout=0.5) and st.get("port") == port and st.get("pid"):
+        try:
+            os.kill(st["pid"], 15)
+        except OSError:
+            pass
+
+
+def ensure_driver_service(driver_path: str, port: int = CHROMEDRIVER_PORT, timeout: float = 10.0) -> str:
+    """
+    Sobe o chromedriver persistente em `port` (destacado deste processo) se ainda não estiver no ar.
+    Se o que está no ar foi iniciado com outro binário (ou não se sabe qual), reinicia com `driver_path`.
+    """
+    url = f"http://127.0.0.1:{port}"
+    if _driver_service_ready(port):
+        st = _service_state()
+        if st.get("port") == port and st.get("path") == driver_path:
+            return url
+        LOG.info(f"chromedriver em {url} iniciado com '{st.get('path') or '?'}'; reiniciando com '{driver_path}'")
+        stop_driver_service(port)
+    kw = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "stdin": subprocess.DEVNULL}
+    if sys.platform == "win32":
+        kw["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kw["start_new_session"] = True
+    proc = subprocess.Popen([driver_path, f"--port={port}"], **kw)
+    try:
+        with open(CHROMEDRIVER_SERVICE_STATE, "w", encoding="utf-8") as f:
+            json.dump({"port": port, "path": driver_path, "pid": proc.pid}, f, indent=1)
+    except OSError:
+        pass
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if _driver_service_ready(port, timeout=0.5):
+            return url
+        time.sleep(0.1)
+    raise RuntimeError(f"chromedriver não respondeu em {url}")
+
+
+class PersistentChrome(webdriver.Remote):
+    """
+    Sessão no chromedriver persistente (ensure_driver_service). execute_cdp_cmd vem da
+    conexão Chromium; get_log é o mesmo do webdriver.Chrome (log de performance).
+    quit() numa sessão anexada (debuggerAddress) só encerra a sessão, não o navegador.
+    """
+
+    def get_log(self, log_type):
+        return self.execute("getLog", {"type": log_type})["value"]
+
+
+def adopt_tab(driver, addr: str, url_part: str) -> bool:
+    """Passa o driver para a aba já aberta em `url_part` (handle = targetId do DevTools)."""
+    tab = find_tab(addr, url_part)
+    if not tab:
+        return False
+    try:
+        if driver.current_window_handle != tab["id"]:
+            driver.switch_to.window(tab["id"])
+        return True
+    except Exception:
+        return False
+
+
 def start_brave_with_active_profile(
     host_ip_map: Optional[Dict[str, str]] = None,
     proxy_url: Optional[str] = None,
     keep_open: bool = True,
     attach_debugger: Optional[str] = None,
+    adopt_url: Optional[str] = None,
+    headless: bool = HEADLESS,
+    profile_snapshot: str = PROFILE_SNAPSHOT_DIR,
+    cert_issuer_cn: Optional[str] = None,
+    lean: bool = LEAN_LAUNCH,
+    capture_http: bool = CAPTURE_HTTP_STATUS,
 ) -> webdriver.Chrome:
+    """
+    Cria o driver (anexado ao DevTools ou abrindo um navegador novo). Com WARM_ATTACH e modo
+    anexado, usa o chromedriver persistente e, se `adopt_url` for dado, assume a aba que
+    já estiver nessa URL (o chamador decide se ainda precisa navegar).
+    Sem anexar e com `headless`, lança o Chromium headless sobre uma cópia do snapshot
+    `profile_snapshot`; a cópia fica em driver._fap_profile_copy (release_driver apaga).
+    Instâncias lançadas usam o preset enxuto (lean_args) se `lean`. `capture_http` liga o
+    log de performance (status HTTP para o limitador).
+    """
     opts = Options()
+    profile_copy = None
 
     if attach_debugger:
         if not _devtools_ready(attach_debugger, timeout=3.0):
@@ -54,19 +394,59 @@ def start_brave_with_active_profile(
             )
         opts.add_experimental_option("debuggerAddress", attach_debugger)
     else:
-        # Abre uma nova instância (não é o fluxo atual, mas deixo pronto)
-        opts.binary_location = brave_path()
-        user_data = str(brave_user_data_dir())
-        profile_dir = PROFILE_DIR_OVERRIDE or "Default"
-        opts.add_argument(f"--user-data-dir={user_data}")
-        opts.add_argument(f"--profile-directory={profile_dir}")
+        if headless:
+            profile_copy = _headless_options(opts, profile_snapshot, cert_issuer_cn)
+        else:
+            # Abre uma nova instância do Brave com o perfil do usuário (Windows)
+            opts.binary_location = brave_path()
+            user_data = str(brave_user_data_dir())
+            profile_dir = PROFILE_DIR_OVERRIDE or "Default"
+            opts.add_argument(f"--user-data-dir={user_data}")
+            opts.add_argument(f"--profile-directory={profile_dir}")
+        if lean:
+            for arg in lean_args():
+                opts.add_argument(arg)
         if host_ip_map:
-            rules = ",".join([f"MAP {h} {ip}" for h, ip in host_ip_map.items()] + ["EXCLUDE localhost"])
-            opts.add_argument(f"--host-resolver-rules={rules}")
+            opts.add_argument(host_resolver_arg(host_ip_map))
         if proxy_url:
             opts.add_argument(f"--proxy-server={proxy_url}")
 
+    if capture_http:
+        opts.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
     # Cria o driver conectando ao DevTools/Brave
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=opts)
+    system_driver = bool(profile_copy and shutil.which("chromedriver"))
+    if system_driver:
+        driver_path = shutil.which("chromedriver")  # o do pacote da distro acompanha o Chromium dela
+        major = ""
+    else:
+        # anexado: versão pelo DevTools; lançado: pelo --version do executável
+        major = _browser_major(attach_debugger) or _binary_major(opts.binary_location)
+        driver_path = chromedriver_path(major)
+    if WARM_ATTACH and attach_debugger:
+        try:
+            driver = PersistentChrome(command_executor=ensure_driver_service(driver_path), options=opts)
+        except SessionNotCreatedException:
+            # o Brave atualizou e o chromedriver persistente ficou para trás: baixa de novo e reinicia
+            stop_driver_service()
+            driver_path = chromedriver_path(major, refresh=True)
+            driver = PersistentChrome(command_executor=ensure_driver_service(driver_path), options=opts)
+        if adopt_url:
+            adopt_tab(driver, attach_debugger, adopt_url)
+        return driver
+    try:
+        try:
+            driver = webdriver.Chrome(service=Service(driver_path), options=opts)
+        except SessionNotCreatedException:
+            if system_driver:
+                raise
+            # chromedriver lembrado não serve mais para este navegador (atualizou): baixa de novo
+            driver_path = chromedriver_path(major, refresh=True)
+            driver = webdriver.Chrome(service=Service(driver_path), options=opts)
+    except Exception:
+        if profile_copy:
+            from profile_snapshot import discard_copy
+            discard_copy(profile_copy)
+        raise
+    driver._fap_profile_copy = profile_copy
     return driver
@@ -0,0 +1,274 @@
+import json
+import logging
+from typing import Iterable, Optional, Dict, List
+
+from asset_cache import ensure_fetch_sessions
+
+LOG = logging.getLogger("fapbot")
+
+
+# ===== Modo "página leve" (CDP) =====
+# Recursos não essenciais para a consulta: imagens, fontes e analytics do design system gov.br
+LIGHT_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*hotjar.com*", "*clarity.ms*", "*barra.sistema.gov.br*", "*vlibras.gov.br*",
+]
+
+# Zera transições/animações (dropdowns abrem/fecham instantaneamente)
+NO_ANIMATION_CSS = (
+    "*,*::before,*::after{"
+    "transition:none!important;transition-duration:0s!important;"
+    "animation:none!important;animation-duration:0s!important;"
+    "scroll-behavior:auto!important;caret-color:auto!important}"
+)
+
+_INJECT_CSS_JS = """
+(function(css){
+  function add(){
+    if (document.getElementById('fapbot-light-css')) return;
+    var s = document.createElement('style');
+    s.id = 'fapbot-light-css';
+    s.textContent = css;
+    (document.head || document.documentElement).appendChild(s);
+  }
+  if (document.readyState === 'loading') document.addEventListener('DOMContentLoaded', add); else add();
+})(%s);
+"""
+
+
+def _current_handle(driver) -> Optional[str]:
+    try:
+        return driver.current_window_handle
+    except Exception:
+        return None
+
+
+def enable_light_mode(driver, blocked_urls: Optional[Iterable[str]] = None, disable_animations: bool = True) -> bool:
+    """
+    Ativa o modo leve na aba atual: bloqueia URLs não essenciais (Network.setBlockedURLs)
+    e injeta CSS que desliga transições/animações (vale também para navegações futuras).
+    Os comandos CDP valem por aba; use ensure_light_mode() após trocar/criar abas.
+    """
+    urls = list(blocked_urls if blocked_urls is not None else LIGHT_BLOCKED_URLS)
+    ok = True
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": urls})
+    except Exception as e:
+        LOG.warning(f"Modo leve: falha ao bloquear URLs via CDP: {e}")
+        ok = False
+    if disable_animations:
+        js = _INJECT_CSS_JS % json.dumps(NO_ANIMATION_CSS)
+        try:
+            driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": js})
+        except Exception as e:
+            LOG.warning(f"Modo leve: falha ao registrar CSS via CDP: {e}")
+            ok = False
+        try:
+            driver.execute_script(js)  # documento já carregado
+        except Exception:
+            pass
+    # guarda a configuração no driver para reaplicar em novas abas
+    driver._fap_light_mode = {"urls": urls, "disable_animations": disable_animations}
+    applied = getattr(driver, "_fap_light_handles", set())
+    h = _current_handle(driver)
+    if h:
+        applied.add(h)
+    driver._fap_light_handles = applied
+    if ok:
+        LOG.info(f"Modo leve ativo ({len(urls)} padrões bloqueados, animações {'off' if disable_animations else 'on'}).")
+    return ok
+
+
+def ensure_light_mode(driver) -> bool:
+    """Reaplica o modo leve na aba atual se ele estiver ativo e ainda não aplicado nela."""
+    cfg = getattr(driver, "_fap_light_mode", None)
+    if not cfg:
+        return False
+    h = _current_handle(driver)
+    if h and h in getattr(driver, "_fap_light_handles", set()):
+        return True
+    return enable_light_mode(driver, cfg["urls"], cfg["disable_animations"])
+
+
+def navigation_timing(driver) -> Dict[str, float]:
+    """Métricas da última navegação (Navigation Timing): tempo total, DOM pronto e bytes/recursos."""
+    try:
+        return driver.execute_script("""
+            const n = performance.getEntriesByType('navigation')[0];
+            const res = performance.getEntriesByType('resource');
+            let bytes = 0;
+            for (const r of res) bytes += (r.transferSize || 0);
+            return {
+              load_ms: n ? Math.round(n.loadEventEnd - n.startTime) : -1,
+              dom_ms: n ? Math.round(n.domContentLoadedEventEnd - n.startTime) : -1,
+              resources: res.length,
+              kb: Math.round((bytes + (n ? n.transferSize || 0 : 0)) / 1024),
+            };
+        """) or {}
+    except Exception:
+        return {}
+
+
+# ===== Status HTTP (log de performance do ChromeDriver) =====
+PORTAL_HOSTS = ("dataprev.gov.br",)
+
+
+def drain_http_statuses(driver, hosts: Iterable[str] = PORTAL_HOSTS) -> List[int]:
+    """
+    Esvazia o log de performance e devolve os status HTTP das respostas dos `hosts`.
+    Requer browser_config.CAPTURE_HTTP_STATUS (capability goog:loggingPrefs); sem ela retorna [].
+    """
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return []
+    out = []
+    for e in entries:
+        try:
+            msg = json.loads(e["message"])["message"]
+            if msg.get("method") != "Network.responseReceived":
+                continue
+            resp = msg["params"]["response"]
+            if any(h in resp.get("url", "") for h in hosts):
+                out.append(int(resp.get("status") or 0))
+        except Exception:
+            continue
+    return out
+
+
+# ===== Métricas de memória e reciclagem de aba =====
+def tab_metrics(driver) -> Dict[str, float]:
+    """Métricas da aba atual via Performance.getMetrics (JSHeapUsedSize, Nodes, ...)."""
+    try:
+        h = _current_handle(driver)
+        enabled = getattr(driver, "_fap_perf_enabled", set())
+        if h not in enabled:
+            driver.execute_cdp_cmd("Performance.enable", {})
+            enabled.add(h)
+            driver._fap_perf_enabled = enabled
+        res = driver.execute_cdp_cmd("Performance.getMetrics", {}) or {}
+        return {m["name"]: m["value"] for m in res.get("metrics", [])}
+    except Exception:
+        return {}
+
+
+def browser_rss_mb(debugger_addr: Optional[str]) -> float:
+    """
+    RSS somado (MB) do processo do navegador com --remote-debugging-port=<porta> e filhos.
+    Requer psutil (opcional); sem ele retorna 0.
+    """
+    if not debugger_addr:
+        return 0.0
+    try:
+        import psutil
+    except ImportError:
+        return 0.0
+    port = debugger_addr.rsplit(":", 1)[-1]
+    flag = f"--remote-debugging-port={port}"
+    total = 0
+    for p in psutil.process_iter(["cmdline"]):
+        try:
+            if flag in (p.info.get("cmdline") or []):
+                total += p.memory_info().rss
+                for c in p.children(recursive=True):
+                    try:
+                        total += c.memory_info().rss
+                    except Exception:
+                        pass
+                break
+        except Exception:
+            continue
+    return total / (1024 * 1024)
+
+
+def recycle_tab(driver, url: str, restore=None) -> bool:
+    """
+    Troca a aba atual por uma nova: abre aba, navega para `url`, chama restore(driver)
+    para refazer o contexto (vigência/CNPJ) e só então fecha a aba antiga.
+    """
+    old = _current_handle(driver)
+    try:
+        driver.switch_to.new_window("tab")
+    except Exception:
+        try:
+            driver.execute_script("window.open('about:blank','_blank');")
+            driver.switch_to.window(driver.window_handles[-1])
+        except Exception as e:
+            LOG.warning(f"Reciclagem: não foi possível abrir nova aba: {e}")
+            return False
+    new = _current_handle(driver)
+    ensure_light_mode(driver)
+    ensure_fetch_sessions(driver)
+    try:
+        driver.get(url)
+        if restore:
+            restore(driver)
+    except Exception as e:
+        # falhou no meio: volta para a aba antiga e descarta a nova
+        LOG.warning(f"Reciclagem: falha ao preparar nova aba ({e}); mantendo a aba atual.")
+        try:
+            driver.close()
+            driver.switch_to.window(old)
+        except Exception:
+            pass
+        return False
+    if old and old != new:
+        try:
+            driver.switch_to.window(old)
+            driver.close()
+        except Exception:
+            pass
+        driver.switch_to.window(new)
+    return True
+
+
+class TabWatchdog:
+    """
+    Amostra heap JS da aba (Performance.getMetrics) e RSS do navegador a cada
+    `every` itens; quando um limite é ultrapassado, recicla a aba entre itens.
+    """
+
+    def __init__(self, heap_limit_mb: float = 512, rss_limit_mb: float = 3072,
+                 every: int = 10, debugger_addr: Optional[str] = None):
+        self.heap_limit_mb = heap_limit_mb
+        self.rss_limit_mb = rss_limit_mb
+        self.every = max(1, int(every))
+        self.debugger_addr = debugger_addr
+        self.items = 0
+        self.recycles = 0
+        self.last: Dict[str, float] = {}
+
+    def sample(self, driver) -> Dict[str, float]:
+        m = tab_metrics(driver)
+        self.last = {
+            "heap_mb": m.get("JSHeapUsedSize", 0.0) / (1024 * 1024),
+            "nodes": m.get("Nodes", 0.0),
+            "listeners": m.get("JSEventListeners", 0.0),
+            "rss_mb": browser_rss_mb(self.debugger_addr),
+        }
+        return self.last
+
+    def over_limit(self, driver) -> bool:
+        s = self.sample(driver)
+        LOG.debug(f"Watchdog: heap={s['heap_mb']:.0f}MB nodes={s['nodes']:.0f} rss={s['rss_mb']:.0f}MB")
+        return (self.heap_limit_mb and s["heap_mb"] > self.heap_limit_mb) or \
+               (self.rss_limit_mb and s["rss_mb"] > self.rss_limit_mb)
+
+    def tick(self, driver, url: str, restore=None) -> bool:
+        """Chamar entre itens de trabalho; retorna True se reciclou a aba."""
+        self.items += 1
+        if self.items % self.every:
+            return False
+        if not self.over_limit(driver):
+            return False
+        s = self.last
+        LOG.info(f"Watchdog: heap={s['heap_mb']:.0f}MB rss={s['rss_mb']:.0f}MB acima do limite; reciclando aba...")
+        if recycle_tab(driver, url, restore):
+            self.recycles += 1
+            after = self.sample(driver)
+            LOG.info(f"Watchdog: aba reciclada (#{self.recycles}); heap agora {after['heap_mb']:.0f}MB")
+            return True
+        return False
@@ -0,0 +1,593 @@
+"""
+Coordenador de varredura distribuída (sem broker externo).
+
+O coordenador guarda uma fila de (vigência, CNPJ raiz) em SQLite e a expõe por HTTP;
+workers (cada um com seu navegador/certificado) pegam "leases" com prazo, rodam a
+mesma lógica de consultar_para_todos para aquele CNPJ e devolvem as linhas, que vão
+para o histórico central (store_utils). Lease vencido (worker morto) volta para a fila.
+
+    py coordinator.py servir --porta 8765                     # só 127.0.0.1
+    FAPBOT_COORD_TOKEN=segredo py coordinator.py servir --host 0.0.0.0
+    py coordinator.py descobrir --url http://host:8765 --debugger 127.0.0.1:9222 --vigencias 2025 2026
+    py coordinator.py worker --url http://host:8765 --debugger 127.0.0.1:9222
+    py coordinator.py local --debuggers 127.0.0.1:9222 127.0.0.1:9223 --vigencias 2025 2026
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import socket
+import logging
+import argparse
+import threading
+import subprocess
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from store_utils import open_store, start_run, save_rows, export_latest, DEFAULT_DB_PATH
+from scheduler import load_estab_counts, estimate_costs, load_priorities, raiz_digits
+from rate_limit import AdaptiveRateLimiter
+from metrics import SweepMetrics, serve_metrics, DEFAULT_PORT as METRICS_DEFAULT_PORT
+
+LOG = logging.getLogger("fapbot.coord")
+
+DEFAULT_PORT = 8765
+LEASE_TTL = 600.0        # s sem heartbeat até o lease voltar para a fila
+HEARTBEAT_EVERY = 60.0   # s entre heartbeats do worker
+MAX_ATTEMPTS = 3         # tentativas por item antes de marcar como falhou
+# Segredo compartilhado entre coordenador e workers (cabeçalho X-Fapbot-Token); vazio = sem checagem
+TOKEN_ENV = "FAPBOT_COORD_TOKEN"
+TOKEN_HEADER = "X-Fapbot-Token"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fila (
+    vigencia   TEXT NOT NULL,
+    cnpj       TEXT NOT NULL,
+    prioridade INTEGER NOT NULL DEFAULT 0,
+    custo      REAL NOT NULL DEFAULT 0,
+    status     TEXT NOT NULL DEFAULT 'pendente',   -- pendente | alocado | concluido | falhou
+    worker     TEXT,
+    lease_id   TEXT,
+    lease_ate  REAL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    linhas     INTEGER,
+    erro       TEXT,
+    PRIMARY KEY (vigencia, cnpj)
+);
+CREATE INDEX IF NOT EXISTS idx_fila_status ON fila(status, prioridade, custo);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_fila_lease ON fila(lease_id);
+CREATE TABLE IF NOT EXISTS fila_meta (chave TEXT PRIMARY KEY, valor TEXT);
+"""
+
+
+class WorkQueue:
+    """Fila de trabalho com leases (thread-safe; um único processo coordenador)."""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, lease_ttl: float = LEASE_TTL, max_attempts: int = MAX_ATTEMPTS,
+                 priorities: Optional[Dict[str, int]] = None, report_path: Optional[str] = None,
+                 resume: bool = False):
+        self.lease_ttl = lease_ttl
+        self.report_path = report_path  # regravado quando um grupo de prioridade termina
+        self.max_attempts = max_attempts
+        self.priorities = priorities or {}
+        self.conn = open_store(db_path)
+        cols = {r[1] for r in self.conn.execute("PRAGMA table_info(fila)")}
+        if cols and "custo" not in cols:
+            # filas criadas antes do agendamento por custo
+            self.conn.execute("ALTER TABLE fila ADD COLUMN custo REAL NOT NULL DEFAULT 0")
+        self.conn.executescript(_SCHEMA)
+        if not resume:
+            # nova execução: a fila (e o 'fechada') da anterior não vale mais
+            with self.conn:
+                self.conn.execute("DELETE FROM fila")
+                self.conn.execute("DELETE FROM fila_meta")
+        self.run_id = start_run(self.conn, origem="coordenador")
+        self.lock = threading.Lock()
+        self.workers: Dict[str, float] = {}  # worker -> último contato
+        # Um limitador para todos os workers: o portal vê a soma das consultas
+        self.limiter = AdaptiveRateLimiter()
+
+    # ---- fila ----
+    def enqueue(self, items: List[Dict], close: bool = False) -> int:
+        """
+        Acrescenta itens {vigencia, cnpj[, prioridade]}; repetidos são ignorados.
+        O custo (LPT) vem do nº de estabelecimentos no histórico; a prioridade, do
+        item ou do arquivo de prioridades do coordenador.
+        """
+        with self.lock, self.conn:
+            params = []
+            for vig in {str(i["vigencia"]) for i in items}:
+                batch = [i for i in items if str(i["vigencia"]) == vig]
+                costs = estimate_costs([i["cnpj"] for i in batch], load_estab_counts(self.conn, vig))
+                for i in batch:
+                    prio = int(i.get("prioridade") or self.priorities.get(raiz_digits(i["cnpj"]), 0))
+                    params.append((vig, i["cnpj"], prio, costs[i["cnpj"]]))
+            cur = self.conn.executemany(
+                "INSERT OR IGNORE INTO fila (vigencia, cnpj, prioridade, custo) VALUES (?, ?, ?, ?)",
+                params,
+            )
+            if close:
+                self.conn.execute("INSERT OR REPLACE INTO fila_meta VALUES ('fechada', '1')")
+            return cur.rowcount
+
+    def close(self):
+        """Sinaliza que não haverá mais itens (workers podem encerrar quando a fila esvaziar)."""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO fila_meta VALUES ('fechada', '1')")
+
+    def _reap(self, now: float):
+        # leases vencidos: volta para pendente (ou falhou, se estourou as tentativas)
+        expired = self.conn.execute(
+            "SELECT vigencia, cnpj, worker, tentativas FROM fila WHERE status='alocado' AND lease_ate < ?", (now,)
+        ).fetchall()
+        for r in expired:
+            LOG.warning(f"Lease vencido: [{r['vigencia']}] {r['cnpj']} (worker {r['worker']}); reatribuindo.")
+        self.conn.execute(
+            """
+            UPDATE fila SET status = CASE WHEN tentativas >= ? THEN 'falhou' ELSE 'pendente' END,
+                            erro = COALESCE(erro, 'lease expirado'), lease_id = NULL, worker = NULL
+            WHERE status='alocado' AND lease_ate < ?
+            """,
+            (self.max_attempts, now),
+        )
+
+    def lease(self, worker: str) -> Optional[Dict]:
+        now = time.time()
+        with self.lock, self.conn:
+            self.workers[worker] = now
+            self._reap(now)
+            r = self.conn.execute(
+                """
+                SELECT vigencia, cnpj FROM fila WHERE status='pendente'
+                ORDER BY prioridade DESC, custo DESC, vigencia, rowid LIMIT 1
+                """
+            ).fetchone()
+            if not r:
+                return None
+            lease_id = uuid.uuid4().hex
+            self.conn.execute(
+                """
+                UPDATE fila SET status='alocado', worker=?, lease_id=?, lease_ate=?, tentativas=tentativas+1
+                WHERE vigencia=? AND cnpj=?
+                """,
+                (worker, lease_id, now + self.lease_ttl, r["vigencia"], r["cnpj"]),
+            )
+        LOG.info(f"Lease {lease_id[:8]} -> {worker}: [{r['vigencia']}] {r['cnpj']}")
+        return {"lease_id": lease_id, "vigencia": r["vigencia"], "cnpj": r["cnpj"], "ttl": self.lease_ttl}
+
+    def heartbeat(self, lease_id: str, worker: str) -> bool:
+        now = time.time()
+        with self.lock, self.conn:
+            self.workers[worker] = now
+            cur = self.conn.execute(
+                "UPDATE fila SET lease_ate=? WHERE lease_id=? AND worker=? AND status='alocado'",
+                (now + self.lease_ttl, lease_id, worker),
+            )
+            return cur.rowcount > 0
+
+    def complete(self, lease_id: str, worker: str, rows: List[Dict]) -> bool:
+        with self.lock:
+            self.workers[worker] = time.time()
+            owned = self.conn.execute(
+                "SELECT 1 FROM fila WHERE lease_id=? AND worker=?", (lease_id, worker)
+            ).fetchone() is not None
+            if not owned:
+                # lease foi reatribuído; as linhas continuam válidas e vão para o histórico
+                LOG.warning(f"complete de lease reatribuído ({worker}); gravando linhas mesmo assim.")
+            if rows:
+                save_rows(self.conn, self.run_id, rows)
+            prio = self.conn.execute("SELECT prioridade FROM fila WHERE lease_id=?", (lease_id,)).fetchone()
+            with self.conn:
+                cur = self.conn.execute(
+                    "UPDATE fila SET status='concluido', linhas=?, lease_id=NULL, erro=NULL WHERE lease_id=? AND worker=?",
+                    (len(rows), lease_id, worker),
+                )
+            if prio and prio[0] > 0 and cur.rowcount:
+                self._maybe_publish_priority(prio[0])
+        return cur.rowcount > 0
+
+    def _maybe_publish_priority(self, level: int):
+        # grupo de prioridade concluído: publica o relatório já, sem esperar o restante
+        left = self.conn.execute(
+            "SELECT COUNT(*) FROM fila WHERE prioridade=? AND status IN ('pendente', 'alocado')", (level,)
+        ).fetchone()[0]
+        if left:
+            return
+        LOG.info(f"Prioridade {level} concluída.")
+        if self.report_path:
+            n = export_latest(self.conn, self.report_path)
+            LOG.info(f"Relatório parcial publicado: {self.report_path} ({n} linhas)")
+
+    def fail(self, lease_id: str, worker: str, erro: str) -> bool:
+        with self.lock, self.conn:
+            self.workers[worker] = time.time()
+            cur = self.conn.execute(
+                """
+                UPDATE fila SET status = CASE WHEN tentativas >= ? THEN 'falhou' ELSE 'pendente' END,
+                                erro=?, lease_id=NULL, worker=NULL
+                WHERE lease_id=? AND worker=?
+                """,
+                (self.max_attempts, erro[:500], lease_id, worker),
+            )
+        LOG.warning(f"Falha reportada por {worker}: {erro[:200]}")
+        return cur.rowcount > 0
+
+    def release(self, lease_id: str, worker: str, motivo: str = "") -> bool:
+        """Devolve o item à fila sem contar a tentativa (o problema é do worker, não do CNPJ)."""
+        with self.lock, self.conn:
+            self.workers[worker] = time.time()
+            cur = self.conn.execute(
+                """
+                UPDATE fila SET status='pendente', tentativas=MAX(tentativas - 1, 0), lease_id=NULL, worker=NULL
+                WHERE lease_id=? AND worker=? AND status='alocado'
+                """,
+                (lease_id, worker),
+            )
+        LOG.warning(f"Lease devolvido por {worker}: {motivo[:200]}")
+        return cur.rowcount > 0
+
+    def status(self) -> Dict:
+        with self.lock:
+            self._reap(time.time())
+            self.conn.commit()
+            counts = {r[0]: r[1] for r in self.conn.execute("SELECT status, COUNT(*) FROM fila GROUP BY status")}
+            closed = self.conn.execute("SELECT valor FROM fila_meta WHERE chave='fechada'").fetchone() is not None
+        open_items = counts.get("pendente", 0) + counts.get("alocado", 0)
+        return {
+            "run_id": self.run_id,
+            "contagem": counts,
+            "fechada": closed,
+            "finalizado": closed and open_items == 0,
+            "workers": {w: round(time.time() - t, 1) for w, t in self.workers.items()},
+            "limitador": self.limiter.stats(),
+        }
+
+
+# -----------------------------------------------------------------------------
+# Servidor HTTP (JSON)
+# -----------------------------------------------------------------------------
+def _make_handler(queue: WorkQueue, token: Optional[str] = None):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            LOG.debug("http: " + fmt % args)
+
+        def _authorized(self) -> bool:
+            if not token or hmac.compare_digest(self.headers.get(TOKEN_HEADER) or "", token):
+                return True
+            LOG.warning(f"Requisição sem token válido de {self.client_address[0]} ({self.path})")
+            self._send(401, {"erro": "token inválido"})
+            return False
+
+        def _send(self, code: int, obj=None):
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8") if obj is not None else b""
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            if self.path.rstrip("/") == "/status":
+                return self._send(200, queue.status())
+            self._send(404, {"erro": "rota desconhecida"})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            try:
+                n = int(self.headers.get("Content-Length") or 0)
+                data = json.loads(self.rfile.read(n).decode("utf-8") or "{}")
+                route = self.path.rstrip("/")
+                if route == "/lease":
+                    lease = queue.lease(data["worker"])
+                    return self._send(200, lease or {})
+                if route == "/heartbeat":
+                    return self._send(200, {"ok": queue.heartbeat(data["lease_id"], data["worker"])})
+                if route == "/complete":
+                    return self._send(200, {"ok": queue.complete(data["lease_id"], data["worker"], data.get("rows") or [])})
+                if route == "/fail":
+                    return self._send(200, {"ok": queue.fail(data["lease_id"], data["worker"], data.get("erro") or "")})
+                if route == "/release":
+                    return self._send(200, {"ok": queue.release(data["lease_id"], data["worker"], data.get("motivo") or "")})
+                if route == "/token":
+                    return self._send(200, {"espera": queue.limiter.reserve()})
+                if route == "/feedback":
+                    queue.limiter.report(float(data.get("latencia") or 0.0), data.get("http") or [],
+                                         bool(data.get("captcha")))
+                    return self._send(200, {"ok": True})
+                if route == "/enqueue":
+                    n = queue.enqueue(data.get("items") or [], close=bool(data.get("fechar")))
+                    return self._send(200, {"novos": n})
+                if route == "/close":
+                    queue.close()
+                    return self._send(200, {"ok": True})
+                self._send(404, {"erro": "rota desconhecida"})
+            except Exception as e:
+                LOG.exception("Erro no coordenador")
+                self._send(500, {"erro": str(e)})
+
+    return Handler
+
+
+def serve(db_path: str = DEFAULT_DB_PATH, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+          lease_ttl: float = LEASE_TTL, priorities: Optional[Dict[str, int]] = None,
+          report_path: Optional[str] = None, token: Optional[str] = None,
+          resume: bool = False) -> ThreadingHTTPServer:
+    """
+    Sobe o coordenador numa thread e retorna o servidor (server.queue = WorkQueue).
+    `token` (padrão: $FAPBOT_COORD_TOKEN) é exigido de todas as requisições.
+    """
+    token = token if token is not None else os.environ.get(TOKEN_ENV) or None
+    if not token and host not in ("127.0.0.1", "localhost", "::1"):
+        LOG.warning(f"Coordenador exposto em {host} sem token ({TOKEN_ENV}): qualquer um na rede pode usar a fila.")
+    queue = WorkQueue(db_path, lease_ttl=lease_ttl, priorities=priorities, report_path=report_path, resume=resume)
+    httpd = ThreadingHTTPServer((host, port), _make_handler(queue, token))
+    httpd.queue = queue
+    threading.Thread(target=httpd.serve_forever, name="coordinator", daemon=True).start()
+    LOG.info(f"Coordenador em http://{host}:{port} (db={db_path}, run_id={queue.run_id})")
+    return httpd
+
+
+# -----------------------------------------------------------------------------
+# Cliente (workers)
+# -----------------------------------------------------------------------------
+def _call(url: str, route: str, payload: Optional[Dict] = None, timeout: float = 30.0) -> Dict:
+    headers = {TOKEN_HEADER: os.environ[TOKEN_ENV]} if os.environ.get(TOKEN_ENV) else {}
+    if payload is None:
+        req = urllib.request.Request(url.rstrip("/") + route, headers=headers)
+    else:
+        req = urllib.request.Request(
+            url.rstrip("/") + route,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json", **headers},
+        )
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        return json.loads(r.read().decode("utf-8") or "{}")
+
+
+class RemoteRateLimiter:
+    """Mesma interface do AdaptiveRateLimiter, mas o balde fica no coordenador (compartilhado)."""
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def acquire(self) -> float:
+        try:
+            wait = float(_call(self.url, "/token", {}).get("espera") or 0.0)
+        except Exception as e:
+            LOG.warning(f"Limitador remoto inacessível ({e}); seguindo sem espera.")
+            return 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def report(self, latency: float, http_statuses=(), captcha: bool = False):
+        try:
+            _call(self.url, "/feedback", {"latencia": latency, "http": list(http_statuses), "captcha": captcha})
+        except Exception as e:
+            LOG.warning(f"Falha ao enviar feedback ao limitador: {e}")
+
+
+def _heartbeat_loop(url: str, lease_id: str, worker: str, stop: threading.Event, every: float):
+    while not stop.wait(every):
+        try:
+            _call(url, "/heartbeat", {"lease_id": lease_id, "worker": worker})
+        except Exception as e:
+            LOG.warning(f"Heartbeat falhou: {e}")
+
+
+def discover(url: str, debugger: str, vigencias: List[str], close: bool = True) -> int:
+    """Coleta os CNPJs de cada vigência com um navegador e enfileira no coordenador (em lotes)."""
+    import main as bot
+    driver = bot.prepare_driver(debugger)
+    total = 0
+    for ano in vigencias:
+        # enfileira cada lote assim que é descoberto: os workers começam antes do fim da varredura
+        for batch in bot.iter_cnpj_batches_ano(driver, str(ano)):
+            res = _call(url, "/enqueue", {"items": [{"vigencia": str(ano), "cnpj": c} for c in batch]})
+            total += res.get("novos", 0)
+    bot.release_driver(driver, debugger)
+    if close:
+        _call(url, "/close", {})
+    LOG.info(f"Descoberta concluída: {total} itens enfileirados.")
+    return total
+
+
+def _call_retry(url: str, route: str, payload: Dict, tries: int = 5, wait: float = 5.0) -> Optional[Dict]:
+    """_call com novas tentativas (coordenador fora do ar por instantes); None se todas falharem."""
+    for attempt in range(tries):
+        try:
+            return _call(url, route, payload)
+        except Exception as e:
+            LOG.warning(f"{route} falhou ({e}); tentativa {attempt + 1}/{tries}")
+            if attempt + 1 < tries:
+                time.sleep(wait)
+    return None
+
+
+def run_worker(url: str, debugger: str, worker_id: Optional[str] = None, poll: float = 5.0,
+               heartbeat_every: float = HEARTBEAT_EVERY) -> int:
+    """Loop do worker: pega lease, consulta o CNPJ, devolve linhas; encerra quando a fila finaliza."""
+    import main as bot
+    worker = worker_id or f"{socket.gethostname()}-{os.getpid()}-{debugger}"
+    driver = bot.prepare_driver(debugger)
+    limiter = RemoteRateLimiter(url) if bot.RATE_LIMIT_ENABLED else None
+    metrics = SweepMetrics() if bot.METRICS_PORT else None
+    metrics_httpd = serve_metrics(metrics, bot.METRICS_PORT) if metrics is not None else None
+    current_vig = None
+    done = 0
+    try:
+        while True:
+            try:
+                lease = _call(url, "/lease", {"worker": worker})
+                if not lease:
+                    if _call(url, "/status").get("finalizado"):
+                        break
+                    time.sleep(poll)
+                    continue
+            except Exception as e:
+                LOG.warning(f"Coordenador inacessível ({e}); tentando de novo em {poll}s")
+                time.sleep(poll)
+                continue
+
+            stop = threading.Event()
+            hb = threading.Thread(target=_heartbeat_loop, daemon=True,
+                                  args=(url, lease["lease_id"], worker, stop, min(heartbeat_every, lease["ttl"] / 3)))
+            hb.start()
+            ids = {"lease_id": lease["lease_id"], "worker": worker}
+            try:
+                # aba perdida/erro do portal: reabre a tela já na vigência do lease
+                if bot.ensure_form(driver, lease["vigencia"]):
+                    current_vig = lease["vigencia"]
+                if lease["vigencia"] != current_vig:
+                    bot.select_vigencia(driver, lease["vigencia"])
+                    current_vig = lease["vigencia"]
+                if metrics is not None:
+                    metrics.add_cnpjs(lease["vigencia"], 1)
+                rows = bot.consultar_cnpj(driver, lease["vigencia"], lease["cnpj"], limiter=limiter, metrics=metrics)
+            except Exception as e:
+                stop.set()
+                if isinstance(e, bot.PageStateError) and e.state in bot.SESSION_LOST:
+                    # sessão caiu (gov.br/captcha/aba): todo item falharia igual; devolve sem gastar tentativa e para
+                    LOG.error(f"Sessão perdida neste worker ({e}); devolvendo {lease['cnpj']} e encerrando. "
+                              "Refaça o login no navegador e suba o worker de novo.")
+                    _call_retry(url, "/release", {**ids, "motivo": str(e)}, tries=2, wait=poll)
+                    break
+                LOG.exception(f"Erro consultando {lease['cnpj']}")
+                _call_retry(url, "/fail", {**ids, "erro": repr(e)}, tries=2, wait=poll)
+                # estado da página é incerto: recarrega a tela e força nova seleção de vigência
+                current_vig = None
+                try:
+                    driver.get(bot.SSO_URL)
+                except Exception:
+                    pass
+                continue
+            finally:
+                stop.set()
+
+            # consulta feita: falha ao devolver é problema de rede, não do CNPJ (não vira /fail)
+            if rows is None:
+                _call_retry(url, "/fail", {**ids, "erro": "falha ao selecionar CNPJ"}, wait=poll)
+            elif _call_retry(url, "/complete", {**ids, "rows": rows}, wait=poll) is not None:
+                done += 1
+            else:
+                LOG.error(f"Não consegui entregar {len(rows)} linha(s) de {lease['cnpj']}; "
+                          "o lease vai vencer e o item será refeito.")
+    finally:
+        if metrics_httpd is not None:
+            metrics_httpd.shutdown()
+        bot.SELECTORS.save()
+        bot.SELECTORS.log_drift()
+        bot.release_driver(driver, debugger)
+    LOG.info(f"Worker {worker} encerrado: {done} itens concluídos.")
+    return done
+
+
+def run_local(debuggers: List[str], vigencias: List[str], db_path: str = DEFAULT_DB_PATH,
+              port: int = DEFAULT_PORT, export_path: Optional[str] = "relatorio_fap.xlsx",
+              priorities: Optional[Dict[str, int]] = None) -> Dict:
+    """Coordenador + descoberta + um processo worker por navegador, tudo nesta máquina."""
+    httpd = serve(db_path, host="127.0.0.1", port=port, priorities=priorities, report_path=export_path)
+    url = f"http://127.0.0.1:{port}"
+    me = [sys.executable, os.path.abspath(__file__)]
+
+    def worker(i: int) -> subprocess.Popen:
+        # cada worker com seu endpoint de métricas (9108, 9109, ...)
+        return subprocess.Popen(me + ["worker", "--url", url, "--debugger", debuggers[i]],
+                                env=dict(os.environ, FAPBOT_METRICS_PORT=str(METRICS_DEFAULT_PORT + i)))
+
+    try:
+        # os demais navegadores já consultam enquanto o primeiro descobre (a descoberta enfileira em lotes)
+        procs = [worker(i) for i in range(1, len(debuggers))]
+        disc = subprocess.run(me + ["descobrir", "--url", url, "--debugger", debuggers[0], "--vigencias", *vigencias])
+        if disc.returncode != 0:
+            # fecha a fila para os workers terminarem o que já foi enfileirado
+            LOG.error(f"Descoberta terminou com código {disc.returncode}; a fila fica com o que foi enfileirado.")
+            httpd.queue.close()
+        procs.append(worker(0))
+        for p in procs:
+            p.wait()
+        st = httpd.queue.status()
+        LOG.info(f"Varredura distribuída finalizada: {st['contagem']}")
+        if export_path:
+            n = export_latest(httpd.queue.conn, export_path)
+            LOG.info(f"Relatório gerado: {export_path} ({n} linhas)")
+        return st
+    finally:
+        httpd.shutdown()
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Coordenador/worker da varredura FAP distribuída")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("servir", help="sobe o coordenador")
+    p.add_argument("--db", default=DEFAULT_DB_PATH)
+    p.add_argument("--host", default="127.0.0.1", help="0.0.0.0 para aceitar workers de outras máquinas (use um token)")
+    p.add_argument("--porta", type=int, default=DEFAULT_PORT)
+    p.add_argument("--lease-ttl", type=float, default=LEASE_TTL)
+    p.add_argument("--prioridades", help="arquivo com CNPJs raiz prioritários (cnpj[;nível] por linha)")
+    p.add_argument("--relatorio", help="relatório publicado ao concluir cada grupo de prioridade")
+    p.add_argument("--token", help=f"segredo exigido dos workers (padrão: ${TOKEN_ENV})")
+    p.add_argument("--retomar", action="store_true", help="mantém a fila da execução anterior em vez de zerá-la")
+
+    p = sub.add_parser("descobrir", help="coleta CNPJs com um navegador e enfileira")
+    p.add_argument("--url", required=True)
+    p.add_argument("--debugger", default="127.0.0.1:9222")
+    p.add_argument("--vigencias", nargs="+", default=["2025", "2026"])
+
+    p = sub.add_parser("enfileirar", help="enfileira rótulos de CNPJ de um arquivo (um por linha)")
+    p.add_argument("--url", required=True)
+    p.add_argument("--arquivo", required=True)
+    p.add_argument("--vigencias", nargs="+", default=["2025", "2026"])
+
+    p = sub.add_parser("worker", help="processa leases usando o navegador indicado")
+    p.add_argument("--url", required=True)
+    p.add_argument("--debugger", default="127.0.0.1:9222")
+    p.add_argument("--id")
+
+    p = sub.add_parser("status", help="mostra o andamento da fila")
+    p.add_argument("--url", required=True)
+
+    p = sub.add_parser("local", help="coordenador + workers locais, um por navegador")
+    p.add_argument("--debuggers", nargs="+", required=True)
+    p.add_argument("--vigencias", nargs="+", default=["2025", "2026"])
+    p.add_argument("--db", default=DEFAULT_DB_PATH)
+    p.add_argument("--porta", type=int, default=DEFAULT_PORT)
+    p.add_argument("--prioridades")
+
+    args = ap.parse_args(argv)
+    if args.cmd in ("servir", "local"):
+        from log_utils import setup_logging
+        setup_logging("fapbot", log_path=os.path.join("logs", f"coord-{time.strftime('%Y%m%d_%H%M%S')}.log"))
+
+    if args.cmd == "servir":
+        httpd = serve(args.db, args.host, args.porta, args.lease_ttl, load_priorities(args.prioridades), args.relatorio,
+                      token=args.token, resume=args.retomar)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            httpd.shutdown()
+    elif args.cmd == "descobrir":
+        discover(args.url, args.debugger, args.vigencias)
+    elif args.cmd == "enfileirar":
+        with open(args.arquivo, encoding="utf-8-sig") as f:
+            cnpjs = [ln.strip() for ln in f if ln.strip()]
+        items = [{"vigencia": v, "cnpj": c} for v in args.vigencias for c in cnpjs]
+        print(_call(args.url, "/enqueue", {"items": items, "fechar": True}))
+    elif args.cmd == "worker":
+        run_worker(args.url, args.debugger, args.id)
+    elif args.cmd == "status":
+        print(json.dumps(_call(args.url, "/status"), ensure_ascii=False, indent=2))
+    elif args.cmd == "local":
+        run_local(args.debuggers, args.vigencias, args.db, args.porta, priorities=load_priorities(args.prioridades))
+
+
+if __name__ == "__main__":
+    _cli()
@@ -0,0 +1,210 @@
+from typing import Dict, List, Optional, Sequence
+
+# Camada de primitivas DOM: cada função faz UMA chamada execute_script e devolve
+# um "snapshot" (textos, ids, geometria e o próprio WebElement para clicar),
+# em vez de find_elements + is_displayed()/.text por elemento (um round trip cada).
+
+# Seletores de opção do dropdown (design system gov.br e genéricos)
+OPTION_SELECTORS = [
+    "[role='listbox'] [role='option']",
+    "ul[role='listbox'] li",
+    "div[role='option']",
+    ".br-list .item",
+]
+LISTBOX_SELECTORS = ["[role='listbox']", "ul[role='listbox']", ".br-list"]
+
+_JS_COMMON = r"""
+const vis = (e) => {
+  if (!e || !e.getClientRects().length) return false;
+  const r = e.getBoundingClientRect();
+  if (r.width <= 0 || r.height <= 0) return false;
+  const cs = getComputedStyle(e);
+  return cs.visibility !== 'hidden' && cs.display !== 'none';
+};
+const txt = (e) => (e.innerText || e.textContent || '').trim();
+"""
+
+_JS_SNAPSHOT = _JS_COMMON + r"""
+const sels = arguments[0], skip = arguments[1];
+const seen = new Set(), out = [];
+for (const sel of sels) {
+  let els = [];
+  try { els = document.querySelectorAll(sel); } catch (e) { continue; }
+  for (const e of els) {
+    if (seen.has(e) || !vis(e)) continue;
+    seen.add(e);
+    const t = txt(e);
+    if (!t || (skip && /SELECIONE/i.test(t))) continue;
+    const r = e.getBoundingClientRect();
+    out.push({el: e, text: t, id: e.id || '', x: r.left, y: r.top, w: r.width, h: r.height});
+  }
+}
+return out;
+"""
+
+_JS_LISTBOX = _JS_COMMON + r"""
+const sels = arguments[0], optSels = arguments[1];
+let box = null;
+for (const sel of sels) {
+  for (const e of document.querySelectorAll(sel)) { if (vis(e)) { box = e; break; } }
+  if (box) break;
+}
+if (!box) {
+  for (const sel of optSels) {
+    const o = Array.from(document.querySelectorAll(sel)).find(vis);
+    if (o) { box = o.closest("ul,[role='listbox'],.br-list") || o.parentElement; break; }
+  }
+}
+if (!box) return null;
+return {el: box, top: box.scrollTop, ch: box.clientHeight, sh: box.scrollHeight};
+"""
+
+_JS_SCROLL = r"""
+const e = arguments[0], delta = arguments[1];
+if (delta === 'top') e.scrollTop = 0;
+else if (delta) e.scrollTop = e.scrollTop + delta * Math.max(40, e.clientHeight);
+return {top: e.scrollTop, ch: e.clientHeight, sh: e.scrollHeight};
+"""
+
+_JS_ACTIVE = _JS_COMMON + r"""
+const input = arguments[0], box = arguments[1];
+const id = input.getAttribute('aria-activedescendant') || '';
+let opt = id ? document.getElementById(id) : null;
+if (!opt || !vis(opt)) {
+  opt = Array.from(document.querySelectorAll(
+    "[role='option'][aria-selected='true'], .active, li[aria-selected='true']")).find(vis) || null;
+}
+const out = {id: id, text: opt ? txt(opt) : '', value: (input.value || '').trim(), at_end: null};
+if (box) {
+  out.top = box.scrollTop; out.ch = box.clientHeight; out.sh = box.scrollHeight;
+  out.at_end = (box.scrollTop + box.clientHeight + 3) >= box.scrollHeight;
+}
+return out;
+"""
+
+_JS_CLOSE_DROPDOWNS = r"""
+const done = arguments[arguments.length - 1], pause = arguments[0], close = arguments[1];
+if (close) {
+  try { document.activeElement && document.activeElement.blur(); } catch (e) {}
+  try { document.body && document.body.click(); } catch (e) {}
+  try {
+    const t = document.activeElement || document.body;
+    t.dispatchEvent(new KeyboardEvent('keydown', {key: 'Escape', code: 'Escape', keyCode: 27, bubbles: true}));
+  } catch (e) {}
+}
+setTimeout(() => {
+  const qs = (sel) => Array.from(document.querySelectorAll(sel)).filter(e => e.offsetParent !== null);
+  done((qs('[role="listbox"]').length + qs('[id$="-popup"]').length) > 0);
+}, pause);
+"""
+
+_JS_RESOLVE = _JS_COMMON + r"""
+const groups = arguments[0], detail = arguments[1];
+const first = (c) => {
+  try {
+    if (c.startsWith('/') || c.startsWith('(')) {
+      const r = document.evaluate(c, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+      for (let i = 0; i < r.snapshotLength; i++) { const e = r.snapshotItem(i); if (vis(e)) return e; }
+      return null;
+    }
+    return Array.from(document.querySelectorAll(c)).find(vis) || null;
+  } catch (e) { return null; }
+};
+const out = {};
+for (const [name, cands] of groups) {
+  for (let i = 0; i < cands.length; i++) {
+    const el = first(cands[i]);
+    if (!el) continue;
+    const hit = {i: i, el: el, text: txt(el), value: (el.value || '').trim()};
+    if (detail) {
+      const r = el.getBoundingClientRect();
+      const top = document.elementFromPoint((r.left + r.right) / 2, (r.top + r.bottom) / 2);
+      const ad = (el.getAttribute('aria-disabled') || '').toLowerCase();
+      hit.disabled = el.hasAttribute('disabled') || ad === 'true' || ad === '1';
+      hit.covered = !(top && (top === el || el.contains(top)));
+      hit.in_view = r.top >= 0 && r.bottom <= (window.innerHeight || document.documentElement.clientHeight);
+    }
+    out[name] = hit;
+    break;
+  }
+}
+return out;
+"""
+
+
+def option_snapshot(driver, selectors: Sequence[str] = OPTION_SELECTORS, skip_placeholder: bool = True) -> List[Dict]:
+    """Opções visíveis do dropdown aberto: [{el, text, id, x, y, w, h}] em um round trip."""
+    try:
+        return driver.execute_script(_JS_SNAPSHOT, list(selectors), skip_placeholder) or []
+    except Exception:
+        return []
+
+
+def option_texts(driver, selectors: Sequence[str] = OPTION_SELECTORS) -> List[str]:
+    """Textos das opções visíveis, sem duplicados e na ordem da tela."""
+    return list(dict.fromkeys(o["text"] for o in option_snapshot(driver, selectors)))
+
+
+def listbox_state(driver, selectors: Sequence[str] = LISTBOX_SELECTORS,
+                  option_selectors: Sequence[str] = OPTION_SELECTORS) -> Optional[Dict]:
+    """Container rolável visível + posição de scroll {el, top, ch, sh}, ou None."""
+    try:
+        return driver.execute_script(_JS_LISTBOX, list(selectors), list(option_selectors))
+    except Exception:
+        return None
+
+
+def scroll_container(driver, container, delta=None) -> Dict:
+    """Rola o container (delta em 'telas', 'top' para o início) e devolve {top, ch, sh}."""
+    return driver.execute_script(_JS_SCROLL, container, delta) or {}
+
+
+def at_scroll_end(state: Optional[Dict], slack: int = 2) -> bool:
+    if not state:
+        return False
+    return (state.get("top", 0) + state.get("ch", 0) + slack) >= state.get("sh", 0)
+
+
+def active_option_state(driver, input_el, container=None) -> Dict:
+    """Opção ativa (aria-activedescendant ou destacada), value do input e scroll do container."""
+    try:
+        return driver.execute_script(_JS_ACTIVE, input_el, container) or {}
+    except Exception:
+        return {}
+
+
+def close_dropdowns(driver, pause: float = 0.15, close: bool = True) -> Optional[bool]:
+    """
+    Blur + clique no body + ESC sintético e, após `pause`, informa se ainda há listbox
+    visível (None = erro). Com close=False só espera e checa.
+    """
+    try:
+        return bool(driver.execute_async_script(_JS_CLOSE_DROPDOWNS, int(pause * 1000), close))
+    except Exception:
+        return None
+
+
+def resolve_candidates(driver, groups: Sequence, detail: bool = False) -> Dict[str, Dict]:
+    """
+    Para cada (nome, [seletores]) o primeiro candidato (XPath se começa com '/' ou '(',
+    senão CSS) com elemento visível: {nome: {i, el, text, value[, disabled, covered, in_view]}}.
+    Todos os grupos em um round trip; nomes sem candidato visível ficam de fora.
+    """
+    try:
+        return driver.execute_script(_JS_RESOLVE, [[n, list(c)] for n, c in groups], detail) or {}
+    except Exception:
+        return {}
+
+
+def click_element(driver, el, scroll: bool = True) -> bool:
+    """scrollIntoView + clique nativo; se interceptado, clique via JS."""
+    try:
+        if scroll:
+            driver.execute_script("arguments[0].scrollIntoView({block:'center'});", el)
+        try:
+            el.click()
+        except Exception:
+            driver.execute_script("arguments[0].click();", el)
+        return True
+    except Exception:
+        return False
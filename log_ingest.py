@@ -0,0 +1,259 @@
+"""
+Ingestão dos logs de execução (logs/run-*.log) na tabela `fases` do histórico.
+
+Reconstrói, a partir das linhas que o main.py já registra, as mesmas fases que o
+SweepMetrics mede ao vivo, para ter uma linha de base das execuções antigas:
+
+    selecao   "[ano] CNPJ => ..." / "-> Estabelecimento => ..."  até a próxima etapa
+    coleta    "Coletando opções ..."                           até "Estabelecimentos detectados"
+    consulta  "Clicando em Consultar" (ou "Clique ... realizado") até "Extraindo resultado"
+    extracao  "Extraindo resultado..."                         até "OK: ..."
+    intervalo fim do item anterior até o início da próxima seleção
+
+Cada log vira uma execução com origem "log:<arquivo>" (reingerir o mesmo log é ignorado,
+ou refeito com --refazer). Aceita texto ou JSON (log_utils), inclusive os .gz rotacionados.
+Ao final imprime a tendência de vazão entre execuções (logs e ao vivo).
+
+    py log_ingest.py                                  # todos os logs/run-*.log
+    py log_ingest.py logs/run-20251030_195431.log --db saida/Pessoal/relatorio_fap.db
+    py log_ingest.py --so-tendencias --csv tendencias.csv
+"""
+import os
+import re
+import csv
+import glob
+import gzip
+import json
+import argparse
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from store_utils import open_store, start_run, save_phases, DEFAULT_DB_PATH
+
+LOG_GLOB = os.path.join("logs", "run-*.log*")
+PHASES = ("selecao", "coleta", "consulta", "extracao", "intervalo")
+
+_LINE = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)[,.](\d{3}) \[(\w+)\] (.*)$")
+_VIGENCIA = re.compile(r"^=+ Vigência (\d{4}) =+$")
+_CNPJ = re.compile(r"^\[(\d{4})\] CNPJ => (.+)$")
+_ESTAB = re.compile(r"^\[(\d{4})\] (.+?) -> Estabelecimento => (.+)$")
+_DETECTED = re.compile(r"^\[(\d{4})\] Estabelecimentos detectados: \d+")
+_OK = re.compile(r"^OK: ")
+# Fim de fase sem resultado (falhas registradas pelo main.py)
+_FAIL = re.compile(r"^(Falha ao selecionar|Não consegui clicar em Consultar|\[\d{4}\] .+: (sem dados|erro do portal))")
+
+Event = Tuple[datetime, str, str]  # (instante, nível, mensagem)
+
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def iter_events(path: str) -> Iterator[Event]:
+    """(instante, nível, mensagem) de cada linha do log (texto TEXT_FORMAT ou JSON)."""
+    with _open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("{"):
+                try:
+                    d = json.loads(line)
+                    yield datetime.fromisoformat(d["ts"]), d.get("level", ""), d.get("msg", "")
+                except (ValueError, KeyError):
+                    pass
+                continue
+            m = _LINE.match(line)
+            if m:
+                ts = datetime.strptime(m.group(1), "%Y-%m-%d %H:%M:%S").replace(microsecond=int(m.group(2)) * 1000)
+                yield ts, m.group(3), m.group(4)
+
+
+def parse_phases(events) -> Tuple[List[tuple], int]:
+    """
+    Fases (vigencia, cnpj, estab, fase, inicio_iso, duracao_s) como o SweepMetrics grava,
+    e o nº de linhas "OK:". Fase aberta no fim do log (execução interrompida) é descartada.
+    """
+    out: List[tuple] = []
+    ok = 0
+    ano = cnpj = estab = ""
+    cur: Optional[Tuple[str, datetime, str, str, str]] = None   # (fase, início, ano, cnpj, estab)
+    last_end: Optional[datetime] = None
+
+    def close(ts: datetime):
+        nonlocal cur, last_end
+        if cur is not None:
+            fase, t0, a, c, e = cur
+            out.append((a, c, e, fase, t0.isoformat(sep=" ", timespec="milliseconds"),
+                        round((ts - t0).total_seconds(), 3)))
+            last_end = ts
+            cur = None
+
+    def open_(fase: str, ts: datetime):
+        nonlocal cur
+        close(ts)
+        if fase == "selecao" and last_end is not None and ts > last_end:
+            out.append((ano, cnpj, estab, "intervalo", last_end.isoformat(sep=" ", timespec="milliseconds"),
+                        round((ts - last_end).total_seconds(), 3)))
+        cur = (fase, ts, ano, cnpj, estab)
+
+    for ts, _level, msg in events:
+        if msg.startswith("Log iniciado"):
+            cur, last_end = None, None   # outro run no mesmo arquivo: não emenda
+            continue
+        m = _VIGENCIA.match(msg)
+        if m:
+            ano, cur = m.group(1), None
+            continue
+        m = _CNPJ.match(msg)
+        if m:
+            ano, cnpj, estab = m.group(1), m.group(2), ""
+            open_("selecao", ts)
+            continue
+        m = _ESTAB.match(msg)
+        if m:
+            ano, cnpj, estab = m.group(1), m.group(2), m.group(3)
+            open_("selecao", ts)
+            continue
+        if msg.startswith("Coletando opções"):
+            open_("coleta", ts)
+        elif _DETECTED.match(msg):
+            close(ts)
+        elif msg.startswith("Clicando em Consultar"):
+            if cur is None or cur[0] != "consulta":    # retentativas ficam na mesma consulta
+                open_("consulta", ts)
+        elif msg.startswith("Clique em Consultar realizado"):
+            if cur is None or cur[0] != "consulta":    # logs antigos, sem "Clicando em Consultar"
+                open_("consulta", ts)
+        elif msg.startswith("Extraindo resultado"):
+            open_("extracao", ts)
+        elif _OK.match(msg):
+            ok += 1
+            close(ts)
+        elif _FAIL.match(msg):
+            close(ts)
+    return out, ok
+
+
+def run_key(path: str) -> str:
+    """'logs/run-20251030_195431.log.2.gz' -> 'run-20251030_195431.log' (partes rotacionadas juntas)."""
+    name = os.path.basename(path)
+    return name[: name.index(".log") + 4] if ".log" in name else name
+
+
+def _part_order(path: str) -> int:
+    """Ordem cronológica das partes: .log.3.gz, .log.2.gz, .log.1.gz, .log."""
+    rest = os.path.basename(path)[len(run_key(path)):].lstrip(".").split(".")[0]
+    return -int(rest) if rest.isdigit() else 0
+
+
+def ingest_log(conn: sqlite3.Connection, paths: List[str], redo: bool = False) -> Optional[Dict]:
+    """Ingere as partes de um log (mesmo run_key); None se já ingerido (e não `redo`)."""
+    paths = sorted(paths, key=_part_order)
+    origem = f"log:{run_key(paths[0])}"
+    old = conn.execute("SELECT run_id FROM execucoes WHERE origem = ?", (origem,)).fetchall()
+    if old and not redo:
+        return None
+    with conn:
+        for (rid,) in old:
+            conn.execute("DELETE FROM fases WHERE run_id = ?", (rid,))
+            conn.execute("DELETE FROM execucoes WHERE run_id = ?", (rid,))
+
+    def events():
+        for p in paths:
+            yield from iter_events(p)
+
+    phases, ok = parse_phases(events())
+    if not phases:
+        return {"origem": origem, "run_id": None, "fases": 0, "ok": ok}
+    run_id = start_run(conn, origem=origem, iniciada_em=phases[0][4][:19])
+    save_phases(conn, run_id, phases, origem="log")
+    return {"origem": origem, "run_id": run_id, "fases": len(phases), "ok": ok}
+
+
+_TRENDS = """
+SELECT e.run_id, e.iniciada_em, e.origem, f.fase,
+       COUNT(*) AS n, AVG(f.duracao_s) AS media, SUM(f.duracao_s) AS total,
+       MIN(julianday(f.inicio)) AS t0, MAX(julianday(f.inicio) + f.duracao_s / 86400.0) AS t1
+FROM fases f JOIN execucoes e USING (run_id)
+GROUP BY e.run_id, f.fase
+ORDER BY e.iniciada_em, e.run_id
+"""
+
+
+def throughput_trends(conn: sqlite3.Connection, min_items: int = 1) -> List[Dict]:
+    """
+    Por execução (em ordem cronológica): itens (fases de extração), minutos, itens/min,
+    média de cada fase e a variação de itens/min em relação à primeira execução listada.
+    """
+    runs: Dict[int, Dict] = {}
+    for r in conn.execute(_TRENDS):
+        d = runs.setdefault(r["run_id"], {"run_id": r["run_id"], "iniciada_em": r["iniciada_em"],
+                                          "origem": r["origem"], "t0": r["t0"], "t1": r["t1"]})
+        d["t0"], d["t1"] = min(d["t0"], r["t0"]), max(d["t1"], r["t1"])
+        d[r["fase"]] = round(r["media"], 2)
+        if r["fase"] == "extracao":
+            d["itens"] = r["n"]
+    out, base = [], None
+    for d in runs.values():
+        itens = d.get("itens", 0)
+        if itens < min_items:
+            continue
+        minutos = (d.pop("t1") - d.pop("t0")) * 1440
+        d["itens"] = itens
+        d["minutos"] = round(minutos, 1)
+        d["itens_min"] = round(itens / minutos, 2) if minutos > 0 else 0.0
+        base = base if base is not None else d["itens_min"]
+        d["vs_base_pct"] = round((d["itens_min"] / base - 1) * 100, 1) if base else 0.0
+        out.append(d)
+    return out
+
+
+TREND_COLS = ["run_id", "iniciada_em", "origem", "itens", "minutos", "itens_min", "vs_base_pct", *PHASES]
+
+
+def _print_trends(rows: List[Dict]):
+    print("\t".join(TREND_COLS))
+    for d in rows:
+        print("\t".join(str(d.get(c, "")) for c in TREND_COLS))
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Ingere logs/run-*.log na tabela de fases e mostra a tendência de vazão")
+    ap.add_argument("arquivos", nargs="*", help=f"logs a ingerir (padrão: {LOG_GLOB})")
+    ap.add_argument("--db", default=DEFAULT_DB_PATH)
+    ap.add_argument("--refazer", action="store_true", help="reingere logs já ingeridos")
+    ap.add_argument("--so-tendencias", action="store_true", help="não ingere; só mostra as tendências")
+    ap.add_argument("--min-itens", type=int, default=5, help="ignora execuções com menos itens na tendência")
+    ap.add_argument("--csv", help="grava as tendências neste .csv")
+    args = ap.parse_args(argv)
+
+    conn = open_store(args.db)
+    if not args.so_tendencias:
+        files = []
+        for a in args.arquivos or [LOG_GLOB]:
+            files.extend(glob.glob(a) if any(ch in a for ch in "*?[") else [a])
+        groups: Dict[str, List[str]] = {}
+        for p in sorted(set(files)):
+            groups.setdefault(run_key(p), []).append(p)
+        for key, parts in groups.items():
+            res = ingest_log(conn, parts, redo=args.refazer)
+            if res is None:
+                print(f"{key}: já ingerido (use --refazer)")
+            else:
+                print(f"{key}: {res['fases']} fases, {res['ok']} OK -> run {res['run_id']}" if res["run_id"]
+                      else f"{key}: sem itens consultados")
+    rows = throughput_trends(conn, min_items=args.min_itens)
+    print()
+    _print_trends(rows)
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.DictWriter(f, fieldnames=TREND_COLS, delimiter=";", extrasaction="ignore")
+            w.writeheader()
+            w.writerows(rows)
+    conn.close()
+
+
+if __name__ == "__main__":
+    _cli()
@@ -0,0 +1,138 @@
+import os
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import logging
+import logging.handlers
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro (para ingestão em ferramentas de log)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "module": record.module,
+            "func": record.funcName,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que NÃO formata no thread chamador: só resolve a mensagem (%-args)
+    e a exceção; a formatação completa fica para o thread do QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        msg = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as fin, gzip.open(dest, "wb") as fout:
+        shutil.copyfileobj(fin, fout)
+    os.remove(source)
+
+
+def _stop_listener(listener: logging.handlers.QueueListener):
+    # stop() falha se chamado duas vezes (ex.: manualmente e no atexit)
+    if getattr(listener, "_thread", None) is not None:
+        listener.stop()
+
+
+def _file_handler(log_path: str, rotation: str, max_bytes: int, backup_count: int, when: str) -> logging.Handler:
+    if rotation == "time":
+        fh = logging.handlers.TimedRotatingFileHandler(
+            log_path, when=when, backupCount=backup_count, encoding="utf-8", delay=True
+        )
+    elif rotation == "size":
+        fh = logging.handlers.RotatingFileHandler(
+            log_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+        )
+    else:
+        return logging.FileHandler(log_path, encoding="utf-8", delay=True)
+    fh.namer = _gzip_namer
+    fh.rotator = _gzip_rotator
+    return fh
+
+
+def setup_logging(
+    name: str = "fapbot",
+    log_dir: str = "logs",
+    level: str = "INFO",
+    console_level: str = "INFO",
+    json_output: bool = False,
+    rotation: Optional[str] = "size",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 20,
+    when: str = "H",
+    levels: Optional[Dict[str, str]] = None,
+    log_path: Optional[str] = None,
+) -> Tuple[logging.Logger, logging.handlers.QueueListener]:
+    """
+    Configura o logger `name` de forma não bloqueante: o logger só enfileira
+    (QueueHandler) e um QueueListener em thread própria escreve no console e no arquivo.
+
+    - rotation: "size" (max_bytes), "time" (when) ou None (sem rotação); rotacionados viram .gz
+    - json_output: arquivo em JSON por linha (console continua em texto)
+    - levels: níveis por módulo, ex.: {"fapbot.collect": "DEBUG"}
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    if not log_path:
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_path = os.path.join(log_dir, f"run-{ts}.log")
+
+    text_fmt = logging.Formatter(TEXT_FORMAT)
+    ch = logging.StreamHandler()
+    ch.setLevel(console_level)
+    ch.setFormatter(text_fmt)
+    fh = _file_handler(log_path, rotation, max_bytes, backup_count, when)
+    fh.setFormatter(JsonFormatter() if json_output else text_fmt)
+
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(q, ch, fh, respect_handler_level=True)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+        try:
+            h.close()
+        except Exception:
+            pass
+    logger.addHandler(_LazyQueueHandler(q))
+    logger.propagate = False
+    for mod, lvl in (levels or {}).items():
+        logging.getLogger(mod).setLevel(lvl)
+
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    logger.info(f"Log iniciado: {log_path}")
+    return logger, listener
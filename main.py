@@ -1,18 +1,40 @@
 import threading
 import time
 import re
+from contextlib import contextmanager, nullcontext
 from typing import Dict
-import os, logging
+import os, socket, logging, argparse
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
-from typing import Tuple, Optional
+from typing import Iterator, List, Tuple, Optional
 from browser_config import (
     start_brave_with_active_profile,
+    get_profile,
+    profile_debugger,
+    profile_output_dir,
     ATTACH_DEBUGGER,
+    BIND_DEST_IPS,
     KEEP_OPEN,
     PROXY_URL,
+    LIGHT_MODE,
+    ASSET_CACHE,
+    ASSET_CACHE_DIR,
+    ASSET_CACHE_MAX_MB,
+    CAPTURE_HTTP_STATUS,
+    WARM_ATTACH,
+)
+from cdp_utils import enable_light_mode, navigation_timing, drain_http_statuses, TabWatchdog
+from dom_utils import (
+    option_snapshot,
+    option_texts,
+    listbox_state,
+    scroll_container,
+    at_scroll_end,
+    active_option_state,
+    close_dropdowns,
+    click_element,
 )
 from sso_utils import (
     safe_click_any_xpath,
@@ -26,49 +48,85 @@ from sso_utils import (
     select_first_option,
     XPATHS_CERT_BUTTON,
     XPATH_ENTER_GOV,
+    _ensure_window,
 )
 from net_utils import validate_host_ip_map_or_fail
-from report_utils import append_row_to_excel
+from report_utils import append_row_to_excel, ReportUpsertWriter, ShardWriter, shard_path, REPORT_HEADERS
+from store_utils import open_store, start_run, save_row
+from log_utils import setup_logging
+from scheduler import plan, load_priorities, priority_groups
+from rate_limit import AdaptiveRateLimiter, shared_limiter
+from asset_cache import AssetCache, enable_asset_cache, asset_cache_report
+from metrics import SweepMetrics, serve_metrics
+from replay import start_recording, stop_recording
+from selector_registry import registry
+from page_state import (
+    classify_page,
+    wait_page_state,
+    PageStateError,
+    SESSION_LOST,
+    SSO_LOGIN,
+    CAPTCHA,
+    PORTAL_ERROR,
+    NO_DATA,
+    RESULT,
+    FORM_READY,
+    TAB_GONE,
+)
+from portfolio import load_portfolio, portfolio_size, fmt_raiz, fmt_estab, write_missing
+from profile_snapshot import discard_copy
 from datetime import datetime
 from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException, StaleElementReferenceException
 
 # -----------------------------------------------------------------------------
 # Logging e esperas
 # -----------------------------------------------------------------------------
+# Formato do arquivo de log e rotação (arquivos rotacionados são compactados em .gz)
+LOG_JSON = False
+LOG_ROTATION = "size"              # "size", "time" ou None
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 20
+# Níveis por módulo; ex.: {"fapbot.collect": "DEBUG"} para ver cada tecla dos coletores ARIA
+LOG_LEVELS: Dict[str, str] = {"fapbot.collect": "INFO"}
+
+
+LOG_PATH: Optional[str] = None  # arquivo de log desta execução (o perfil vai ao lado)
+
+
 def _setup_logging():
-    os.makedirs("logs", exist_ok=True)
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_path = os.path.join("logs", f"run-{ts}.log")
-    logger = logging.getLogger("fapbot")
-    logger.setLevel(logging.INFO)
-    fmt = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-    ch = logging.StreamHandler()
-    ch.setFormatter(fmt)
-    fh = logging.FileHandler(log_path, encoding="utf-8")
-    fh.setFormatter(fmt)
-    logger.handlers.clear()
-    logger.addHandler(ch)
-    logger.addHandler(fh)
-    logger.info(f"Log iniciado: {log_path}")
+    global LOG_PATH
+    logger, _listener = setup_logging(
+        "fapbot",
+        log_dir=os.getenv("FAPBOT_LOG_DIR", "logs"),  # multi_profile separa os logs por perfil
+        json_output=LOG_JSON,
+        rotation=LOG_ROTATION,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUPS,
+        levels=LOG_LEVELS,
+    )
+    LOG_PATH = next((getattr(h, "baseFilename", None) for h in _listener.handlers if hasattr(h, "baseFilename")), None)
     return logger
 
 LOG = _setup_logging()
+LOG_COLLECT = logging.getLogger("fapbot.collect")
 
 # Esperas solicitadas
 SLEEP_AFTER_TYPE = 3       # após inserir/selecionar em combobox
 SLEEP_AFTER_CONSULT = 5    # após clicar em Consultar
+DROPDOWN_ANIM_PAUSE = 0.15  # espera a animação do dropdown fechar (reduzida no modo leve)
+
+# Descoberta em fluxo: os CNPJs são consultados conforme a varredura do listbox os encontra
+# (com arquivo de prioridades a lista é coletada inteira antes, para respeitar os níveis)
+STREAM_DISCOVERY = True
+DISCOVERY_CHUNK_S = 3.0     # duração de cada fatia da varredura do #cnpjRaiz
 
 # Sistema alvo (redireciona para SSO)
 SSO_URL = "https://fap.dataprev.gov.br/consultar-fap"
+CONSULT_URL_PART = "fap.dataprev.gov.br/consultar-fap"
 
 # Emissor do seu certificado de cliente (mTLS)
 CERT_ISSUER_CN = "AC SOLUTI Multipla v5"
 
-# Hosts "pinnados" para IPs (mesmos do seu .ps1)
-BIND_DEST_IPS: Dict[str, str] = {
-    "sso.acesso.gov.br": "161.148.168.40",
-    "fap.dataprev.gov.br": "200.152.35.17",
-}
 
 # (Opcional) aceitar o diálogo NATIVO do Windows do certificado
 ACCEPT_NATIVE_CERT_DIALOG = True
@@ -76,6 +134,31 @@ ACCEPT_NATIVE_CERT_DIALOG = True
 # Validar os IPs "pinnados" antes de automatizar (recomendado)
 VALIDATE_IPS_BEFORE = False  # validação desnecessária pois a pinagem é feita no processo do Brave
 
+# Relatório: upsert por (CNPJ_Estab, Vigencia) em vez de apenas acrescentar linhas
+REPORT_PATH = "relatorio_fap.xlsx"
+REPORT_UPSERT = True
+
+# Histórico de resultados (SQLite); None desativa
+RESULT_DB_PATH: Optional[str] = "relatorio_fap.db"
+
+# Watchdog de memória: recicla a aba quando heap JS ou RSS do navegador passam do limite
+WATCHDOG_ENABLED = True
+TAB_HEAP_LIMIT_MB = 512
+BROWSER_RSS_LIMIT_MB = 3072    # requer psutil; sem ele só o heap é avaliado
+WATCHDOG_EVERY = 10            # amostra a cada N consultas
+
+# Limitador de taxa adaptativo (AIMD): sobe devagar enquanto o portal responde bem,
+# corta pela metade em captcha, HTTP 429/5xx ou resposta lenta
+RATE_LIMIT_ENABLED = True
+RATE_START_PER_MIN = 20
+RATE_MIN_PER_MIN = 1
+RATE_MAX_PER_MIN = 120
+RATE_SLOW_LATENCY = 8.0        # s além de SLEEP_AFTER_CONSULT até o resultado aparecer
+
+# Métricas ao vivo (progresso, linhas/min, ETA, latência por fase) em http://127.0.0.1:<porta>/;
+# FAPBOT_METRICS_PORT sobrescreve (um por processo); None desliga
+METRICS_PORT: Optional[int] = int(os.environ.get("FAPBOT_METRICS_PORT") or 9108)
+
 # Timeouts
 TIMEOUT_CLICK = 20
 TIMEOUT_LEAVE_SSO = 60
@@ -94,6 +177,20 @@ XP_MUNICIPIO = "/html/body/div/div[2]/div/div[2]/div[2]/div[1]/div/div[2]/div/di
 X_VIG_ALIQ_ROOT = "/html/body/div/div[2]/div/div[2]/div[2]/div[1]/div/div[1]"
 XP_ALIQUOTA = "/html/body/div/div[2]/div/div[2]/div[2]/div[1]/div/div[1]/div/div/div[2]/div/div[1]/span"
 
+SELECTORS = registry()
+# Candidatos por campo do resultado: (XPath absoluto, relativo ao rótulo). O relativo segura
+# mudanças de layout do painel, mas pode pegar o span errado; é fallback e nunca é
+# promovido: o absoluto é sempre tentado primeiro (e, sumindo, gera aviso de drift).
+RESULT_SELECTORS = {
+    "aliquota": (XP_ALIQUOTA, X_VIG_ALIQ_ROOT + "//span[contains(text(), ',')]"),
+    "razao_social": (XP_RAZAO_SOCIAL, "//*[normalize-space(text())='Razão Social']/following::span[1]"),
+    "cnpj_estab": (XP_CNPJ_ESTAB, "//*[normalize-space(text())='CNPJ']/following::span[1]"),
+    "uf": (XP_UF, "//*[normalize-space(text())='UF']/following::span[1]"),
+    "municipio": (XP_MUNICIPIO, "//*[starts-with(normalize-space(text()),'Endere')]/following::span[1]"),
+}
+for _name, (_primary, _relative) in RESULT_SELECTORS.items():
+    SELECTORS.register(_name, [_primary], fallback=[_relative])
+
 # CSS do input CNPJ Raiz (fornecido)
 CNPJ_INPUT_CSS = "#cnpjRaiz"
 
@@ -179,26 +276,26 @@ def _extract_raiz_digits_from_label(label: str) -> str:
 def extract_result_data(driver, ano: str, estab_label: Optional[str] = None) -> dict:
     """Extrai dados da área de resultado após clicar em Consultar."""
     LOG.info("Extraindo resultado...")
-    # Aguarda painel e aliquota
-    try:
-        WebDriverWait(driver, 15).until(EC.visibility_of_element_located((By.XPATH, X_INFO_ROOT)))
-    except Exception:
-        pass
-    try:
-        WebDriverWait(driver, 15).until(EC.visibility_of_element_located((By.XPATH, XP_ALIQUOTA)))
-    except Exception:
-        pass
-
-    razao = _safe_text(driver, XP_RAZAO_SOCIAL)
-    cnpj_estab_raw = _safe_text(driver, XP_CNPJ_ESTAB)
+    # Todos os campos num único laço de polling: espera a alíquota (até 15s) e dá um
+    # respiro curto só para os campos que ainda não apareceram
+    hits = SELECTORS.find(driver, list(RESULT_SELECTORS), timeout=15, require=["aliquota"])
+    missing = [n for n in RESULT_SELECTORS if n not in hits]
+    if missing:
+        hits.update(SELECTORS.find(driver, missing, timeout=2))
+
+    def field(name: str) -> str:
+        return (hits.get(name) or {}).get("text", "")
+
+    razao = field("razao_social")
+    cnpj_estab_raw = field("cnpj_estab")
     # Somente dígitos
     cnpj_estab = _only_digits(cnpj_estab_raw)
     # CNPJ_Raiz: prioriza o valor do input (ex.: '53.458.313 - 3L SERVIços LTDA'), senão usa 8 dígitos do estab
     cnpj_raiz_label = _input_value(driver, X_CNPJ_RAIZ)
     cnpj_raiz_from_label = _extract_raiz_digits_from_label(cnpj_raiz_label)
     cnpj_raiz = cnpj_raiz_from_label or (cnpj_estab[:8] if cnpj_estab else "")
-    uf = _safe_text(driver, XP_UF)
-    municipio = _safe_text(driver, XP_MUNICIPIO)
+    uf = field("uf")
+    municipio = field("municipio")
     # Se vier endereço completo, tenta extrair município e UF
     if municipio and ("-" in municipio or "CEP" in municipio.upper()):
         muni_p, uf_p = _parse_municipio_uf(municipio)
@@ -213,7 +310,7 @@ def extract_result_data(driver, ano: str, estab_label: Optional[str] = None) ->
             municipio = muni_p
         if uf_p:
             uf = uf_p
-    aliquota = _safe_text(driver, XP_ALIQUOTA)
+    aliquota = field("aliquota")
     # Nome do estabelecimento:
     # Preferência: rótulo capturado no loop (ex.: "53.458.313 - NOME").
     # Fallback: monta "raiz formatada - razao social" usando a raiz obtida.
@@ -253,26 +350,25 @@ def _open_dropdown_via_button(driver, css: str = None, xpath: str = None):
     """Abre o dropdown clicando no botão 'Exibir lista' irmão do input."""
     LOG.debug(f"Abrindo dropdown via botão: css={css} xpath={xpath}")
     el = _find_el(driver, css, xpath)
-    driver.execute_script("arguments[0].scrollIntoView({block:'center'});", el)
-    container = None
-    try:
-        container = el.find_element(By.XPATH, "./ancestor::div[contains(@class,'br-input')][1]")
-    except Exception:
-        container = el.find_element(By.XPATH, "./parent::*")
-    # botão com ícone de seta
-    btn = None
-    try:
-        btn = container.find_element(By.CSS_SELECTOR, "button.br-button")
-    except Exception:
-        btn = container.find_element(By.XPATH, ".//button")
-    try:
-        btn.click()
-    except Exception:
-        driver.execute_script("arguments[0].click();", btn)
+    # localiza e clica o botão irmão num único script (container .br-input ou pai)
+    clicked = driver.execute_script("""
+        const el = arguments[0];
+        el.scrollIntoView({block:'center'});
+        const box = el.closest('div.br-input') || el.parentElement;
+        const btn = box && (box.querySelector('button.br-button') || box.querySelector('button'));
+        if (!btn) return false;
+        btn.click();
+        return true;
+    """, el)
+    if not clicked:
+        try:
+            el.click()
+        except Exception:
+            pass
     # espera a lista abrir (role=listbox) ou opções visíveis
     try:
-        WebDriverWait(driver, 5).until(
-            lambda d: len(_visible_option_elements(d)) > 0
+        WebDriverWait(driver, 5, poll_frequency=DROPDOWN_ANIM_PAUSE).until(
+            lambda d: len(_visible_options(d)) > 0
         )
     except TimeoutException:
         # como fallback, tenta ALT+DOWN no input
@@ -284,74 +380,22 @@ def _open_dropdown_via_button(driver, css: str = None, xpath: str = None):
     return el
 
 
-def _visible_option_elements(driver):
-    """Retorna elementos de opção visíveis do dropdown atual (genérico)."""
-    candidates = []
-    sels = [
-        (By.CSS_SELECTOR, "[role='listbox'] [role='option']"),
-        (By.CSS_SELECTOR, "ul[role='listbox'] li"),
-        (By.XPATH, "//div[@role='option']"),
-        (By.XPATH, "//ul[@role='listbox']//li"),
-        (By.CSS_SELECTOR, ".br-list .item"),
-    ]
-    seen = set()
-    for by, sel in sels:
-        try:
-            for e in driver.find_elements(by, sel):
-                if e.is_displayed():
-                    tid = id(e)
-                    if tid not in seen:
-                        seen.add(tid)
-                        candidates.append(e)
-        except Exception:
-            pass
-    # remove placeholders “Selecione …”
-    def _txt(e):
-        try:
-            return e.text.strip()
-        except Exception:
-            return ""
-    return [e for e in candidates if _txt(e) and "SELECIONE" not in _txt(e).upper()]
+def _visible_options(driver):
+    """Snapshot das opções visíveis do dropdown atual (texto, id, geometria e elemento), sem placeholders."""
+    return option_snapshot(driver)
 
 
 def _list_options_for_input(driver, css: str = None, xpath: str = None):
     """Abre a lista pelo botão ao lado do input e retorna todos os textos."""
     _open_dropdown_via_button(driver, css, xpath)
-    opts = _visible_option_elements(driver)
-    texts = []
-    for e in opts:
-        try:
-            t = e.text.strip()
-            if t:
-                texts.append(t)
-        except Exception:
-            pass
     # dedupe preservando ordem
-    return [t for t in dict.fromkeys(texts)]
+    return option_texts(driver)
 
 
 def _find_listbox_container(driver):
     """Retorna o container rolável (role=listbox) do dropdown aberto."""
-    sels = [
-        (By.CSS_SELECTOR, "[role='listbox']"),
-        (By.CSS_SELECTOR, "ul[role='listbox']"),
-        (By.CSS_SELECTOR, ".br-list"),
-    ]
-    for by, sel in sels:
-        try:
-            for el in driver.find_elements(by, sel):
-                if el.is_displayed():
-                    return el
-        except Exception:
-            pass
-    # fallback: usa o ancestral do primeiro option visível
-    opts = _visible_option_elements(driver)
-    if opts:
-        try:
-            return opts[0].find_element(By.XPATH, "./ancestor::*[self::ul or @role='listbox' or contains(@class,'br-list')][1]")
-        except Exception:
-            return opts[0].find_element(By.XPATH, "./parent::*")
-    return None
+    state = listbox_state(driver)
+    return state["el"] if state else None
 
 
 def _list_all_options_scrolling(driver, css: str = None, xpath: str = None, pause: float = 0.15, max_scrolls: int = 300):
@@ -364,7 +408,7 @@ def _list_all_options_scrolling(driver, css: str = None, xpath: str = None, paus
 
     # vai para o topo
     try:
-        driver.execute_script("arguments[0].scrollTop = 0;", container)
+        scroll_container(driver, container, "top")
     except Exception:
         pass
 
@@ -375,44 +419,31 @@ def _list_all_options_scrolling(driver, css: str = None, xpath: str = None, paus
 
     for i in range(max_scrolls):
         # coleta visíveis
-        for e in _visible_option_elements(driver):
-            try:
-                t = e.text.strip()
-                if t and "SELECIONE" not in t.upper() and t not in seen_set:
-                    seen_set.add(t)
-                    seen_list.append(t)
-            except Exception:
-                pass
+        for o in _visible_options(driver):
+            t = o["text"]
+            if t not in seen_set:
+                seen_set.add(t)
+                seen_list.append(t)
 
-        # fim se nada novo por algumas iterações E chegou no fim do scroll
         new_count = len(seen_list)
-        reached_end = False
-        try:
-            top = driver.execute_script("return arguments[0].scrollTop;", container)
-            ch = driver.execute_script("return arguments[0].clientHeight;", container)
-            sh = driver.execute_script("return arguments[0].scrollHeight;", container)
-            reached_end = (top + ch + 2) >= sh
-        except Exception:
-            pass
-
         if new_count == last_count:
             still_counter += 1
         else:
             still_counter = 0
             last_count = new_count
 
-        if reached_end and still_counter >= 1:
-            break
-
-        # scroll passo
+        # scroll passo (já devolve a posição: fim se nada novo E chegou ao fim)
         try:
-            driver.execute_script("arguments[0].scrollTop = arguments[0].scrollTop + arguments[0].clientHeight;", container)
+            state = scroll_container(driver, container, 1)
         except Exception:
+            state = None
             # fallback com END
             try:
                 _find_el(driver, css, xpath).send_keys(Keys.END)
             except Exception:
                 pass
+        if at_scroll_end(state) and still_counter >= 1:
+            break
         time.sleep(pause)
 
     return seen_list
@@ -424,18 +455,10 @@ def _select_option_by_text_via_button(driver, text: str, css: str = None, xpath:
     lo = (text or "").strip().lower()
 
     def _try_click_visible():
-        for e in _visible_option_elements(driver):
-            try:
-                t = e.text.strip()
-                if t and (t.lower() == lo or t.lower().startswith(lo)):
-                    driver.execute_script("arguments[0].scrollIntoView({block:'center'});", e)
-                    try:
-                        e.click()
-                    except Exception:
-                        driver.execute_script("arguments[0].click();", e)
-                    return True
-            except Exception:
-                pass
+        for o in _visible_options(driver):
+            t = o["text"].lower()
+            if t == lo or t.startswith(lo):
+                return click_element(driver, o["el"])
         return False
 
     # tenta no que está visível
@@ -447,8 +470,9 @@ def _select_option_by_text_via_button(driver, text: str, css: str = None, xpath:
     if container:
         for _ in range(max_scrolls):
             try:
-                driver.execute_script("arguments[0].scrollTop = arguments[0].scrollTop + Math.max(40, arguments[0].clientHeight*0.9);", container)
+                state = scroll_container(driver, container, 0.9)
             except Exception:
+                state = None
                 try:
                     input_el.send_keys(Keys.PAGE_DOWN)
                 except Exception:
@@ -456,6 +480,8 @@ def _select_option_by_text_via_button(driver, text: str, css: str = None, xpath:
             time.sleep(0.12)
             if _try_click_visible():
                 return True
+            if state and at_scroll_end(state):
+                break
 
     # fallback: digitar valor e ENTER
     try:
@@ -472,20 +498,10 @@ def _select_option_by_text_via_button(driver, text: str, css: str = None, xpath:
 
 def _select_first_option_via_button(driver, css: str = None, xpath: str = None) -> bool:
     _open_dropdown_via_button(driver, css, xpath)
-    opts = _visible_option_elements(driver)
+    opts = _visible_options(driver)
     if not opts:
         return False
-    target = opts[0]
-    try:
-        driver.execute_script("arguments[0].scrollIntoView({block:'center'});", target)
-        target.click()
-        return True
-    except Exception:
-        try:
-            driver.execute_script("arguments[0].click();", target)
-            return True
-        except Exception:
-            return False
+    return click_element(driver, opts[0]["el"])
 
 
 def _type_select(driver, text: str, css: str = None, xpath: str = None) -> bool:
@@ -508,30 +524,61 @@ def _type_select(driver, text: str, css: str = None, xpath: str = None) -> bool:
         return False
 
 
-def _get_active_option(driver, input_el):
-    """Retorna o elemento da opção atualmente ativa (highlight) para um combobox acessível."""
-    try:
-        act_id = input_el.get_attribute("aria-activedescendant")
-        if act_id:
-            try:
-                el = driver.find_element(By.ID, act_id)
-                if el.is_displayed():
-                    return el
-            except Exception:
-                pass
-        # fallbacks comuns
-        for e in driver.find_elements(By.CSS_SELECTOR, "[role='option'][aria-selected='true'], .active, li[aria-selected='true']"):
-            if e.is_displayed():
-                return e
-    except Exception:
-        pass
-    return None
+class SelectionError(RuntimeError):
+    """O combobox não respondeu (digitação/clique falhou): não significa que o item não existe."""
 
 
-def _collect_all_options_via_keyboard(driver, css: str = None, xpath: str = None, max_steps: int = 1200, pause: float = 0.08, max_duration: float = 60.0) -> list:
+def _select_by_prefix(driver, prefix: str, css: str = None, xpath: str = None, timeout: float = 4.0,
+                      tries: int = 2) -> Optional[str]:
+    """
+    Digita `prefix` no combobox (o portal filtra a lista) e clica na opção que começa com ele.
+    Retorna o rótulo completo da opção, ou None se o portal não oferece esse item.
+    Falha de interface (digitação/clique, filtro sem o prefixo) é refeita até `tries` vezes
+    e, persistindo, vira SelectionError.
+    """
+    for attempt in range(tries):
+        if attempt:
+            _close_open_dropdowns(driver, tries=1)
+        try:
+            LOG.info(f"Selecionando direto: {prefix}")
+            el = _find_el(driver, css, xpath)
+            driver.execute_script("arguments[0].scrollIntoView({block:'center'});", el)
+            el.click()
+            el.send_keys(Keys.CONTROL, "a")
+            el.send_keys(Keys.BACKSPACE)
+            el.send_keys(prefix)
+        except Exception as e:
+            LOG.warning(f"Falha ao digitar {prefix} (tentativa {attempt + 1}/{tries}): {e}")
+            continue
+        end = time.time() + timeout
+        while True:
+            hit = next((o for o in _visible_options(driver) if o["text"].startswith(prefix)), None)
+            if hit is not None or time.time() >= end:
+                break
+            time.sleep(DROPDOWN_ANIM_PAUSE)
+        if hit is not None:
+            if click_element(driver, hit["el"], scroll=False):
+                time.sleep(SLEEP_AFTER_TYPE)
+                return hit["text"]
+            LOG.warning(f"Falha ao clicar em {hit['text']} (tentativa {attempt + 1}/{tries})")
+            continue
+        # filtro aplicado com o prefixo e nenhuma opção: o portal não oferece o item
+        try:
+            typed = (el.get_attribute("value") or "").strip()
+        except Exception:
+            typed = ""
+        if typed == prefix:
+            _close_open_dropdowns(driver, tries=1)
+            return None
+        LOG.warning(f"Campo ficou com '{typed}' em vez de '{prefix}' (tentativa {attempt + 1}/{tries})")
+    _close_open_dropdowns(driver, tries=1)
+    raise SelectionError(f"não foi possível selecionar {prefix}")
+
+
+def _iter_options_via_keyboard(driver, css: str = None, xpath: str = None, max_steps: int = 1200, pause: float = 0.08, max_duration: float = 60.0) -> Iterator[str]:
     """
     Abre o dropdown, vai ao topo e percorre TODAS as opções com ARROW_DOWN,
-    capturando os textos exibidos (funciona em listas virtualizadas).
+    entregando cada texto novo assim que aparece (funciona em listas virtualizadas).
     """
     LOG.info("Coletando opções via teclado (ARIA navigation)...")
     input_el = _open_dropdown_via_button(driver, css, xpath)
@@ -539,7 +586,7 @@ def _collect_all_options_via_keyboard(driver, css: str = None, xpath: str = None
     try:
         # garante estar no topo
         if container:
-            driver.execute_script("arguments[0].scrollTop = 0;", container)
+            scroll_container(driver, container, "top")
     except Exception:
         pass
 
@@ -560,7 +607,7 @@ def _collect_all_options_via_keyboard(driver, css: str = None, xpath: str = None
         pass
     time.sleep(pause)
 
-    seen_list, seen_set = [], set()
+    seen = set()
     stagnant = 0
 
     t0 = time.time()
@@ -568,27 +615,26 @@ def _collect_all_options_via_keyboard(driver, css: str = None, xpath: str = None
         if time.time() - t0 > max_duration:
             LOG.warning("Encerrado por tempo (max_duration) na coleta via teclado.")
             break
-        text = ""
-        opt = _get_active_option(driver, input_el)
-        if opt:
-            try:
-                text = opt.text.strip()
-            except Exception:
-                text = ""
-        if not text:
-            # alguns componentes espelham o texto na value
-            try:
-                text = (input_el.get_attribute("value") or "").strip()
-            except Exception:
-                text = ""
-
-        if text and "SELECIONE" not in text.upper() and text not in seen_set:
-            seen_set.add(text)
-            seen_list.append(text)
+        # opção ativa, value do input e scroll do container numa chamada só
+        state = active_option_state(driver, input_el, container)
+        # alguns componentes espelham o texto na value
+        text = state.get("text") or state.get("value") or ""
+
+        LOG_COLLECT.debug("teclado: ativo=%r stagnant=%d", text, stagnant)
+        if text and "SELECIONE" not in text.upper() and text not in seen:
+            seen.add(text)
             stagnant = 0
+            yield text
         else:
             stagnant += 1
 
+        # critério de parada: fim do scroll e sem itens novos em algumas iterações
+        if state.get("at_end") and stagnant >= 3:
+            break
+        if stagnant >= 18:
+            LOG.debug("Sem novidades por várias iterações; encerrando varredura via teclado.")
+            break
+
         # avança para o próximo
         try:
             input_el.send_keys(Keys.ARROW_DOWN)
@@ -596,25 +642,15 @@ def _collect_all_options_via_keyboard(driver, css: str = None, xpath: str = None
             pass
         time.sleep(pause)
 
-        # critério de parada: fim do scroll e sem itens novos em algumas iterações
-        if container:
-            try:
-                top = driver.execute_script("return arguments[0].scrollTop;", container)
-                ch  = driver.execute_script("return arguments[0].clientHeight;", container)
-                sh  = driver.execute_script("return arguments[0].scrollHeight;", container)
-                if (top + ch + 3) >= sh and stagnant >= 3:
-                    break
-            except Exception:
-                pass
-        if stagnant >= 18:
-            LOG.debug("Sem novidades por várias iterações; encerrando varredura via teclado.")
-            break
+    LOG.info(f"Total coletado (teclado): {len(seen)}")
 
-    LOG.info(f"Total coletado (teclado): {len(seen_list)}")
-    return seen_list
 
+def _collect_all_options_via_keyboard(driver, css: str = None, xpath: str = None, max_steps: int = 1200, pause: float = 0.08, max_duration: float = 60.0) -> list:
+    """Lista completa (ordem da tela) de _iter_options_via_keyboard."""
+    return list(_iter_options_via_keyboard(driver, css, xpath, max_steps, pause, max_duration))
 
-def _collect_all_options_via_aria(driver, css: str = None, xpath: str = None, max_guard: int = 2000, pause: float = 0.06, max_duration: float = 60.0) -> list:
+
+def _iter_options_via_aria(driver, css: str = None, xpath: str = None, max_guard: int = 2000, pause: float = 0.06, max_duration: float = 60.0) -> Iterator[str]:
     """Percorre TODAS as opções usando aria-activedescendant (funciona com listas virtualizadas)."""
     LOG.info("Coletando opções via aria-activedescendant...")
     input_el = _open_dropdown_via_button(driver, css, xpath)
@@ -628,7 +664,8 @@ def _collect_all_options_via_aria(driver, css: str = None, xpath: str = None, ma
     except Exception:
         pass
 
-    seen_texts: list[str] = []
+    container = _find_listbox_container(driver)
+    seen = set()
     last_id = None
     last_index = -1
     stall = 0
@@ -644,22 +681,18 @@ def _collect_all_options_via_aria(driver, css: str = None, xpath: str = None, ma
         if time.time() - t0 > max_duration:
             LOG.warning("Encerrado por tempo (max_duration) na coleta via aria.")
             break
-        act_id = ""
-        try:
-            act_id = input_el.get_attribute("aria-activedescendant") or ""
-        except Exception:
-            pass
+        # id ativo + texto do item + fim do container numa chamada só
+        state = active_option_state(driver, input_el, container)
+        act_id = state.get("id") or ""
 
+        LOG_COLLECT.debug("aria: activedescendant=%r stall=%d", act_id, stall)
         if act_id and act_id != last_id:
             # pega o texto do item ativo
-            try:
-                opt = driver.find_element(By.ID, act_id)
-                txt = (opt.text or "").strip()
-            except Exception:
-                txt = (input_el.get_attribute("value") or "").strip()
+            txt = state.get("text") or state.get("value") or ""
 
-            if txt and "SELECIONE" not in txt.upper() and txt not in seen_texts:
-                seen_texts.append(txt)
+            if txt and "SELECIONE" not in txt.upper() and txt not in seen:
+                seen.add(txt)
+                yield txt
 
             # detecta wrap (índice caiu)
             idx = parse_index(act_id)
@@ -671,220 +704,229 @@ def _collect_all_options_via_aria(driver, css: str = None, xpath: str = None, ma
         else:
             stall += 1
 
+        # fim físico + sem novidades => parar
+        if state.get("at_end") and stall >= 10:
+            LOG.debug("Chegou ao fim do container (aria) sem novidades; encerrando.")
+            break
+
         # desce 1
         try:
             input_el.send_keys(Keys.ARROW_DOWN)
         except Exception:
             pass
         time.sleep(pause)
+    LOG.info(f"Total coletado (aria): {len(seen)}")
 
-        # fim físico + sem novidades => parar
-        container = _find_listbox_container(driver)
-        at_end = False
-        if container:
-            try:
-                top = driver.execute_script("return arguments[0].scrollTop;", container)
-                ch  = driver.execute_script("return arguments[0].clientHeight;", container)
-                sh  = driver.execute_script("return arguments[0].scrollHeight;", container)
-                at_end = (top + ch + 2) >= sh
-            except Exception:
-                pass
-        if at_end and stall >= 10:
-            LOG.debug("Chegou ao fim do container (aria) sem novidades; encerrando.")
+
+def _collect_all_options_via_aria(driver, css: str = None, xpath: str = None, max_guard: int = 2000, pause: float = 0.06, max_duration: float = 60.0) -> list:
+    """Lista completa (ordem da tela) de _iter_options_via_aria."""
+    return list(_iter_options_via_aria(driver, css, xpath, max_guard, pause, max_duration))
+
+
+# Varredura do listbox #cnpjRaiz em fatias: cada chamada abre a lista (se fechada), volta à
+# posição `start` do scroll, rola por até `budget` ms na direção `dir` e devolve os textos
+# vistos + a posição final. Entre fatias a página fica livre para as consultas.
+_CNPJ_SCAN_CHUNK_JS = r"""
+const [start, dir, budget, done] = arguments;
+(async () => {
+  const sleep = (ms) => new Promise(r => setTimeout(r, ms));
+  try {
+    const input = document.getElementById("cnpjRaiz");
+    if (!input) return done({error:"input #cnpjRaiz não encontrado"});
+
+    const popupId = input.getAttribute("aria-owns") || input.getAttribute("aria-controls") || "cnpjRaiz-popup";
+    const findListbox = () => document.getElementById(popupId) ||
+                        document.querySelector('#cnpjRaiz-popup,[role="listbox"][aria-labelledby="cnpjRaiz-label"]');
+    let listbox = findListbox();
+    if (!listbox) {
+      // Abre a lista (clica no botão irmão)
+      try { input.click(); } catch(e){}
+      try {
+        var btn = input.parentElement && input.parentElement.querySelector("button");
+        if (btn) btn.click();
+      } catch(e){}
+      await sleep(150);
+      listbox = findListbox();
+    }
+    if (!listbox) return done({error:"listbox não encontrado"});
+
+    // Encontra o container com maior overflow (onde o scroll realmente acontece)
+    const findScrollable = (root) => {
+      let best = root, bestOv = root.scrollHeight - root.clientHeight;
+      const walker = document.createTreeWalker(root, NodeFilter.SHOW_ELEMENT);
+      while (walker.nextNode()) {
+        const el = walker.currentNode;
+        const ov = el.scrollHeight - el.clientHeight;
+        if (ov > bestOv + 4) { best = el; bestOv = ov; }
+      }
+      return best;
+    };
+    const scroller = findScrollable(listbox);
+
+    const seen = new Set();
+    const addVisible = () => listbox.querySelectorAll('[role="option"], [id^="cnpjRaiz-option-"]').forEach(el => {
+      const t = (el.textContent || "").trim();
+      if (t && !/SELECIONE/i.test(t)) seen.add(t);
+    });
+
+    // retoma de onde a fatia anterior parou
+    if (start > 0 && scroller.scrollTop !== start) {
+      scroller.scrollTop = Math.min(start, scroller.scrollHeight);
+      await sleep(60);
+    }
+    addVisible();
+    const deadline = Date.now() + budget;
+    const step = Math.max(250, Math.floor(scroller.clientHeight));
+    let lastSize = seen.size, stagnant = 0, end = false;
+    while (Date.now() < deadline) {
+      if (dir > 0 && (scroller.scrollTop + scroller.clientHeight) >= (scroller.scrollHeight - 2)) { end = true; break; }
+      if (dir < 0 && scroller.scrollTop <= 0) { end = true; break; }
+      scroller.scrollTop = dir > 0 ? Math.min(scroller.scrollTop + step, scroller.scrollHeight)
+                                   : Math.max(scroller.scrollTop - step, 0);
+      await sleep(dir > 0 ? 45 : 35);
+      addVisible();
+      if (seen.size === lastSize) stagnant++; else { stagnant = 0; lastSize = seen.size; }
+      if (stagnant >= 10) { end = true; break; }
+    }
+    return done({texts: Array.from(seen), top: scroller.scrollTop, end: end});
+  } catch (e) {
+    return done({error: String(e)});
+  }
+})();
+"""
+
+
+def _iter_cnpj_batches_via_js(driver, chunk_s: float = 3.0, max_duration: float = 600.0) -> Iterator[list]:
+    """
+    Varre o listbox do #cnpjRaiz em fatias de `chunk_s` segundos e entrega, a cada fatia,
+    só os rótulos ainda não vistos (dedupe por set). Retoma pelo scrollTop salvo, então o
+    consumidor pode consultar os CNPJs de uma fatia antes de pedir a próxima.
+    Ao chegar no fim, faz uma passada de segurança subindo até o topo.
+    `max_duration` conta só o tempo de varredura, não o que o consumidor gasta entre fatias.
+    """
+    seen = set()
+    pos, direction = 0, 1
+    scanned = 0.0
+    while scanned < max_duration:
+        t0 = time.time()
+        try:
+            data = driver.execute_async_script(_CNPJ_SCAN_CHUNK_JS, pos, direction, int(chunk_s * 1000))
+        except Exception as e:
+            LOG.warning(f"Coleta via JS falhou: {e}")
             break
-    LOG.info(f"Total coletado (aria): {len(seen_texts)}")
-    return seen_texts
+        finally:
+            scanned += time.time() - t0
+        if not isinstance(data, dict) or data.get("error"):
+            LOG.warning(f"Coleta via JS falhou: {data.get('error') if isinstance(data, dict) else data}")
+            break
+        batch = []
+        for t in data.get("texts") or []:
+            t = (t or "").strip()
+            if t and t not in seen:
+                seen.add(t)
+                batch.append(t)
+        LOG_COLLECT.debug("js: fatia dir=%d top=%s novos=%d total=%d", direction, data.get("top"), len(batch), len(seen))
+        pos = data.get("top") or 0
+        if batch:
+            yield batch
+        if data.get("end"):
+            if direction < 0:
+                break
+            direction = -1
+    else:
+        LOG.warning(f"Coleta via JS interrompida após {scanned:.0f}s de varredura (limite {max_duration:.0f}s); "
+                    f"a lista pode estar incompleta.")
+    LOG.info(f"Total coletado via JS: {len(seen)}")
 
 
 def _collect_cnpjs_via_js(driver) -> list:
     """Usa JS no contexto da página para varrer todo o listbox do #cnpjRaiz e retornar TODOS os textos."""
-    js = r"""
-    const done = arguments[0];
-    (async () => {
-      const sleep = (ms) => new Promise(r => setTimeout(r, ms));
-      try {
-        const input = document.getElementById("cnpjRaiz");
-        if (!input) return done({error:"input #cnpjRaiz não encontrado"});
-
-        // Abre a lista (clica no botão irmão)
-        try { input.click(); } catch(e){}
-        try {
-          var btn = input.parentElement && input.parentElement.querySelector("button");
-          if (btn) btn.click();
-        } catch(e){}
-        await sleep(150);
-
-        const popupId = input.getAttribute("aria-owns") || input.getAttribute("aria-controls") || "cnpjRaiz-popup";
-        const listbox = document.getElementById(popupId) ||
-                        document.querySelector('#cnpjRaiz-popup,[role="listbox"][aria-labelledby="cnpjRaiz-label"]');
-        if (!listbox) return done({error:"listbox não encontrado"});
-
-        // Encontra o container com maior overflow (onde o scroll realmente acontece)
-        const findScrollable = (root) => {
-          let best = root, bestOv = root.scrollHeight - root.clientHeight;
-          const walker = document.createTreeWalker(root, NodeFilter.SHOW_ELEMENT);
-          while (walker.nextNode()) {
-            const el = walker.currentNode;
-            const ov = el.scrollHeight - el.clientHeight;
-            if (ov > bestOv + 4) { best = el; bestOv = ov; }
-          }
-          return best;
-        };
-        const scroller = findScrollable(listbox);
-
-        const getOptionTexts = () =>
-          Array.from(listbox.querySelectorAll('[role="option"], [id^="cnpjRaiz-option-"]'))
-               .map(el => (el.textContent || "").trim())
-               .filter(Boolean);
-
-        const seen = new Set();
-        const addVisible = () => getOptionTexts().forEach(t => { if (t && !/SELECIONE/i.test(t)) seen.add(t); });
-
-        // Varrer descendo (com limite de tempo)
-        const deadline = Date.now() + 90000; // 90s hard limit
-        addVisible();
-        let lastSize = -1, stagnant = 0;
-        const step = Math.max(250, Math.floor(scroller.clientHeight));
-        for (let guard = 0; guard < 2000; guard++) {
-          if (Date.now() > deadline) break;
-           if ((scroller.scrollTop + scroller.clientHeight) >= (scroller.scrollHeight - 2)) break;
-           scroller.scrollTop = Math.min(scroller.scrollTop + step, scroller.scrollHeight);
-           await sleep(45);
-           addVisible();
-           if (seen.size === lastSize) stagnant++; else { stagnant = 0; lastSize = seen.size; }
-           if (stagnant >= 10) break;
-         }
- 
-        // Passada de segurança voltando ao topo
-        for (let guard = 0; guard < 1000; guard++) {
-          if (Date.now() > deadline) break;
-           if (scroller.scrollTop <= 0) break;
-           scroller.scrollTop = Math.max(scroller.scrollTop - step, 0);
-           await sleep(35);
-           addVisible();
-         }
- 
-         return done(Array.from(seen));
-       } catch (e) {
-         return done({error: String(e)});
-       }
-    })();
-    """
-    try:
-        data = driver.execute_async_script(js)
-        if isinstance(data, dict) and data.get("error"):
-            LOG.warning(f"Coleta via JS falhou: {data.get('error')}")
-            return []
-        if isinstance(data, list):
-            # normaliza e mantém ordem
-            seen = []
-            seen_set = set()
-            for t in data:
-                t = (t or "").strip()
-                if t and t not in seen_set:
-                    seen.append(t); seen_set.add(t)
-            LOG.info(f"Total coletado via JS: {len(seen)}")
-            return seen
-    except Exception:
-        pass
-    return []
+    return [t for batch in _iter_cnpj_batches_via_js(driver, max_duration=90.0) for t in batch]
 
-def collect_all_cnpjs_ano(driver, ano: str) -> list:
-    """Define vigência e coleta TODOS os CNPJs (preferência: JS; fallback: ARIA)."""
-    LOG.info(f"====== Vigência {ano} ======")
-    set_combobox_value_by_typing(driver, X_COMBO, str(ano))
-    time.sleep(SLEEP_AFTER_TYPE)  # espera solicitada
 
-    # 1) Tenta via JS (varre o listbox inteiro no DOM)
-    cnpj_list = _collect_cnpjs_via_js(driver)
+def iter_cnpj_batches_ano(driver, ano: str) -> Iterator[list]:
+    """
+    Define a vigência e entrega os CNPJs em lotes conforme são descobertos
+    (preferência: JS em fatias; fallback: ARIA), para as consultas começarem já.
+    """
+    LOG.info(f"====== Vigência {ano} ======")
+    select_vigencia(driver, ano)
 
-    # 2) Fallback robusto via ARIA/teclado
-    if not cnpj_list or len(cnpj_list) < 2:
-        cnpj_list = _collect_all_options_via_aria(driver, css=CNPJ_INPUT_CSS, max_guard=2000)
-        if not cnpj_list:
+    seen = set()
+    for batch in _iter_cnpj_batches_via_js(driver, chunk_s=DISCOVERY_CHUNK_S):
+        seen.update(batch)
+        yield batch
+
+    # Fallback robusto via ARIA/teclado
+    if len(seen) < 2:
+        batch = [t for t in _iter_options_via_aria(driver, css=CNPJ_INPUT_CSS, max_guard=2000) if t not in seen]
+        if not batch and not seen:
             _select_first_option_via_button(driver, css=CNPJ_INPUT_CSS)
-            cnpj_list = _collect_all_options_via_aria(driver, css=CNPJ_INPUT_CSS, max_guard=2000)
+            batch = _collect_all_options_via_aria(driver, css=CNPJ_INPUT_CSS, max_guard=2000)
+        seen.update(batch)
+        if batch:
+            yield batch
 
-    LOG.info(f"CNPJs coletados para {ano}: {len(cnpj_list)}")
-    return cnpj_list
+    LOG.info(f"CNPJs coletados para {ano}: {len(seen)}")
+
+
+def collect_all_cnpjs_ano(driver, ano: str) -> list:
+    """Define vigência e coleta TODOS os CNPJs (preferência: JS; fallback: ARIA)."""
+    return [t for batch in iter_cnpj_batches_ano(driver, ano) for t in batch]
 
 
 def _close_open_dropdowns(driver, tries: int = 3):
     """Fecha listboxes/combos abertos para não cobrir o botão Consultar."""
     for _ in range(tries):
-        try:
-            driver.execute_script("""
-                try { document.activeElement && document.activeElement.blur(); } catch(e){}
-                try { document.body && document.body.click(); } catch(e){}
-            """)
-        except Exception:
-            pass
         try:
             # ESC ajuda a fechar o popup de opções
             driver.switch_to.active_element.send_keys(Keys.ESCAPE)
         except Exception:
             pass
-        time.sleep(0.15)
-        # Se ainda houver listbox visível, tenta de novo
-        try:
-            visible = driver.execute_script("""
-                const qs = (sel) => Array.from(document.querySelectorAll(sel))
-                  .filter(e => e.offsetParent !== null);
-                const a = qs('[role="listbox"]');
-                const b = qs('[id$="-popup"]');
-                return (a.length + b.length) > 0;
-            """)
-            if not visible:
-                return
-        except Exception:
+        # checagem após a animação; se ainda houver listbox, blur + clique no body + ESC por script
+        visible = close_dropdowns(driver, pause=DROPDOWN_ANIM_PAUSE, close=False)
+        if visible:
+            visible = close_dropdowns(driver, pause=DROPDOWN_ANIM_PAUSE)
+        if not visible:
             return
 
+
+CONSULTAR_XPATHS = [
+    X_BTN_CONSULTA,
+    "//button[normalize-space()='Consultar']",
+    "//button[contains(@class,'br-button')][contains(normalize-space(.),'Consultar')]",
+]
+CONSULTAR_CSS = ["button.br-button"]
+# o CSS genérico pega qualquer botão do gov.br: só como último recurso, nunca promovido
+SELECTORS.register("consultar", CONSULTAR_XPATHS, fallback=CONSULTAR_CSS)
+
+
+def _consultar_button_state(driver):
+    """Botão Consultar + estado (disabled/coberto) em um round trip; None se não visível."""
+    return SELECTORS.find_one(driver, "consultar", detail=True)
+
+
 def _find_consultar_button(driver):
     """Localiza o botão Consultar por vários seletores robustos."""
-    candidates = [
-        (By.XPATH, X_BTN_CONSULTA),
-        (By.XPATH, "//button[normalize-space()='Consultar']"),
-        (By.XPATH, "//button[contains(@class,'br-button')][contains(normalize-space(.),'Consultar')]"),
-        (By.CSS_SELECTOR, "button.br-button"),
-    ]
-    for by, sel in candidates:
-        try:
-            els = driver.find_elements(by, sel)
-            for el in els:
-                if el.is_displayed():
-                    return el
-        except Exception:
-            continue
-    return None
+    state = _consultar_button_state(driver)
+    return state["el"] if state else None
 
 def _wait_button_enabled(driver, timeout: int = 25):
-    """Espera o botão Consultar existir, estar visível e não estar 'disabled'."""
-    t0 = time.time()
-    last_err = None
-    while time.time() - t0 < timeout:
-        btn = _find_consultar_button(driver)
-        if btn:
-            try:
-                aria_dis = (btn.get_attribute("aria-disabled") or "").lower() in ("true", "1")
-                dis = btn.get_attribute("disabled") is not None
-                if btn.is_displayed() and (not aria_dis) and (not dis):
-                    return btn
-            except Exception as e:
-                last_err = e
-        time.sleep(0.15)
-    if last_err:
-        raise TimeoutException(str(last_err))
-    raise TimeoutException("Botão Consultar não ficou habilitado/visível a tempo.")
+    """Espera o botão Consultar existir, estar visível e não estar 'disabled' (retorna o estado)."""
+    # um único laço de polling no registro: a vitória do seletor é contada uma vez só
+    state = SELECTORS.find_one(driver, "consultar", timeout, detail=True, accept=lambda n, h: not h.get("disabled"))
+    if not state:
+        raise TimeoutException("Botão Consultar não ficou habilitado/visível a tempo.")
+    return state
 
 def _element_not_covered(driver, el) -> bool:
     """Confere se o elemento não está coberto por overlay no ponto central."""
     try:
-        rect = driver.execute_script("""
-            const r = arguments[0].getBoundingClientRect();
-            return {x: (r.left + r.right)/2, y: (r.top + r.bottom)/2};
-        """, el)
-        topEl = driver.execute_script("return document.elementFromPoint(arguments[0].x, arguments[0].y);", rect)
-        return topEl is not None and (topEl == el or el.contains(topEl))
+        return bool(driver.execute_script("""
+            const el = arguments[0], r = el.getBoundingClientRect();
+            const top = document.elementFromPoint((r.left + r.right)/2, (r.top + r.bottom)/2);
+            return top !== null && (top === el || el.contains(top));
+        """, el))
     except Exception:
         return True
 
@@ -895,17 +937,20 @@ def click_consultar(driver, timeout: int = 30) -> bool:
         _close_open_dropdowns(driver, tries=2)
 
         try:
-            btn = _wait_button_enabled(driver, timeout=max(10, timeout - attempt*5))
+            state = _wait_button_enabled(driver, timeout=max(10, timeout - attempt*5))
         except TimeoutException:
             LOG.warning("Tempo esgotado esperando botão habilitar.")
             continue
+        btn = state["el"]
 
-        try:
-            driver.execute_script("arguments[0].scrollIntoView({block:'center'});", btn)
-        except Exception:
-            pass
+        if not state.get("in_view"):
+            try:
+                driver.execute_script("arguments[0].scrollIntoView({block:'center'});", btn)
+            except Exception:
+                pass
+            state["covered"] = not _element_not_covered(driver, btn)
 
-        if not _element_not_covered(driver, btn):
+        if state.get("covered"):
             LOG.info("Botão coberto por overlay; fechando dropdowns e tentando novamente.")
             _close_open_dropdowns(driver, tries=2)
 
@@ -926,79 +971,470 @@ def click_consultar(driver, timeout: int = 30) -> bool:
 
     return False
 
-def consultar_para_todos(driver, anos=("2025", "2026")):
-    for ano in anos:
-        cnpj_list = collect_all_cnpjs_ano(driver, str(ano))
+def select_vigencia(driver, ano: str):
+    """Seleciona a vigência no primeiro combobox."""
+    set_combobox_value_by_typing(driver, X_COMBO, str(ano))
+    time.sleep(SLEEP_AFTER_TYPE)  # espera solicitada
+
+
+def _restore_context(driver, ano: str, cnpj: str):
+    """Refaz vigência + CNPJ raiz numa aba nova (usado na reciclagem de aba)."""
+    WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.XPATH, X_COMBO)))
+    select_vigencia(driver, ano)
+    if not _type_select(driver, cnpj, css=CNPJ_INPUT_CSS):
+        raise RuntimeError(f"não foi possível reselecionar o CNPJ {cnpj}")
+    WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, X_ESTABELECIMENTOS)))
 
-        for cnpj in cnpj_list:
-            LOG.info(f"[{ano}] CNPJ => {cnpj}")
-            # Seleciona CNPJ
-            if not _type_select(driver, cnpj, css=CNPJ_INPUT_CSS):
-                if not _select_option_by_text_via_button(driver, cnpj, css=CNPJ_INPUT_CSS):
-                    LOG.warning(f"Falha ao selecionar CNPJ: {cnpj}")
-                    continue
 
-            WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, X_ESTABELECIMENTOS)))
-            time.sleep(SLEEP_AFTER_TYPE)
+def _record_row(row: dict, store=None, run_id: Optional[int] = None, report=None):
+    """Grava uma linha no histórico (SQLite) e no relatório (upsert ou append)."""
+    if store is not None:
+        save_row(store, run_id, row)
 
+    if report is not None:
+        report.upsert(row)
+    else:
+        append_row_to_excel(
+            path=REPORT_PATH,
+            row=row,
+            headers=REPORT_HEADERS,
+        )
+
+
+def _page_state(driver) -> Dict:
+    """Estado da tela de consulta (page_state.classify_page) com os XPaths deste módulo."""
+    return classify_page(driver, form_xpath=X_COMBO, result_xpath=X_INFO_ROOT)
+
+
+def _wait_state(driver, states, timeout: float = 15.0) -> Dict:
+    return wait_page_state(driver, states, timeout=timeout, form_xpath=X_COMBO, result_xpath=X_INFO_ROOT)
+
+
+def ensure_form(driver, ano: str) -> bool:
+    """
+    Antes de cada CNPJ: confere o estado da aba em um round trip. Aba fechada ou erro do
+    portal => reabre a tela e reseleciona a vigência (retorna True); SSO/captcha => PageStateError.
+    """
+    st = _wait_state(driver, (FORM_READY, RESULT, NO_DATA, PORTAL_ERROR), timeout=5)
+    if st["estado"] in (FORM_READY, RESULT, NO_DATA):
+        return False
+    if st["estado"] in (SSO_LOGIN, CAPTCHA):
+        raise PageStateError(st["estado"], st.get("url", ""))
+    LOG.warning(f"[{ano}] Página em estado '{st['estado']}' ({st.get('detalhe')}); reabrindo a tela de consulta")
+    if st["estado"] == TAB_GONE:
+        _ensure_window(driver, revive_url=SSO_URL)
+    else:
+        driver.get(SSO_URL)
+    st = _wait_state(driver, (FORM_READY,), timeout=30)
+    if st["estado"] != FORM_READY:
+        raise PageStateError(st["estado"], st.get("detalhe", ""))
+    select_vigencia(driver, ano)
+    return True
+
+
+def _consultar_cnpj_checked(driver, ano: str, cnpj: str, **kw) -> Optional[list]:
+    """consultar_cnpj precedido de ensure_form; aba perdida no meio do CNPJ => recupera e refaz uma vez."""
+    for attempt in range(2):
+        ensure_form(driver, ano)
+        try:
+            return consultar_cnpj(driver, ano, cnpj, **kw)
+        except PageStateError as e:
+            if e.state != TAB_GONE or attempt:
+                raise
+            LOG.warning(f"[{ano}] Aba perdida durante {cnpj}; refazendo o CNPJ")
+    return None
+
+
+@contextmanager
+def _phase(driver, metrics, fase: str, ano: str = "", cnpj: str = "", estab: str = ""):
+    """
+    Mede uma fase em `metrics` (SweepMetrics, se ligado) e, com gravação ativa
+    (driver._fap_recorder), guarda o passo com o snapshot do DOM ao final.
+    """
+    t0 = time.time()
+    with (metrics.phase(fase, ano, cnpj, estab) if metrics is not None else nullcontext()):
+        yield
+    rec = getattr(driver, "_fap_recorder", None)
+    if rec is not None:
+        rec.step(driver, fase, ano, cnpj, estab, t0, time.time())
+
+
+def consultar_cnpj(driver, ano: str, cnpj: str, on_row=None, watchdog: Optional[TabWatchdog] = None,
+                   limiter=None, metrics: Optional[SweepMetrics] = None, direct: bool = False,
+                   estabs: Optional[List[str]] = None, on_missing=None) -> Optional[list]:
+    """
+    Consulta todos os estabelecimentos de um CNPJ raiz (com a vigência já selecionada).
+    Retorna as linhas extraídas, ou None se o CNPJ não pôde ser selecionado.
+    `limiter` (acquire/report) dosa cada consulta conforme a resposta do portal;
+    `metrics` recebe a duração de cada fase e as retentativas/falhas.
+    Modo carteira (`direct`): `cnpj` é o prefixo '53.458.313' e `estabs` (se dado) os rótulos
+    '53.458.313/0001-54' a consultar, sem coletar a lista; o que o portal não oferece vai
+    para `on_missing(cnpj, estab)` (estab vazio = a raiz inteira).
+    """
+    LOG.info(f"[{ano}] CNPJ => {cnpj}")
+    restore_cnpj = cnpj  # rótulo para reselecionar numa aba nova (watchdog)
+    # Seleciona CNPJ
+    with _phase(driver, metrics, "selecao", ano, cnpj):
+        if direct:
+            try:
+                label = _select_by_prefix(driver, cnpj, css=CNPJ_INPUT_CSS)
+            except SelectionError as e:
+                LOG.warning(f"Falha ao selecionar CNPJ: {cnpj} ({e})")
+                if metrics is not None:
+                    metrics.failure("selecao_cnpj")
+                return None
+            if label is None:
+                LOG.warning(f"[{ano}] CNPJ {cnpj} não oferecido pelo portal")
+                if on_missing is not None:
+                    on_missing(cnpj, "")
+                return None
+            restore_cnpj = label
+        elif not _type_select(driver, cnpj, css=CNPJ_INPUT_CSS):
+            if metrics is not None:
+                metrics.retry("selecao")
+            if not _select_option_by_text_via_button(driver, cnpj, css=CNPJ_INPUT_CSS):
+                LOG.warning(f"Falha ao selecionar CNPJ: {cnpj}")
+                if metrics is not None:
+                    metrics.failure("selecao_cnpj")
+                return None
+
+        WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, X_ESTABELECIMENTOS)))
+        time.sleep(SLEEP_AFTER_TYPE)
+
+    if estabs is not None:
+        estab_list = list(estabs)
+    else:
+        with _phase(driver, metrics, "coleta", ano, cnpj):
             estab_list = _collect_all_options_via_keyboard(driver, xpath=X_ESTABELECIMENTOS, max_duration=45.0)
             if not estab_list:
+                if metrics is not None:
+                    metrics.retry("coleta")
                 _select_first_option_via_button(driver, xpath=X_ESTABELECIMENTOS)
                 estab_list = _collect_all_options_via_keyboard(driver, xpath=X_ESTABELECIMENTOS, max_duration=45.0)
-            LOG.info(f"[{ano}] Estabelecimentos detectados: {len(estab_list)}")
-
-            for estab in estab_list:
-                LOG.info(f"[{ano}] {cnpj} -> Estabelecimento => {estab}")
-                if not _type_select(driver, estab, xpath=X_ESTABELECIMENTOS):
+        LOG.info(f"[{ano}] Estabelecimentos detectados: {len(estab_list)}")
+
+    rows = []
+    if limiter is not None:
+        drain_http_statuses(driver)  # descarta o que veio antes desta consulta
+    for estab in estab_list:
+        offered = estab
+        raised = False
+        try:
+            if limiter is not None:
+                waited = limiter.acquire()
+                if waited > 1:
+                    LOG.info(f"Limitador: aguardou {waited:.1f}s")
+            LOG.info(f"[{ano}] {cnpj} -> Estabelecimento => {estab}")
+            with _phase(driver, metrics, "selecao", ano, cnpj, estab):
+                if estabs is not None:
+                    try:
+                        offered = _select_by_prefix(driver, estab, xpath=X_ESTABELECIMENTOS)
+                    except SelectionError as e:
+                        LOG.warning(f"Falha ao selecionar {estab} ({e}); avançando para o próximo.")
+                        if metrics is not None:
+                            metrics.failure("selecao_estab")
+                        continue
+                elif not _type_select(driver, estab, xpath=X_ESTABELECIMENTOS):
+                    if metrics is not None:
+                        metrics.retry("selecao")
                     _select_option_by_text_via_button(driver, estab, xpath=X_ESTABELECIMENTOS)
-                time.sleep(SLEEP_AFTER_TYPE)
+                if estabs is None:
+                    time.sleep(SLEEP_AFTER_TYPE)
+            if estabs is not None and offered is None:
+                LOG.warning(f"[{ano}] Estabelecimento {estab} não oferecido pelo portal")
+                if on_missing is not None:
+                    on_missing(cnpj, estab)
+                continue
 
+            with _phase(driver, metrics, "consulta", ano, cnpj, estab):
                 # FECHA DROPDOWNS E CLICA COM RETRY
                 if not click_consultar(driver, timeout=30):
                     LOG.error("Não consegui clicar em Consultar; avançando para o próximo.")
+                    if metrics is not None:
+                        metrics.failure("consultar")
+                    if limiter is not None:
+                        limiter.report(30.0, drain_http_statuses(driver), _page_state(driver)["estado"] == CAPTCHA)
                     continue
 
                 LOG.info("Clique em Consultar realizado; aguardando 5s...")
+                t_click = time.monotonic()
                 time.sleep(SLEEP_AFTER_CONSULT)
 
-                try:
-                    WebDriverWait(driver, 15).until(EC.visibility_of_element_located((By.XPATH, X_INFO_ROOT)))
-                except Exception:
-                    time.sleep(0.8)
+                # resultado, "sem dados", erro ou sessão perdida: o que vier primeiro, sem esperar timeout
+                st = _wait_state(driver, (RESULT, NO_DATA, PORTAL_ERROR), timeout=15)
+                if st["estado"] != RESULT and metrics is not None:
+                    metrics.retry("resultado")
+
+            if limiter is not None:
+                latency = max(0.0, time.monotonic() - t_click - SLEEP_AFTER_CONSULT)
+                limiter.report(latency, drain_http_statuses(driver), st["estado"] == CAPTCHA)
+
+            if st["estado"] in SESSION_LOST:
+                if metrics is not None:
+                    metrics.failure(st["estado"])
+                raise PageStateError(st["estado"], st.get("url", ""))
+            if st["estado"] in (NO_DATA, PORTAL_ERROR):
+                LOG.warning(f"[{ano}] {estab}: {'sem dados' if st['estado'] == NO_DATA else 'erro do portal'} "
+                            f"({st.get('detalhe')}); avançando para o próximo.")
+                if metrics is not None:
+                    metrics.failure(st["estado"])
+                continue
 
-                row = extract_result_data(driver, ano, estab_label=estab)
+            with _phase(driver, metrics, "extracao", ano, cnpj, estab):
+                row = extract_result_data(driver, ano, estab_label=offered)
+
+            # remover Estab_Nome do relatório
+            row.pop("Estab_Nome", None)
+
+            rows.append(row)
+            if metrics is not None:
+                metrics.row_done(ano)
+            if on_row is not None:
+                on_row(row)
+        except BaseException:
+            raised = True
+            raise
+        finally:
+            # Entre itens (também após falha/"continue"): se a aba inchou, troca por uma nova
+            # mantendo vigência/CNPJ; não com exceção subindo (ex.: sessão perdida)
+            if watchdog is not None and not raised:
+                watchdog.tick(driver, SSO_URL, restore=lambda d, a=ano, c=restore_cnpj: _restore_context(d, a, c))
+    if metrics is not None:
+        metrics.cnpj_done(ano)
+    return rows
+
+
+def consultar_para_todos(driver, anos=("2025", "2026"), store=None, run_id: Optional[int] = None, report=None,
+                         watchdog: Optional[TabWatchdog] = None, priorities: Optional[Dict[str, int]] = None,
+                         limiter=None, metrics: Optional[SweepMetrics] = None):
+    priorities = priorities or {}
+    for ano in anos:
+        if STREAM_DISCOVERY and not priorities:
+            # Consulta cada lote assim que é descoberto; dentro do lote, maiores primeiro
+            n = 0
+            for batch in iter_cnpj_batches_ano(driver, str(ano)):
+                if store is not None:
+                    batch, _ = plan(batch, store, str(ano))
+                if metrics is not None:
+                    metrics.add_cnpjs(ano, len(batch))
+                for cnpj in batch:
+                    _consultar_cnpj_checked(
+                        driver, str(ano), cnpj,
+                        on_row=lambda row: _record_row(row, store, run_id, report),
+                        watchdog=watchdog,
+                        limiter=limiter,
+                        metrics=metrics,
+                    )
+                n += len(batch)
+                LOG.info(f"[{ano}] {n} CNPJs consultados até aqui (descoberta em andamento)")
+            continue
 
-                # remover Estab_Nome do relatório
-                row.pop("Estab_Nome", None)
+        cnpj_list = collect_all_cnpjs_ano(driver, str(ano))
 
-                append_row_to_excel(
-                    path="relatorio_fap.xlsx",
-                    row=row,
-                    headers=[
-                        "CNPJ_Raiz", "Razao_Social", "CNPJ_Estab",
-                        "UF", "Municipio", "Vigencia", "Aliquota", "Data_Consulta",
-                    ],
-                )
-
-def main():
-    # Valida IPs "pinnados" antes de automatizar (evita surpresas)
-    if VALIDATE_IPS_BEFORE and BIND_DEST_IPS:
-        validate_host_ip_map_or_fail(BIND_DEST_IPS)
+        # Maiores carteiras (pelo histórico) e prioridades primeiro
+        if store is not None or priorities:
+            cnpj_list, costs = plan(cnpj_list, store, str(ano), priorities)
+            LOG.info(f"[{ano}] Ordem por custo: estimativa {sum(costs.values()) / 3600:.1f} h")
+        group_ends = priority_groups(cnpj_list, priorities)
+        if metrics is not None:
+            metrics.add_cnpjs(ano, len(cnpj_list))
 
+        for cnpj in cnpj_list:
+            _consultar_cnpj_checked(
+                driver, str(ano), cnpj,
+                on_row=lambda row: _record_row(row, store, run_id, report),
+                watchdog=watchdog,
+                limiter=limiter,
+                metrics=metrics,
+            )
+            # Fim de um grupo de prioridade: grava o relatório já, sem esperar o resto
+            if cnpj in group_ends:
+                if report is not None:
+                    report.flush()
+                LOG.info(f"[{ano}] Prioridade {group_ends[cnpj]} concluída; relatório atualizado.")
+
+
+def consultar_carteira(driver, carteira: Dict[str, Dict[str, Optional[set]]], store=None, run_id: Optional[int] = None,
+                       report=None, watchdog: Optional[TabWatchdog] = None, limiter=None,
+                       metrics: Optional[SweepMetrics] = None) -> List[Dict]:
+    """
+    Consulta só os itens da carteira (portfolio.load_portfolio), sem descoberta pelos dropdowns:
+    custo proporcional à lista. Retorna os itens que o portal não ofereceu.
+    """
+    missing: List[Dict] = []
+    for ano, raizes in carteira.items():
+        LOG.info(f"====== Vigência {ano} (carteira: {len(raizes)} CNPJs) ======")
+        select_vigencia(driver, ano)
+        order = list(raizes)
+        if store is not None:
+            order, _ = plan(order, store, str(ano))
+        if metrics is not None:
+            metrics.add_cnpjs(ano, len(order))
+
+        def on_missing(cnpj, estab, a=ano):
+            missing.append({"Vigencia": a, "CNPJ_Raiz": _only_digits(cnpj), "CNPJ_Estab": _only_digits(estab),
+                            "Motivo": "estabelecimento não oferecido" if estab else "CNPJ raiz não oferecido"})
+
+        for raiz in order:
+            estabs = raizes[raiz]
+            _consultar_cnpj_checked(
+                driver, str(ano), fmt_raiz(raiz),
+                on_row=lambda row: _record_row(row, store, run_id, report),
+                watchdog=watchdog,
+                limiter=limiter,
+                metrics=metrics,
+                direct=True,
+                estabs=[fmt_estab(e) for e in sorted(estabs)] if estabs else None,
+                on_missing=on_missing,
+            )
+    return missing
+
+
+def prepare_driver(attach_debugger: Optional[str] = ATTACH_DEBUGGER, on_attach=None, asset_cache: bool = ASSET_CACHE):
+    """
+    Anexa ao navegador, aplica o modo leve (se ativo) e abre a tela de consulta.
+    `on_attach(driver)` roda antes da primeira navegação (ex.: gravação/reprodução).
+    Com WARM_ATTACH, uma aba consultar-fap já aberta e com o formulário pronto é
+    reaproveitada sem recarregar a SPA (exceto com on_attach, que precisa da navegação).
+    """
+    global DROPDOWN_ANIM_PAUSE
+    t0 = time.perf_counter()
+    warm = WARM_ATTACH and bool(attach_debugger) and on_attach is None
     driver = start_brave_with_active_profile(
-        host_ip_map=None,          # pinagem já vem do ex_brave.bat
+        # anexado, a pinagem já vem do ex_brave.bat; lançando (headless), vai na linha de comando
+        host_ip_map=None if attach_debugger else BIND_DEST_IPS,
         proxy_url=None,            # sem proxy
         keep_open=KEEP_OPEN,
-        attach_debugger=ATTACH_DEBUGGER  # anexa no Brave aberto em 127.0.0.1:9222
+        attach_debugger=attach_debugger,  # anexa no Brave aberto em 127.0.0.1:9222
+        adopt_url=CONSULT_URL_PART if warm else None,
+        cert_issuer_cn=CERT_ISSUER_CN,
+        capture_http=CAPTURE_HTTP_STATUS and RATE_LIMIT_ENABLED,  # só o limitador drena o log
     )
 
+    if LIGHT_MODE:
+        # sem animações o dropdown fecha/abre na hora; basta um respiro curto
+        enable_light_mode(driver)
+        DROPDOWN_ANIM_PAUSE = 0.03
+
+    if asset_cache and attach_debugger:
+        # o WebSocket CDP precisa do endereço do DevTools (só no modo anexado)
+        enable_asset_cache(driver, attach_debugger, AssetCache(ASSET_CACHE_DIR, ASSET_CACHE_MAX_MB))
+    if on_attach is not None:
+        on_attach(driver)
+
+    if warm and _form_ready(driver):
+        _close_open_dropdowns(driver, tries=1)
+        LOG.info(f"Aba consultar-fap reaproveitada; pronto em {(time.perf_counter() - t0) * 1000:.0f} ms")
+        return driver
+
+    driver.get(SSO_URL)
+    nav = navigation_timing(driver)
+    if nav:
+        LOG.info(f"Página carregada: {nav.get('load_ms')} ms, {nav.get('resources')} recursos, {nav.get('kb')} KB")
+    return driver
+
+
+def release_driver(driver, attach_debugger: Optional[str] = ATTACH_DEBUGGER):
+    """
+    Fecha o navegador só se NÃO for para manter aberto. No chromedriver persistente a
+    sessão anexada é sempre encerrada (quit() ali não fecha o Brave), para não acumular
+    sessões entre execuções. O Chromium headless (cópia do snapshot) sempre fecha e a
+    cópia do perfil é apagada.
+    """
+    profile_copy = getattr(driver, "_fap_profile_copy", None)
+    try:
+        if not KEEP_OPEN or (WARM_ATTACH and attach_debugger) or profile_copy:
+            driver.quit()
+    except Exception:
+        pass
+    discard_copy(profile_copy)
+
+
+def _form_ready(driver) -> bool:
+    """Aba atual está em consultar-fap com o formulário pronto (sessão ainda válida)."""
+    st = _page_state(driver)
+    return CONSULT_URL_PART in st.get("url", "") and st["estado"] in (FORM_READY, RESULT, NO_DATA)
+
+
+def make_limiter() -> Optional[AdaptiveRateLimiter]:
+    """Limitador do processo (compartilhado entre threads) conforme RATE_*; None se desativado."""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    return shared_limiter(
+        rate=RATE_START_PER_MIN / 60.0,
+        min_rate=RATE_MIN_PER_MIN / 60.0,
+        max_rate=RATE_MAX_PER_MIN / 60.0,
+        increase=1 / 60.0,
+        slow_latency=RATE_SLOW_LATENCY,
+    )
+
+
+def main(argv=None):
+    global ATTACH_DEBUGGER, REPORT_PATH, RESULT_DB_PATH
+    ap = argparse.ArgumentParser(description="Consulta FAP para todos os CNPJs/estabelecimentos")
+    ap.add_argument("--perfil", help="perfil de browser_config.PROFILES (porta e pasta de saída próprias)")
+    ap.add_argument("--vigencias", nargs="+", default=["2025", "2026"])
+    ap.add_argument("--prioridades", help="arquivo com CNPJs raiz prioritários (cnpj[;nível] por linha)")
+    ap.add_argument("--carteira", help="consulta só os CNPJs/estabelecimentos do arquivo (.csv/.json/.xlsx), sem descoberta")
+    ap.add_argument("--perfilar", action="store_true",
+                    help="perfil por amostragem (speedscope/folded/top-N ao lado do log; separa sleep, WebDriver e CPU)")
+    ap.add_argument("--gravar", metavar="PASTA", help="grava rede e DOM de cada passo para reprodução (replay.py)")
+    ap.add_argument("--shard", nargs="?", const="", metavar="WORKER",
+                    help="grava num shard só de append (shards/<relatório>.<worker>.jsonl) em vez do .xlsx; "
+                         "juntar depois com merge_reports.py")
+    ap.add_argument("--headless", action="store_true",
+                    help="não anexa: lança o Chromium headless a partir do snapshot de perfil (servidor Linux)")
+    args = ap.parse_args(argv)
+    if args.perfil:
+        prof = get_profile(args.perfil)
+        out = profile_output_dir(args.perfil)
+        ATTACH_DEBUGGER = profile_debugger(prof)
+        REPORT_PATH = str(out / os.path.basename(REPORT_PATH))
+        if RESULT_DB_PATH:
+            RESULT_DB_PATH = str(out / os.path.basename(RESULT_DB_PATH))
+        LOG.info(f"Perfil {args.perfil}: DevTools {ATTACH_DEBUGGER}, saída em {out}")
+    if args.headless:
+        ATTACH_DEBUGGER = None
+
+    carteira = load_portfolio(args.carteira, args.vigencias) if args.carteira else None
+    if carteira is not None:
+        LOG.info(f"Carteira {args.carteira}: {portfolio_size(carteira)}")
+
+    # Valida IPs "pinnados" antes de automatizar (evita surpresas)
+    if VALIDATE_IPS_BEFORE and BIND_DEST_IPS:
+        validate_host_ip_map_or_fail(BIND_DEST_IPS)
+
+    on_attach = None
+    if args.gravar:
+        dom_xpaths = {"estab": X_ESTABELECIMENTOS, "resultado": X_INFO_ROOT, "aliquota": X_VIG_ALIQ_ROOT}
+        on_attach = lambda d: start_recording(d, ATTACH_DEBUGGER, args.gravar, dom_xpaths)
+    # gravando, os estáticos também vão para a gravação (sem o cache local na frente)
+    driver = prepare_driver(ATTACH_DEBUGGER, on_attach=on_attach, asset_cache=ASSET_CACHE and not args.gravar)
+
     stop = threading.Event()
     watcher = None
 
+    store = open_store(RESULT_DB_PATH) if RESULT_DB_PATH else None
+    run_id = start_run(store) if store is not None else None
+    if args.shard is not None:
+        shard = shard_path(REPORT_PATH, args.shard or f"{socket.gethostname()}-{os.getpid()}")
+        report = ShardWriter(shard, REPORT_HEADERS)
+        LOG.info(f"Relatório em shard: {shard} (juntar com: py merge_reports.py shards --saida {REPORT_PATH})")
+    else:
+        report = ReportUpsertWriter(REPORT_PATH, REPORT_HEADERS) if REPORT_UPSERT else None
+    watchdog = TabWatchdog(TAB_HEAP_LIMIT_MB, BROWSER_RSS_LIMIT_MB, WATCHDOG_EVERY, ATTACH_DEBUGGER) if WATCHDOG_ENABLED else None
+    limiter = make_limiter()
+    metrics = SweepMetrics(store, run_id) if METRICS_PORT else None
+    metrics_httpd = serve_metrics(metrics, METRICS_PORT) if metrics is not None else None
+    profiler = None
+    if args.perfilar:
+        from profiling import SamplingProfiler, profile_base
+        profiler = SamplingProfiler().start()
+
     try:
         # # 1) Abre o sistema (vai redirecionar para o SSO)
         # driver.get(SSO_URL)
-        driver.get("https://fap.dataprev.gov.br/consultar-fap")
+        # (feito em prepare_driver)
 
         # # Em páginas que mostram "Entrar" primeiro
         # safe_click_any_xpath(driver, XPATH_ENTER_GOV, timeout=10)
@@ -1038,9 +1474,22 @@ def main():
 
         # 4) Aguarda sair do domínio do SSO (retorno autenticado)
 
-        # Consulta para todos CNPJs/Estabelecimentos nas vigências desejadas
-        consultar_para_todos(driver, anos=["2025", "2026"])
-
+        if carteira is not None:
+            # Só a carteira informada; o que o portal não oferece vai para o relatório de ausentes
+            missing = consultar_carteira(driver, carteira, store=store, run_id=run_id, report=report,
+                                         watchdog=watchdog, limiter=limiter, metrics=metrics)
+            if missing:
+                path = write_missing(os.path.splitext(REPORT_PATH)[0] + "_ausentes.csv", missing)
+                LOG.warning(f"Carteira: {len(missing)} item(ns) não oferecido(s) pelo portal; ver {path}")
+        else:
+            # Consulta para todos CNPJs/Estabelecimentos nas vigências desejadas
+            consultar_para_todos(driver, anos=args.vigencias, store=store, run_id=run_id, report=report,
+                                 watchdog=watchdog, priorities=load_priorities(args.prioridades), limiter=limiter,
+                                 metrics=metrics)
+
+    except PageStateError as e:
+        # sessão caiu (gov.br/captcha) ou a aba não voltou: não adianta seguir tentando
+        LOG.error(f"Execução interrompida: {e}. Resolva no Brave e rode de novo (o histórico já tem o que foi consultado).")
     finally:
         try:
             stop.set()
@@ -1049,12 +1498,35 @@ def main():
         except Exception:
             pass
 
-        # Só fecha o navegador se NÃO quiser manter aberto
-        try:
-            if not KEEP_OPEN:
-                driver.quit()
-        except Exception:
-            pass
+        if profiler is not None:
+            profiler.stop()
+            try:
+                paths = profiler.write(profile_base(LOG_PATH), name=f"fapbot {' '.join(args.vigencias)}")
+                LOG.info(f"Perfil gravado: {', '.join(paths)}")
+                LOG.info("Perfil: " + ", ".join(f"{k}={v:.0f}s" for k, v in profiler.categories.items()))
+            except OSError as e:
+                LOG.error(f"Falha ao gravar perfil: {e}")
+
+        if limiter is not None:
+            LOG.info(f"Limitador: {limiter.stats()}")
+        asset_cache_report(driver)
+        stop_recording(driver)
+        SELECTORS.save()
+        SELECTORS.log_drift()
+        if metrics is not None:
+            metrics.flush()
+            LOG.info(f"Resumo: {metrics.snapshot()['linhas_por_min']} linhas/min; fases: {metrics.snapshot()['fases']}")
+        if metrics_httpd is not None:
+            metrics_httpd.shutdown()
+        if report is not None:
+            try:
+                report.close()
+            except Exception as e:
+                LOG.error(f"Falha ao gravar relatório: {e}")
+        if store is not None:
+            store.close()
+
+        release_driver(driver, ATTACH_DEBUGGER)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,64 @@
+"""
+Junta relatórios do FAP num único arquivo canônico, em streaming.
+
+shards:    os shards dos workers (main.py --shard). Cada processo anexa suas linhas em
+           saida/shards/relatorio_fap.<worker>.jsonl, sem disputar o .xlsx.
+planilhas: relatórios antigos (.xlsx em modo read-only ou .csv), com cabeçalhos variados
+           (com/sem Estab_Nome) e CNPJ com ou sem máscara, mapeados para o formato atual.
+
+Nos dois casos fica a consulta mais recente de cada (CNPJ_Estab, Vigencia) e a planilha
+é gravada em modo write-only (memória limitada).
+
+    py merge_reports.py shards --saida relatorio_fap.xlsx            # shards/ ao lado da saída
+    py merge_reports.py shards w1.jsonl w2.csv --saida final.xlsx
+    py merge_reports.py planilhas relatorio_fap.xlsx "testes/relatorio_fap (antigo).xlsx" --saida consolidado.xlsx
+"""
+import os
+import glob
+import time
+import logging
+import argparse
+from typing import List
+
+from report_utils import REPORT_HEADERS, SHARD_DIR, merge_shards, consolidate_reports
+
+LOG = logging.getLogger("fapbot")
+
+
+def find_shards(report_path: str) -> List[str]:
+    """Shards de `report_path` (saida/shards/<nome>.*.jsonl|csv)."""
+    base = os.path.join(os.path.dirname(os.path.abspath(report_path)), SHARD_DIR)
+    stem = os.path.splitext(os.path.basename(report_path))[0]
+    return sorted(glob.glob(os.path.join(base, f"{stem}.*.jsonl")) + glob.glob(os.path.join(base, f"{stem}.*.csv")))
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Merge em streaming dos relatórios do FAP")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sh = sub.add_parser("shards", help="junta os shards por worker (consulta mais recente por CNPJ_Estab/Vigencia)")
+    sh.add_argument("arquivos", nargs="*", help="shards .jsonl/.csv (padrão: shards/ ao lado de --saida)")
+    sh.add_argument("--saida", default="relatorio_fap.xlsx")
+    pl = sub.add_parser("planilhas", help="consolida relatórios antigos (.xlsx/.csv) no formato atual")
+    pl.add_argument("arquivos", nargs="+")
+    pl.add_argument("--saida", default="relatorio_consolidado.xlsx")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    t0 = time.perf_counter()
+    if args.cmd == "planilhas":
+        out = os.path.abspath(args.saida)
+        paths = [p for p in args.arquivos if os.path.abspath(p) != out]  # a saída não entra como entrada
+        n = consolidate_reports(paths, args.saida, REPORT_HEADERS)
+        LOG.info(f"{len(paths)} relatório(s) -> {args.saida}: {n} linhas em {time.perf_counter() - t0:.1f}s")
+        return 0
+    paths = args.arquivos or find_shards(args.saida)
+    if not paths:
+        LOG.error(f"Nenhum shard encontrado para {args.saida}")
+        return 1
+    n = merge_shards(paths, args.saida, REPORT_HEADERS)
+    LOG.info(f"{len(paths)} shard(s) -> {args.saida}: {n} linhas em {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_cli())
@@ -0,0 +1,258 @@
+"""
+Métricas ao vivo da varredura: progresso por vigência, linhas/min, ETA, histogramas
+de latência por fase e contagem de retentativas/falhas.
+
+Servidas em localhost (sem dependências):
+    http://127.0.0.1:9108/              página de status (atualiza sozinha)
+    http://127.0.0.1:9108/metrics       formato Prometheus
+    http://127.0.0.1:9108/metrics.json  JSON
+
+Cada fase medida também vira um registro na tabela `fases` do histórico (store_utils).
+"""
+import json
+import time
+import logging
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from store_utils import save_phases
+
+LOG = logging.getLogger("fapbot")
+
+DEFAULT_PORT = 9108
+# Limites (s) dos histogramas por fase
+BUCKETS = (0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120)
+RATE_WINDOW_S = 600          # janela da taxa linhas/min (e do ETA)
+ITEM_START_PHASE = "selecao"  # o tempo entre o fim do item anterior e esta fase vira "intervalo"
+FLUSH_EVERY = 50             # fases acumuladas antes de gravar no banco
+
+
+def _quantile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    v = sorted(values)
+    return v[min(len(v) - 1, int(q * len(v)))]
+
+
+class SweepMetrics:
+    """Contadores da varredura (thread-safe; o servidor HTTP só lê)."""
+
+    def __init__(self, store=None, run_id: Optional[int] = None):
+        self.store = store
+        self.run_id = run_id
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.cnpjs_total: Dict[str, int] = defaultdict(int)
+        self.cnpjs_done: Dict[str, int] = defaultdict(int)
+        self.rows_done: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, int] = defaultdict(int)   # "retentativa:<tipo>" / "falha:<tipo>"
+        self.hist: Dict[str, List[int]] = {}
+        self.hist_sum: Dict[str, float] = defaultdict(float)
+        self.hist_count: Dict[str, int] = defaultdict(int)
+        self.recent: Dict[str, deque] = defaultdict(lambda: deque(maxlen=500))
+        self.row_times: deque = deque()
+        self._last_end: Optional[float] = None
+        self._pending: List[tuple] = []
+
+    # ---- registro ----
+    def add_cnpjs(self, vigencia: str, n: int):
+        with self.lock:
+            self.cnpjs_total[str(vigencia)] += n
+
+    def cnpj_done(self, vigencia: str):
+        with self.lock:
+            self.cnpjs_done[str(vigencia)] += 1
+
+    def row_done(self, vigencia: str):
+        now = time.time()
+        with self.lock:
+            self.rows_done[str(vigencia)] += 1
+            self.row_times.append(now)
+
+    def retry(self, kind: str):
+        with self.lock:
+            self.counters[f"retentativa:{kind}"] += 1
+
+    def failure(self, kind: str):
+        with self.lock:
+            self.counters[f"falha:{kind}"] += 1
+
+    def observe(self, fase: str, seconds: float, vigencia: str = "", cnpj: str = "", estab: str = "",
+                start: Optional[float] = None):
+        start = start if start is not None else time.time() - seconds
+        with self.lock:
+            if fase == ITEM_START_PHASE and self._last_end is not None and start > self._last_end:
+                self._observe_locked("intervalo", start - self._last_end, vigencia, cnpj, estab, self._last_end)
+            self._observe_locked(fase, seconds, vigencia, cnpj, estab, start)
+            self._last_end = start + seconds
+            flush = self.store is not None and len(self._pending) >= FLUSH_EVERY
+        if flush:
+            self.flush()
+
+    def _observe_locked(self, fase, seconds, vigencia, cnpj, estab, start):
+        buckets = self.hist.setdefault(fase, [0] * len(BUCKETS))
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                buckets[i] += 1
+        self.hist_sum[fase] += seconds
+        self.hist_count[fase] += 1
+        self.recent[fase].append(seconds)
+        if self.store is not None:
+            self._pending.append((
+                str(vigencia), cnpj, estab, fase,
+                datetime.fromtimestamp(start).isoformat(sep=" ", timespec="milliseconds"), round(seconds, 3),
+            ))
+
+    @contextmanager
+    def phase(self, fase: str, vigencia: str = "", cnpj: str = "", estab: str = ""):
+        """with metrics.phase("consulta", ano, cnpj, estab): ..."""
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.observe(fase, time.time() - t0, vigencia, cnpj, estab, start=t0)
+
+    def flush(self):
+        """Grava no banco as fases acumuladas."""
+        with self.lock:
+            batch, self._pending = self._pending, []
+        if batch and self.store is not None:
+            try:
+                save_phases(self.store, self.run_id, batch, origem="ao_vivo")
+            except Exception as e:
+                LOG.warning(f"Métricas: falha ao gravar fases: {e}")
+
+    # ---- leitura ----
+    def snapshot(self) -> Dict:
+        now = time.time()
+        with self.lock:
+            while self.row_times and now - self.row_times[0] > RATE_WINDOW_S:
+                self.row_times.popleft()
+            window = min(RATE_WINDOW_S, max(now - self.started, 1.0))
+            rpm = len(self.row_times) * 60.0 / window
+            total_rows = sum(self.rows_done.values())
+            total_done = sum(self.cnpjs_done.values())
+            rows_per_cnpj = total_rows / total_done if total_done else 0.0
+            vig = {}
+            for v in sorted(set(self.cnpjs_total) | set(self.rows_done)):
+                remaining_cnpjs = max(0, self.cnpjs_total[v] - self.cnpjs_done[v])
+                vig[v] = {
+                    "cnpjs_total": self.cnpjs_total[v],
+                    "cnpjs_concluidos": self.cnpjs_done[v],
+                    "linhas": self.rows_done[v],
+                    "linhas_restantes_est": round(remaining_cnpjs * rows_per_cnpj),
+                }
+            remaining = sum(x["linhas_restantes_est"] for x in vig.values())
+            fases = {
+                f: {
+                    "n": self.hist_count[f],
+                    "media_s": round(self.hist_sum[f] / self.hist_count[f], 2) if self.hist_count[f] else 0.0,
+                    "p50_s": round(_quantile(list(self.recent[f]), 0.5), 2),
+                    "p95_s": round(_quantile(list(self.recent[f]), 0.95), 2),
+                }
+                for f in self.hist
+            }
+            return {
+                "run_id": self.run_id,
+                "inicio": datetime.fromtimestamp(self.started).isoformat(sep=" ", timespec="seconds"),
+                "decorrido_s": round(now - self.started),
+                "linhas_por_min": round(rpm, 2),
+                "eta_s": round(remaining / rpm * 60) if rpm > 0 and remaining else None,
+                "vigencias": vig,
+                "fases": fases,
+                "contadores": dict(self.counters),
+            }
+
+    def prometheus(self) -> str:
+        snap = self.snapshot()
+        out = [
+            "# TYPE fapbot_rows_total counter",
+            *[f'fapbot_rows_total{{vigencia="{v}"}} {x["linhas"]}' for v, x in snap["vigencias"].items()],
+            "# TYPE fapbot_rows_remaining gauge",
+            *[f'fapbot_rows_remaining{{vigencia="{v}"}} {x["linhas_restantes_est"]}' for v, x in snap["vigencias"].items()],
+            "# TYPE fapbot_cnpjs_total gauge",
+            *[f'fapbot_cnpjs_total{{vigencia="{v}"}} {x["cnpjs_total"]}' for v, x in snap["vigencias"].items()],
+            "# TYPE fapbot_cnpjs_done counter",
+            *[f'fapbot_cnpjs_done{{vigencia="{v}"}} {x["cnpjs_concluidos"]}' for v, x in snap["vigencias"].items()],
+            "# TYPE fapbot_rows_per_minute gauge",
+            f"fapbot_rows_per_minute {snap['linhas_por_min']}",
+            "# TYPE fapbot_eta_seconds gauge",
+            f"fapbot_eta_seconds {snap['eta_s'] if snap['eta_s'] is not None else 'NaN'}",
+            "# TYPE fapbot_events_total counter",
+        ]
+        for k, n in snap["contadores"].items():
+            tipo, nome = k.split(":", 1)
+            out.append(f'fapbot_events_total{{evento="{tipo}",tipo="{nome}"}} {n}')
+        out.append("# TYPE fapbot_phase_seconds histogram")
+        with self.lock:
+            for f, buckets in self.hist.items():
+                for le, n in zip(BUCKETS, buckets):
+                    out.append(f'fapbot_phase_seconds_bucket{{fase="{f}",le="{le}"}} {n}')
+                out.append(f'fapbot_phase_seconds_bucket{{fase="{f}",le="+Inf"}} {self.hist_count[f]}')
+                out.append(f'fapbot_phase_seconds_sum{{fase="{f}"}} {round(self.hist_sum[f], 3)}')
+                out.append(f'fapbot_phase_seconds_count{{fase="{f}"}} {self.hist_count[f]}')
+        return "\n".join(out) + "\n"
+
+    def html(self) -> str:
+        s = self.snapshot()
+        eta = "-" if s["eta_s"] is None else f"{s['eta_s'] // 3600}h{(s['eta_s'] % 3600) // 60:02d}m"
+        vig = "".join(
+            f"<tr><td>{v}</td><td>{x['cnpjs_concluidos']}/{x['cnpjs_total']}</td>"
+            f"<td>{x['linhas']}</td><td>{x['linhas_restantes_est']}</td></tr>"
+            for v, x in s["vigencias"].items()
+        )
+        fases = "".join(
+            f"<tr><td>{f}</td><td>{x['n']}</td><td>{x['media_s']}</td><td>{x['p50_s']}</td><td>{x['p95_s']}</td></tr>"
+            for f, x in s["fases"].items()
+        )
+        cont = "".join(f"<tr><td>{k}</td><td>{n}</td></tr>" for k, n in s["contadores"].items())
+        return f"""<!doctype html><html><head><meta charset="utf-8"><meta http-equiv="refresh" content="5">
+<title>FAP - varredura</title><style>body{{font-family:sans-serif}}td,th{{padding:2px 10px;text-align:right}}</style></head><body>
+<h3>Execução {s['run_id'] or '-'} &mdash; iniciada {s['inicio']}, {s['decorrido_s'] // 60} min</h3>
+<p><b>{s['linhas_por_min']}</b> linhas/min &middot; ETA <b>{eta}</b></p>
+<table><tr><th>Vigência</th><th>CNPJs</th><th>Linhas</th><th>Restantes (est.)</th></tr>{vig}</table>
+<h4>Fases (s)</h4><table><tr><th>Fase</th><th>n</th><th>média</th><th>p50</th><th>p95</th></tr>{fases}</table>
+<h4>Retentativas / falhas</h4><table>{cont}</table>
+</body></html>"""
+
+
+def _make_handler(metrics: SweepMetrics):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, body: str, ctype: str):
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            route = self.path.split("?")[0].rstrip("/")
+            if route == "/metrics":
+                return self._send(metrics.prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+            if route == "/metrics.json":
+                return self._send(json.dumps(metrics.snapshot(), ensure_ascii=False), "application/json; charset=utf-8")
+            if route == "":
+                return self._send(metrics.html(), "text/html; charset=utf-8")
+            self.send_error(404)
+
+    return Handler
+
+
+def serve_metrics(metrics: SweepMetrics, port: int = DEFAULT_PORT, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """Sobe o endpoint numa thread; se a porta estiver ocupada, segue sem ele."""
+    try:
+        httpd = ThreadingHTTPServer((host, port), _make_handler(metrics))
+    except OSError as e:
+        LOG.warning(f"Métricas: não foi possível abrir {host}:{port} ({e}); seguindo sem endpoint.")
+        return None
+    threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    LOG.info(f"Métricas em http://{host}:{port}/ (Prometheus: /metrics)")
+    return httpd
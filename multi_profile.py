@@ -0,0 +1,111 @@
+"""
+Varredura simultânea de vários perfis/certificados (browser_config.PROFILES).
+
+Cada perfil roda em um processo `main.py --perfil <nome>` próprio, anexado ao Brave
+daquele perfil (porta de debug própria), com log, histórico e relatório em
+saida/<perfil>/. Ao final, os relatórios de todos os perfis são agregados em
+saida/relatorio_fap.xlsx (uma linha por CNPJ_Estab/Vigencia, a consulta mais recente vence).
+
+    py multi_profile.py                       # todos os perfis do registro
+    py multi_profile.py --perfis Pessoal Empresa --lancar
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import subprocess
+from typing import Dict, List, Optional
+
+from browser_config import (
+    PROFILES,
+    OUTPUT_ROOT,
+    BIND_DEST_IPS,
+    get_profile,
+    launch_brave_profile,
+    profile_debugger,
+    profile_output_dir,
+    wait_devtools,
+)
+from report_utils import ReportUpsertWriter, REPORT_HEADERS
+from store_utils import open_store, latest_aliquota, as_report_row, DEFAULT_DB_PATH
+from log_utils import setup_logging
+from metrics import DEFAULT_PORT as METRICS_DEFAULT_PORT
+
+LOG = logging.getLogger("fapbot")
+
+METRICS_BASE_PORT = METRICS_DEFAULT_PORT
+
+
+def _spawn(name: str, vigencias: List[str], metrics_port: Optional[int] = None) -> subprocess.Popen:
+    out = profile_output_dir(name)
+    env = dict(os.environ, FAPBOT_LOG_DIR=str(out / "logs"))
+    if metrics_port:
+        env["FAPBOT_METRICS_PORT"] = str(metrics_port)
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+           "--perfil", name, "--vigencias", *vigencias]
+    LOG.info(f"[{name}] iniciando: {' '.join(cmd[1:])}")
+    return subprocess.Popen(cmd, env=env)
+
+
+def aggregate_reports(names: List[str], out_path: Optional[str] = None) -> int:
+    """Junta os históricos de cada perfil num relatório único (upsert pela consulta mais recente)."""
+    out_path = out_path or os.path.join(OUTPUT_ROOT, "relatorio_fap.xlsx")
+    rows = []
+    for name in names:
+        db = os.path.join(OUTPUT_ROOT, name, os.path.basename(DEFAULT_DB_PATH))
+        if not os.path.exists(db):
+            LOG.warning(f"[{name}] sem histórico em {db}; perfil ignorado na agregação.")
+            continue
+        conn = open_store(db)
+        rows.extend(dict(as_report_row(r), _ts=r["consultado_em"] or "") for r in latest_aliquota(conn))
+        conn.close()
+    # mais antigas primeiro: o upsert deixa a consulta mais recente de cada chave
+    rows.sort(key=lambda r: r.pop("_ts"))
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    with ReportUpsertWriter(out_path, REPORT_HEADERS, flush_every=max(1, len(rows))) as w:
+        for r in rows:
+            w.upsert(r)
+        return len(w)
+
+
+def run_profiles(names: List[str], vigencias: List[str], launch: bool = False, devtools_timeout: float = 60.0) -> Dict[str, Dict]:
+    """Roda um processo por perfil em paralelo e devolve {perfil: {rc, segundos}}."""
+    for name in names:
+        prof = get_profile(name)
+        if launch:
+            launch_brave_profile(prof, host_ip_map=BIND_DEST_IPS)
+    procs, t0, result = {}, {}, {}
+    for i, name in enumerate(names):
+        if not wait_devtools(profile_debugger(get_profile(name)), timeout=devtools_timeout):
+            LOG.warning(f"[{name}] DevTools fora do ar; o processo do perfil deve falhar ao anexar.")
+        # um endpoint de métricas por perfil: 9108, 9109, ...
+        procs[name] = _spawn(name, vigencias, metrics_port=METRICS_BASE_PORT + i)
+        LOG.info(f"[{name}] métricas em http://127.0.0.1:{METRICS_BASE_PORT + i}/")
+        t0[name] = time.time()
+    for name, p in procs.items():
+        rc = p.wait()
+        result[name] = {"rc": rc, "segundos": round(time.time() - t0[name], 1)}
+        level = logging.INFO if rc == 0 else logging.ERROR
+        LOG.log(level, f"[{name}] finalizado rc={rc} em {result[name]['segundos']}s (logs em {profile_output_dir(name) / 'logs'})")
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Varre vários perfis/certificados ao mesmo tempo")
+    ap.add_argument("--perfis", nargs="+", default=list(PROFILES), help="nomes em browser_config.PROFILES")
+    ap.add_argument("--vigencias", nargs="+", default=["2025", "2026"])
+    ap.add_argument("--lancar", action="store_true", help="abre o Brave de cada perfil se a porta não estiver no ar")
+    ap.add_argument("--so-agregar", action="store_true", help="apenas agrega os relatórios já existentes")
+    args = ap.parse_args(argv)
+
+    setup_logging("fapbot", log_dir=os.path.join(OUTPUT_ROOT, "logs"))
+    if not args.so_agregar:
+        run_profiles(args.perfis, args.vigencias, launch=args.lancar)
+    n = aggregate_reports(args.perfis)
+    LOG.info(f"Relatório agregado: {os.path.join(OUTPUT_ROOT, 'relatorio_fap.xlsx')} ({n} linhas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Classificador do estado da página num único round trip.
+
+Em vez de baixar `page_source` e esperar XPaths até o timeout para descobrir que a
+sessão caiu, que a aba sumiu ou que a consulta não trouxe dados, um script lê URL,
+mensagens visíveis e os elementos-chave da tela e devolve um estado:
+
+    sso_login     tela do gov.br (sessão expirada / login pendente)
+    captcha       "Captcha inválido" ou desafio hCaptcha/reCAPTCHA visível
+    portal_error  página de erro do navegador/portal ou mensagem de erro visível
+    no_data       mensagem de "nenhum registro" após a consulta
+    result        painel de resultado visível e preenchido
+    form_ready    formulário de consulta visível (combobox de CNPJ)
+    loading       nada conclusivo ainda (carregando/transição)
+    tab_gone      aba/janela fechada (o script nem roda)
+"""
+import time
+import logging
+from typing import Dict, Iterable, Optional
+
+from selenium.common.exceptions import NoSuchWindowException, WebDriverException
+
+from dom_utils import _JS_COMMON
+
+LOG = logging.getLogger("fapbot")
+
+SSO_LOGIN = "sso_login"
+CAPTCHA = "captcha"
+PORTAL_ERROR = "portal_error"
+NO_DATA = "no_data"
+RESULT = "result"
+FORM_READY = "form_ready"
+LOADING = "loading"
+TAB_GONE = "tab_gone"
+
+# Estados em que não adianta esperar elemento nenhum: a sessão precisa de intervenção
+SESSION_LOST = (SSO_LOGIN, CAPTCHA, TAB_GONE)
+
+FORM_CSS = "#cnpjRaiz"
+RESULT_XPATH = "/html/body/div/div[2]/div/div[2]/div[2]/div[1]/div/div[2]"
+
+_JS_CLASSIFY = _JS_COMMON + r"""
+const formCss = arguments[0], formXp = arguments[1], resXp = arguments[2];
+const q = (xp) => {
+  if (!xp) return null;
+  try { return document.evaluate(xp, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue; }
+  catch (e) { return null; }
+};
+const out = (estado, detalhe) => ({estado: estado, detalhe: (detalhe || '').slice(0, 200), url: location.href});
+const body = document.body ? document.body.innerText : '';
+if (location.protocol === 'chrome-error:') return out('portal_error', 'erro de rede do navegador');
+if (body.indexOf('Captcha inválido') >= 0) return out('captcha', 'Captcha inválido');
+for (const f of document.querySelectorAll('iframe[src*="captcha"]')) {
+  const r = f.getBoundingClientRect();
+  if (r.width > 50 && r.height > 50) return out('captcha', 'desafio visível');
+}
+if (location.hostname.indexOf('sso.acesso.gov.br') >= 0 || /Seu certificado digital/.test(body)) return out('sso_login');
+const msgs = Array.from(document.querySelectorAll(".br-message, [role='alert'], .alert, .toast, .br-modal"))
+  .filter(vis).map(txt).filter(Boolean).join(' | ');
+if (/erro|indispon[íi]vel|falha|tente novamente/i.test(msgs) || /^(5\d\d|Service Unavailable|Bad Gateway)/i.test(document.title))
+  return out('portal_error', msgs || document.title);
+if (/nenhum|n[ãa]o (foi|foram) encontrad|n[ãa]o (h[áa]|existe|possui)|sem (dados|registros)/i.test(msgs))
+  return out('no_data', msgs);
+const res = q(resXp);
+if (res && vis(res) && txt(res)) return out('result');
+const form = document.querySelector(formCss) || q(formXp);
+if (form && vis(form)) return out('form_ready');
+if (/erro inesperado|ocorreu um erro|servi[çc]o indispon/i.test(body)) return out('portal_error', body);
+return out('loading', document.readyState);
+"""
+
+
+class PageStateError(RuntimeError):
+    """A página está num estado que nenhuma espera resolve (ex.: SSO, captcha, aba fechada)."""
+
+    def __init__(self, state: str, detail: str = ""):
+        super().__init__(f"página em estado '{state}'" + (f": {detail}" if detail else ""))
+        self.state = state
+        self.detail = detail
+
+
+def classify_page(driver, form_xpath: Optional[str] = None, result_xpath: Optional[str] = RESULT_XPATH) -> Dict:
+    """{estado, detalhe, url} da aba atual em uma chamada de script."""
+    try:
+        res = driver.execute_script(_JS_CLASSIFY, FORM_CSS, form_xpath, result_xpath)
+        return res or {"estado": LOADING, "detalhe": "", "url": ""}
+    except NoSuchWindowException as e:
+        return {"estado": TAB_GONE, "detalhe": str(e).splitlines()[0], "url": ""}
+    except WebDriverException as e:
+        msg = str(e)
+        if "no such window" in msg or "target window already closed" in msg or "web view not found" in msg:
+            return {"estado": TAB_GONE, "detalhe": msg.splitlines()[0], "url": ""}
+        return {"estado": LOADING, "detalhe": msg.splitlines()[0] if msg else "", "url": ""}
+
+
+def wait_page_state(driver, states: Iterable[str], timeout: float = 15.0, poll: float = 0.2, **kw) -> Dict:
+    """Reclassifica até cair num dos `states` (ou em SESSION_LOST); no timeout, devolve o último estado."""
+    wanted = set(states) | set(SESSION_LOST)
+    end = time.time() + timeout
+    while True:
+        st = classify_page(driver, **kw)
+        if st["estado"] in wanted or time.time() >= end:
+            return st
+        time.sleep(poll)
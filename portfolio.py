@@ -0,0 +1,134 @@
+"""
+Carteira conhecida (exportação do ERP) em vez da descoberta pelos dropdowns.
+
+Arquivo .csv/.json/.xlsx com CNPJ raiz e/ou CNPJ do estabelecimento e, opcionalmente,
+as vigências de cada linha. Os rótulos dos dropdowns são montados a partir dos dígitos
+('53.458.313' para a raiz, '53.458.313/0001-54' para o estabelecimento) e cada item é
+selecionado diretamente; o que o portal não oferece vai para um relatório de ausentes.
+
+    CNPJ_Raiz;CNPJ_Estab;Vigencia
+    53458313;53458313000154;2025,2026
+    02618143;;                        <- raiz sem estabelecimento = todos os estabelecimentos
+
+JSON: lista de objetos com as mesmas chaves (ou {"itens": [...]}); "Vigencia" pode ser lista.
+"""
+import os
+import csv
+import json
+from typing import Dict, Iterable, List, Optional, Set
+
+# Cabeçalhos aceitos (minúsculas, sem acento/espaço) -> campo
+_ALIASES = {
+    "cnpjraiz": "raiz", "raiz": "raiz", "cnpjbase": "raiz",
+    "cnpjestab": "estab", "estab": "estab", "estabelecimento": "estab", "cnpj": "cnpj",
+    "vigencia": "vigencia", "vigencias": "vigencia", "ano": "vigencia",
+}
+
+MISSING_HEADERS = ["Vigencia", "CNPJ_Raiz", "CNPJ_Estab", "Motivo"]
+
+
+def _digits(v) -> str:
+    s = str(v if v is not None else "").strip()
+    if s.endswith(".0"):  # número vindo do Excel
+        s = s[:-2]
+    return "".join(ch for ch in s if ch.isdigit())
+
+
+def fmt_raiz(d: str) -> str:
+    """'53458313' -> '53.458.313' (prefixo do rótulo do dropdown de CNPJ raiz)."""
+    d = _digits(d).zfill(8)[:8]
+    return f"{d[0:2]}.{d[2:5]}.{d[5:8]}"
+
+
+def fmt_estab(d: str) -> str:
+    """'53458313000154' -> '53.458.313/0001-54' (rótulo do dropdown de estabelecimentos)."""
+    d = _digits(d).zfill(14)[:14]
+    return f"{d[0:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:14]}"
+
+
+def _key(h) -> str:
+    k = "".join(ch for ch in str(h or "").lower() if ch.isalnum())
+    return _ALIASES.get(k.replace("ê", "e").replace("ç", "c"), "")
+
+
+def _read_rows(path: str) -> List[Dict]:
+    low = path.lower()
+    if low.endswith(".json"):
+        with open(path, encoding="utf-8-sig") as f:
+            data = json.load(f)
+        return data.get("itens", []) if isinstance(data, dict) else data
+    if low.endswith(".xlsx"):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            it = wb.active.iter_rows(values_only=True)
+            header = next(it, None) or ()
+            return [dict(zip(header, r)) for r in it]
+        finally:
+            wb.close()
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        head = f.readline()
+        f.seek(0)
+        sep = ";" if head.count(";") >= head.count(",") else ","
+        return list(csv.DictReader(f, delimiter=sep))
+
+
+def _vigencias(v) -> List[str]:
+    if v is None or v == "":
+        return []
+    items = v if isinstance(v, (list, tuple)) else str(v).replace(";", ",").replace("/", ",").split(",")
+    return [_digits(x)[:4] for x in items if _digits(x)]
+
+
+def load_portfolio(path: str, default_vigencias: Iterable[str]) -> Dict[str, Dict[str, Optional[Set[str]]]]:
+    """
+    {vigência: {raiz (8 dígitos): {estabs (14 dígitos)} ou None = todos}}.
+    Linhas sem vigência usam `default_vigencias`; CNPJ de 14 dígitos numa coluna 'CNPJ'
+    conta como estabelecimento, de 8 como raiz.
+    """
+    out: Dict[str, Dict[str, Optional[Set[str]]]] = {}
+    for row in _read_rows(path):
+        f = {}
+        for k, v in row.items():
+            name = _key(k)
+            if name and v not in (None, ""):
+                f[name] = v
+        raiz, estab = _digits(f.get("raiz", "")), _digits(f.get("estab", ""))
+        cnpj = _digits(f.get("cnpj", ""))
+        if cnpj and not estab and len(cnpj) > 8:
+            estab = cnpj
+        elif cnpj and not raiz:
+            raiz = cnpj
+        if estab:
+            estab = estab.zfill(14)
+            raiz = raiz or estab[:8]
+        if not raiz:
+            continue
+        raiz = raiz.zfill(8)[:8]
+        for ano in _vigencias(f.get("vigencia")) or [str(a) for a in default_vigencias]:
+            by_raiz = out.setdefault(ano, {})
+            if estab:
+                cur = by_raiz.setdefault(raiz, set())
+                if cur is not None:
+                    cur.add(estab)
+            else:
+                by_raiz[raiz] = None  # todos os estabelecimentos
+    return out
+
+
+def portfolio_size(carteira: Dict[str, Dict[str, Optional[Set[str]]]]) -> str:
+    raizes = sum(len(r) for r in carteira.values())
+    estabs = sum(len(e) for r in carteira.values() for e in r.values() if e)
+    todos = sum(1 for r in carteira.values() for e in r.values() if e is None)
+    return f"{raizes} CNPJs raiz em {len(carteira)} vigência(s) ({estabs} estabelecimentos listados, {todos} raízes completas)"
+
+
+def write_missing(path: str, missing: List[Dict]) -> str:
+    """Relatório .csv dos itens da carteira que o portal não ofereceu."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=MISSING_HEADERS, delimiter=";")
+        w.writeheader()
+        for m in missing:
+            w.writerow({h: m.get(h, "") for h in MISSING_HEADERS})
+    return path
@@ -0,0 +1,140 @@
+"""
+Snapshot mínimo de perfil para rodar em servidor (Chromium headless no Linux).
+
+Em vez de copiar o user-data-dir inteiro (centenas de MB de cache, histórico,
+extensões), guarda só o que a sessão precisa: os cookies (gov.br/dataprev), o
+Preferences do perfil e o Local State, mais a regra de seleção automática do
+certificado (AutoSelectCertificateForUrls) num snapshot.json. Cada execução copia o
+snapshot (poucos MB) para uma pasta temporária descartável.
+
+Os cookies do Chromium no Linux são cifrados com a chave do chaveiro do usuário; para o
+snapshot servir em outra máquina/sem chaveiro, o perfil de origem precisa ter sido
+usado com --password-store=basic (o comando `login` abaixo já abre assim).
+O certificado em si fica no NSS do usuário (~/.pki/nssdb), fora do perfil.
+
+    py profile_snapshot.py login --pasta perfil_login          # login manual uma vez (com janela)
+    py profile_snapshot.py criar --de perfil_login --para perfil_base
+    py profile_snapshot.py politica > /etc/chromium/policies/managed/fapbot.json
+"""
+import os
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional
+
+SNAPSHOT_MANIFEST = "snapshot.json"
+SNAPSHOT_PROFILE = "Default"   # nome do perfil dentro do snapshot
+# Relativos ao user-data-dir ("{p}" = pasta do perfil); os ausentes são ignorados
+SNAPSHOT_FILES = [
+    "Local State",
+    "{p}/Preferences",
+    "{p}/Cookies",
+    "{p}/Cookies-journal",
+    "{p}/Network/Cookies",           # Chromium >= 96 guarda os cookies aqui
+    "{p}/Network/Cookies-journal",
+]
+CERT_URLS = ("https://sso.acesso.gov.br", "https://fap.dataprev.gov.br")
+
+
+def cert_rules(cert_issuer_cn: str) -> List[Dict]:
+    return [{"pattern": url, "filter": {"ISSUER": {"CN": cert_issuer_cn}}} for url in CERT_URLS]
+
+
+def cert_policy(cert_issuer_cn: str) -> Dict:
+    """Conteúdo de um arquivo de política gerenciada (/etc/chromium/policies/managed/*.json)."""
+    return {"AutoSelectCertificateForUrls": [json.dumps(r, separators=(",", ":")) for r in cert_rules(cert_issuer_cn)]}
+
+
+def create_snapshot(user_data_dir: str, profile_dir: str, dest: str,
+                    cert_issuer_cn: Optional[str] = None) -> List[str]:
+    """Copia os arquivos mínimos de `user_data_dir/profile_dir` para `dest` (feche o navegador antes)."""
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+    copied = []
+    for rel in SNAPSHOT_FILES:
+        src = os.path.join(user_data_dir, rel.format(p=profile_dir))
+        if not os.path.isfile(src):
+            continue
+        dst_rel = rel.format(p=SNAPSHOT_PROFILE)
+        dst = os.path.join(dest, dst_rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copy2(src, dst)
+        copied.append(dst_rel)
+    if not any("Cookies" in c for c in copied):
+        raise RuntimeError(f"Nenhum arquivo de cookies em {os.path.join(user_data_dir, profile_dir)}")
+    manifest = {
+        "criado": datetime.now().isoformat(sep=" ", timespec="seconds"),
+        "origem": os.path.abspath(os.path.join(user_data_dir, profile_dir)),
+        "perfil": SNAPSHOT_PROFILE,
+        "cert_issuer_cn": cert_issuer_cn,
+        "arquivos": copied,
+    }
+    with open(os.path.join(dest, SNAPSHOT_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return copied
+
+
+def read_manifest(snapshot_dir: str) -> Dict:
+    try:
+        with open(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def copy_snapshot(snapshot_dir: str, parent: Optional[str] = None) -> str:
+    """user-data-dir descartável com o conteúdo do snapshot; devolve o caminho."""
+    if not os.path.isfile(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST)):
+        raise RuntimeError(f"Snapshot de perfil não encontrado em '{snapshot_dir}' (py profile_snapshot.py criar ...)")
+    work = tempfile.mkdtemp(prefix="fapbot-perfil-", dir=parent)
+    shutil.copytree(snapshot_dir, work, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns(SNAPSHOT_MANIFEST))
+    return work
+
+
+def discard_copy(path: Optional[str]):
+    if path and os.path.basename(path).startswith("fapbot-perfil-"):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _cli(argv=None):
+    from browser_config import BIND_DEST_IPS, PROFILES, linux_browser_path, host_resolver_arg, _auto_select_cert_arg
+
+    default_cn = next((p.get("cert_issuer_cn") for p in PROFILES.values() if p.get("cert_issuer_cn")), None)
+    ap = argparse.ArgumentParser(description="Snapshot mínimo de perfil para o Chromium headless")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    lg = sub.add_parser("login", help="abre o Chromium com janela numa pasta de perfil para o login manual")
+    lg.add_argument("--pasta", default="perfil_login")
+    lg.add_argument("--cert-cn", default=default_cn)
+    cr = sub.add_parser("criar", help="gera o snapshot a partir de um user-data-dir")
+    cr.add_argument("--de", required=True, help="user-data-dir de origem")
+    cr.add_argument("--perfil", default="Default", help="pasta do perfil dentro do user-data-dir")
+    cr.add_argument("--para", default="perfil_base")
+    cr.add_argument("--cert-cn", default=default_cn)
+    po = sub.add_parser("politica", help="imprime a política AutoSelectCertificateForUrls (JSON)")
+    po.add_argument("--cert-cn", default=default_cn)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "login":
+        cmd = [linux_browser_path(), f"--user-data-dir={os.path.abspath(args.pasta)}",
+               f"--profile-directory={SNAPSHOT_PROFILE}", "--password-store=basic",
+               host_resolver_arg(BIND_DEST_IPS)]
+        if args.cert_cn:
+            cmd.append(_auto_select_cert_arg(args.cert_cn))
+        cmd.append(CERT_URLS[0])
+        print("Faça o login no gov.br/FAP, feche o navegador e rode: "
+              f"py profile_snapshot.py criar --de {args.pasta}")
+        subprocess.call(cmd)
+    elif args.cmd == "criar":
+        files = create_snapshot(args.de, args.perfil, args.para, args.cert_cn)
+        size = sum(os.path.getsize(os.path.join(args.para, f)) for f in files)
+        print(f"Snapshot em {args.para}: {len(files)} arquivo(s), {size / 1024:.0f} KB")
+    else:
+        print(json.dumps(cert_policy(args.cert_cn), ensure_ascii=False, indent=1))
+
+
+if __name__ == "__main__":
+    _cli()
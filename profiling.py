@@ -0,0 +1,205 @@
+"""
+Perfil por amostragem da varredura (opcional: py main.py --perfilar).
+
+Uma thread amostra a pilha Python da thread da varredura a cada PROFILE_INTERVAL_MS
+(sys._current_frames, sem sys.setprofile: o custo não depende de quantas funções rodam)
+e classifica cada amostra em:
+
+    [sleep]          dentro de time.sleep (esperas fixas do bot e polling)
+    [webdriver http] esperando o chromedriver (remote_connection -> urllib3/http.client)
+    cpu              o resto: Python puro (regex, dedupe, openpyxl, sqlite...)
+
+Ao final grava, ao lado do log da execução:
+    run-...prof.speedscope.json   abrir em https://www.speedscope.app
+    run-...prof.folded            pilhas "a;b;c N" (flamegraph.pl / inferno)
+    run-...prof.txt               tempo por categoria + top-N por tempo próprio e inclusivo
+
+Desligado, nada disso é carregado nem altera time.sleep.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+LOG = logging.getLogger("fapbot")
+
+PROFILE_INTERVAL_MS = 5
+TOP_N = 25
+
+SLEEP = "[sleep]"
+WEBDRIVER = "[webdriver http]"
+CPU = "cpu"
+# Arquivos que indicam chamada HTTP ao chromedriver em andamento
+_WEBDRIVER_FILES = ("remote_connection.py", os.sep + "urllib3" + os.sep, os.sep + "http" + os.sep + "client.py")
+
+Frame = Tuple[str, str, int]  # (função, arquivo, linha de definição)
+
+
+class SamplingProfiler:
+    """Amostrador de pilha de uma thread (a que chamou start(), por padrão)."""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, thread_id: Optional[int] = None):
+        self.interval = interval_ms / 1000.0
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()        # pilha (tupla de Frame, raiz primeiro) -> segundos
+        self.categories: Dict[str, float] = defaultdict(float)
+        self.samples = 0
+        self.wall = 0.0
+        self._sleeping: Dict[int, int] = {}     # thread id -> profundidade de time.sleep
+        self._orig_sleep = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._t0 = 0.0
+        self._skip = None
+
+    # -- time.sleep instrumentado (só enquanto o perfil está ativo) --
+    def _patch_sleep(self):
+        orig = self._orig_sleep = time.sleep
+        sleeping = self._sleeping
+
+        def sleep(secs):
+            tid = threading.get_ident()
+            sleeping[tid] = sleeping.get(tid, 0) + 1
+            try:
+                orig(secs)
+            finally:
+                sleeping[tid] -= 1
+
+        time.sleep = sleep
+        self._skip = sleep.__code__  # o wrapper não aparece nas pilhas
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._patch_sleep()
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="fapbot-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if self._orig_sleep is not None:
+            time.sleep = self._orig_sleep
+        self.wall = time.perf_counter() - self._t0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _classify(self, stack: List[Frame]) -> str:
+        if self._sleeping.get(self.thread_id):
+            return SLEEP
+        for _, filename, _ in stack:
+            if any(m in filename for m in _WEBDRIVER_FILES):
+                return WEBDRIVER
+        return CPU
+
+    def _run(self):
+        wait = self._orig_sleep or time.sleep
+        last = time.perf_counter()
+        while not self._stop.is_set():
+            wait(self.interval)
+            now = time.perf_counter()
+            dt, last = now - last, now
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack: List[Frame] = []
+            while frame is not None:
+                code = frame.f_code
+                if code is not self._skip:
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            cat = self._classify(stack)
+            if cat != CPU:
+                stack.append((cat, "", 0))
+            self.stacks[tuple(stack)] += dt
+            self.categories[cat] += dt
+            self.samples += 1
+
+    # -- saídas --
+    @staticmethod
+    def _label(f: Frame) -> str:
+        name, filename, line = f
+        return f"{name} ({os.path.basename(filename)}:{line})" if filename else name
+
+    def folded(self) -> str:
+        lines = []
+        for stack, secs in self.stacks.most_common():
+            lines.append(";".join(self._label(f) for f in stack) + f" {max(1, round(secs * 1000))}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str = "fapbot") -> Dict:
+        index: Dict[Frame, int] = {}
+        frames: List[Dict] = []
+        samples, weights = [], []
+        for stack, secs in self.stacks.items():
+            ids = []
+            for f in stack:
+                if f not in index:
+                    index[f] = len(frames)
+                    fr = {"name": f[0]}
+                    if f[1]:
+                        fr.update(file=f[1], line=f[2])
+                    frames.append(fr)
+                ids.append(index[f])
+            samples.append(ids)
+            weights.append(round(secs, 6))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": name, "unit": "seconds",
+                "startValue": 0, "endValue": round(sum(weights), 6),
+                "samples": samples, "weights": weights,
+            }],
+            "name": name,
+            "exporter": "fapbot profiling.py",
+        }
+
+    def summary(self, top: int = TOP_N) -> str:
+        total = sum(self.categories.values()) or 1e-9
+        out = [f"Perfil: {self.wall:.1f}s de parede, {self.samples} amostras a cada {self.interval * 1000:.0f} ms", ""]
+        out.append("Tempo por categoria:")
+        for cat, secs in sorted(self.categories.items(), key=lambda kv: -kv[1]):
+            out.append(f"  {cat:<18} {secs:9.1f}s  {secs / total * 100:5.1f}%")
+        own: Counter = Counter()
+        incl: Counter = Counter()
+        for stack, secs in self.stacks.items():
+            own[stack[-1]] += secs
+            for f in set(stack):
+                incl[f] += secs
+        for title, cnt in (("Top por tempo próprio:", own), ("Top por tempo inclusivo:", incl)):
+            out += ["", title]
+            for f, secs in cnt.most_common(top):
+                out.append(f"  {secs:9.1f}s  {secs / total * 100:5.1f}%  {self._label(f)}")
+        return "\n".join(out) + "\n"
+
+    def write(self, base: str, name: str = "fapbot") -> List[str]:
+        """Grava base.speedscope.json, base.folded e base.txt; retorna os caminhos."""
+        paths = [base + ".speedscope.json", base + ".folded", base + ".txt"]
+        with open(paths[0], "w", encoding="utf-8") as f:
+            json.dump(self.speedscope(name), f)
+        with open(paths[1], "w", encoding="utf-8") as f:
+            f.write(self.folded())
+        with open(paths[2], "w", encoding="utf-8") as f:
+            f.write(self.summary())
+        return paths
+
+
+def profile_base(log_path: Optional[str]) -> str:
+    """'logs/run-20251030_195431.log' -> 'logs/run-20251030_195431.prof'."""
+    if log_path:
+        return os.path.splitext(log_path)[0] + ".prof"
+    return os.path.join("logs", time.strftime("run-%Y%m%d_%H%M%S") + ".prof")
@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+
+LOG = logging.getLogger("fapbot")
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket com taxa ajustada por AIMD a partir do retorno do portal.
+
+    - reserve(): reserva um token e diz quanto esperar (usado pelo coordenador)
+    - acquire(): reserva e dorme o necessário (uma consulta = um token)
+    - report(): sucesso rápido => taxa += increase (aditivo);
+      latência alta, HTTP 429/5xx ou captcha => taxa *= decrease (multiplicativo),
+      no máximo uma redução por `cooldown` segundos.
+
+    Thread-safe: uma instância (shared_limiter) é compartilhada por todos os workers do processo.
+    """
+
+    def __init__(self, rate: float = 20 / 60, min_rate: float = 1 / 60, max_rate: float = 2.0, burst: float = 2.0,
+                 increase: float = 1 / 60, decrease: float = 0.5, slow_latency: float = 8.0, cooldown: float = 30.0):
+        self.rate = rate            # consultas por segundo
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_latency = slow_latency
+        self.cooldown = cooldown
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._last_cut = 0.0
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"ok": 0, "lento": 0, "http": 0, "captcha": 0, "reducoes": 0}
+        self.waited = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self) -> float:
+        """Reserva um token e retorna quanto esperar (s) até usá-lo; não bloqueia."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1.0
+            return max(0.0, -self._tokens) / max(self.rate, 1e-6)
+
+    def acquire(self) -> float:
+        """Espera um token; retorna quanto tempo esperou (s)."""
+        waited = self.reserve()
+        if waited > 0:
+            time.sleep(waited)
+        with self._lock:
+            self.waited += waited
+        return waited
+
+    def _cut(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_cut < self.cooldown:
+            return
+        old = self.rate
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self._tokens = min(self._tokens, 0.0)
+        self._last_cut = now
+        self.counters["reducoes"] += 1
+        LOG.warning(f"Limitador: {reason}; taxa {old * 60:.1f} -> {self.rate * 60:.1f} consultas/min")
+
+    def report(self, latency: float, http_statuses: Iterable[int] = (), captcha: bool = False):
+        """Registra o resultado de uma consulta e ajusta a taxa."""
+        bad = [s for s in http_statuses if s == 429 or s >= 500]
+        with self._lock:
+            self._refill(time.monotonic())
+            if captcha:
+                self.counters["captcha"] += 1
+                self._cut("captcha detectado")
+            elif bad:
+                self.counters["http"] += 1
+                self._cut(f"HTTP {sorted(set(bad))}")
+            elif latency > self.slow_latency:
+                self.counters["lento"] += 1
+                self._cut(f"resposta lenta ({latency:.1f}s)")
+            else:
+                self.counters["ok"] += 1
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counters, taxa_por_min=round(self.rate * 60, 2), espera_total_s=round(self.waited, 1))
+
+
+_SHARED: Optional[AdaptiveRateLimiter] = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_limiter(**kwargs) -> AdaptiveRateLimiter:
+    """Instância única por processo (os kwargs só valem na primeira chamada)."""
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = AdaptiveRateLimiter(**kwargs)
+        return _SHARED
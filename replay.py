@@ -0,0 +1,344 @@
+"""
+Gravação e reprodução de sessões do portal, para reproduzir execuções lentas/falhas
+e medir mudanças em coletores/extratores sem depender do portal.
+
+Gravação (py main.py --gravar gravacoes/AAAAMMDD): todas as respostas de
+fap.dataprev.gov.br são capturadas via CDP (Fetch, estágio de resposta) com a latência
+original, e a cada passo de consultar_para_todos (seleção, coleta, consulta, extração)
+é guardado um snapshot do DOM dos comboboxes e do painel de resultado.
+
+    gravacoes/AAAAMMDD/
+        meta.json      início, hosts
+        rede.jsonl     uma resposta por linha (método, URL, status, cabeçalhos, latência, corpo)
+        corpos/        corpos das respostas (nome = sha256, sem repetição)
+        passos.jsonl   um passo por linha (fase, vigência, CNPJ, estab, início/fim, DOM)
+
+Reprodução: as requisições do bot ao portal são atendidas a partir da gravação
+(Fetch.fulfillRequest), na mesma ordem e com a latência original dividida por
+--velocidade (as esperas fixas do bot também são divididas).
+
+    py replay.py resumo gravacoes/AAAAMMDD
+    py replay.py reproduzir gravacoes/AAAAMMDD --velocidade 4 --vigencias 2025
+
+Requer websocket-client (mesma sessão CDP do cache de estáticos).
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from asset_cache import FetchSession, register_fetch_session, stop_fetch_sessions
+
+LOG = logging.getLogger("fapbot")
+
+RECORD_HOSTS = ("fap.dataprev.gov.br",)
+# Cabeçalhos que não podem ser repetidos com o corpo já decodificado
+_DROP_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+_DOM_SNAPSHOT_JS = r"""
+const [xpEstab, xpResultado, xpAliquota] = arguments;
+const q = (xp) => document.evaluate(xp, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+const cut = (el, n) => el ? el.outerHTML.slice(0, n) : null;
+const cnpj = document.getElementById('cnpjRaiz');
+const estab = q(xpEstab);
+return {
+  url: location.href,
+  cnpj: cnpj ? cnpj.value : null,
+  estab: estab ? estab.value : null,
+  listbox: cut(document.querySelector('[role="listbox"]'), 200000),
+  resultado: cut(q(xpResultado), 50000),
+  aliquota: cut(q(xpAliquota), 20000),
+};
+"""
+
+
+def _post_hash(post: Optional[str]) -> str:
+    return hashlib.sha1(post.encode("utf-8")).hexdigest() if post else ""
+
+
+class SessionRecording:
+    """Escrita da gravação (thread-safe: rede vem das sessões CDP, passos vêm do bot)."""
+
+    def __init__(self, path: str, dom_xpaths: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.dom_xpaths = dom_xpaths or {}
+        self.t0 = time.time()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(path, "corpos"), exist_ok=True)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"inicio": datetime.now().isoformat(sep=" ", timespec="seconds"), "hosts": RECORD_HOSTS}, f)
+        self._net = open(os.path.join(path, "rede.jsonl"), "a", encoding="utf-8")
+        self._steps = open(os.path.join(path, "passos.jsonl"), "a", encoding="utf-8")
+        self.n_responses = 0
+        self.n_steps = 0
+
+    def add_response(self, req: Dict, status: int, headers: List[Dict], body: bytes, t_req: float, ms: float,
+                     resource_type: str = ""):
+        digest = hashlib.sha256(body).hexdigest()
+        bpath = os.path.join(self.path, "corpos", digest)
+        if not os.path.exists(bpath):
+            with open(bpath, "wb") as f:
+                f.write(body)
+        rec = {
+            "t": round(t_req - self.t0, 3), "ms": round(ms, 1), "tipo": resource_type,
+            "metodo": req.get("method", "GET"), "url": req.get("url", ""), "post": _post_hash(req.get("postData")),
+            "status": status, "cabecalhos": headers, "corpo": digest,
+        }
+        with self.lock:
+            self._net.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._net.flush()
+            self.n_responses += 1
+
+    def step(self, driver, fase: str, vigencia: str, cnpj: str, estab: str, t0: float, t1: float):
+        try:
+            dom = driver.execute_script(
+                _DOM_SNAPSHOT_JS,
+                self.dom_xpaths.get("estab", ""), self.dom_xpaths.get("resultado", ""), self.dom_xpaths.get("aliquota", ""),
+            )
+        except Exception as e:
+            dom = {"erro": str(e)}
+        rec = {
+            "fase": fase, "vigencia": str(vigencia), "cnpj": cnpj, "estab": estab,
+            "t0": round(t0 - self.t0, 3), "t1": round(t1 - self.t0, 3), "dom": dom,
+        }
+        with self.lock:
+            self._steps.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._steps.flush()
+            self.n_steps += 1
+
+    def close(self):
+        with self.lock:
+            self._net.close()
+            self._steps.close()
+        LOG.info(f"Gravação em {self.path}: {self.n_responses} respostas, {self.n_steps} passos.")
+
+
+class NetworkRecorder(FetchSession):
+    """Pausa cada requisição do portal, segue com interceptResponse e grava a resposta."""
+
+    label = "Gravação"
+
+    def __init__(self, recording: SessionRecording, debugger_addr: str, target_id: str):
+        super().__init__(debugger_addr, target_id)
+        self.recording = recording
+        self._started: Dict[str, float] = {}
+
+    def patterns(self) -> List[Dict]:
+        return [{"urlPattern": f"*://{h}/*", "requestStage": "Request"} for h in RECORD_HOSTS]
+
+    def on_paused(self, p: Dict):
+        rid = p["requestId"]
+        if "responseStatusCode" not in p and "responseErrorReason" not in p:
+            self._started[rid] = time.time()
+            self._send("Fetch.continueRequest", {"requestId": rid, "interceptResponse": True})
+            return
+        t_req = self._started.pop(rid, time.time())
+        ms = (time.time() - t_req) * 1000
+        status = int(p.get("responseStatusCode") or 0)
+        body = b""
+        if status and not 300 <= status < 400:
+            try:
+                res = self._send("Fetch.getResponseBody", {"requestId": rid}, wait=True)
+                body = base64.b64decode(res["body"]) if res.get("base64Encoded") else res.get("body", "").encode("utf-8")
+            except Exception as e:
+                LOG.debug(f"Gravação: sem corpo para {p['request']['url']}: {e}")
+        headers = [h for h in p.get("responseHeaders") or [] if h["name"].lower() not in _DROP_HEADERS]
+        self.recording.add_response(p["request"], status, headers, body, t_req, ms, p.get("resourceType", ""))
+        self._send("Fetch.continueRequest", {"requestId": rid})
+
+
+def start_recording(driver, debugger_addr: str, path: str, dom_xpaths: Optional[Dict[str, str]] = None) -> Optional[SessionRecording]:
+    """Grava rede (aba atual e próximas) e passos (via driver._fap_recorder) em `path`."""
+    rec = SessionRecording(path, dom_xpaths)
+    if not register_fetch_session(driver, "gravacao", lambda h: NetworkRecorder(rec, debugger_addr, h)):
+        rec.close()
+        return None
+    driver._fap_recorder = rec
+    LOG.info(f"Gravando sessão em {path}")
+    return rec
+
+
+def stop_recording(driver):
+    rec = getattr(driver, "_fap_recorder", None)
+    stop_fetch_sessions(driver, "gravacao")
+    if rec is not None:
+        rec.close()
+        driver._fap_recorder = None
+
+
+# -----------------------------------------------------------------------------
+# Reprodução
+# -----------------------------------------------------------------------------
+class Recording:
+    """Leitura da gravação: respostas por (método, URL, post) na ordem original."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.exact: Dict[tuple, deque] = defaultdict(deque)
+        self.by_path: Dict[tuple, deque] = defaultdict(deque)
+        self.last: Dict[tuple, Dict] = {}
+        with open(os.path.join(path, "rede.jsonl"), encoding="utf-8") as f:
+            for ln in f:
+                r = json.loads(ln)
+                self.exact[(r["metodo"], r["url"], r["post"])].append(r)
+                self.by_path[(r["metodo"], urlsplit(r["url"]).path)].append(r)
+        self.lock = threading.Lock()
+        self.served = 0
+        self.missing: List[str] = []
+
+    def match(self, method: str, url: str, post: Optional[str]) -> Optional[Dict]:
+        """Próxima resposta gravada para a requisição (exata; senão, mesmo caminho sem query)."""
+        with self.lock:
+            for key, table in (((method, url, _post_hash(post)), self.exact),
+                               ((method, urlsplit(url).path), self.by_path)):
+                q = table.get(key)
+                if q:
+                    r = q.popleft() if len(q) > 1 else q[0]  # esgotou: repete a última
+                    self.served += 1
+                    return r
+            self.missing.append(f"{method} {url}")
+            return None
+
+    def body(self, r: Dict) -> bytes:
+        with open(os.path.join(self.path, "corpos", r["corpo"]), "rb") as f:
+            return f.read()
+
+
+class ReplayInterceptor(FetchSession):
+    """Atende as requisições do portal com a gravação, após latência original / velocidade."""
+
+    label = "Reprodução"
+
+    def __init__(self, recording: Recording, speed: float, debugger_addr: str, target_id: str):
+        super().__init__(debugger_addr, target_id)
+        self.recording = recording
+        self.speed = max(speed, 0.01)
+
+    def patterns(self) -> List[Dict]:
+        return [{"urlPattern": f"*://{h}/*", "requestStage": "Request"} for h in RECORD_HOSTS]
+
+    def _fulfill(self, rid: str, r: Optional[Dict]):
+        try:
+            if r is None:
+                self._send("Fetch.fulfillRequest", {"requestId": rid, "responseCode": 404, "body": ""})
+                return
+            if not r["status"]:
+                # a requisição original falhou (rede); reproduz a falha
+                self._send("Fetch.failRequest", {"requestId": rid, "errorReason": "Failed"})
+                return
+            self._send("Fetch.fulfillRequest", {
+                "requestId": rid,
+                "responseCode": r["status"],
+                "responseHeaders": r["cabecalhos"],
+                "body": base64.b64encode(self.recording.body(r)).decode("ascii"),
+            })
+        except Exception as e:
+            LOG.debug(f"Reprodução: falha ao responder {rid}: {e}")
+
+    def on_paused(self, p: Dict):
+        req = p["request"]
+        r = self.recording.match(req.get("method", "GET"), req["url"], req.get("postData"))
+        if r is None:
+            LOG.warning(f"Reprodução: sem gravação para {req.get('method')} {req['url']}")
+        delay = (r["ms"] / 1000.0 / self.speed) if r else 0.0
+        if delay > 0.005:
+            threading.Timer(delay, self._fulfill, args=(p["requestId"], r)).start()
+        else:
+            self._fulfill(p["requestId"], r)
+
+
+def enable_replay(driver, debugger_addr: str, path: str, speed: float = 1.0) -> Optional[Recording]:
+    rec = Recording(path)
+    if not register_fetch_session(driver, "reproducao", lambda h: ReplayInterceptor(rec, speed, debugger_addr, h)):
+        return None
+    LOG.info(f"Reproduzindo {path} ({sum(len(q) for q in rec.exact.values())} respostas, velocidade {speed}x)")
+    return rec
+
+
+# -----------------------------------------------------------------------------
+# Linha de comando
+# -----------------------------------------------------------------------------
+def _load_steps(path: str) -> List[Dict]:
+    with open(os.path.join(path, "passos.jsonl"), encoding="utf-8") as f:
+        return [json.loads(ln) for ln in f if ln.strip()]
+
+
+def summarize(path: str, top: int = 10):
+    """Duração por fase, maiores intervalos entre passos e requisições mais lentas."""
+    steps = _load_steps(path)
+    by_phase = defaultdict(list)
+    for s in steps:
+        by_phase[s["fase"]].append(s["t1"] - s["t0"])
+    print(f"{len(steps)} passos")
+    for fase, d in sorted(by_phase.items()):
+        print(f"  {fase:<10} n={len(d):<5} média={sum(d) / len(d):6.2f}s  máx={max(d):6.2f}s")
+    gaps = sorted(
+        ((b["t0"] - a["t1"], a, b) for a, b in zip(steps, steps[1:])),
+        key=lambda g: -g[0],
+    )[:top]
+    print("Maiores intervalos entre passos:")
+    for g, a, b in gaps:
+        print(f"  {g:6.1f}s  após {a['fase']} [{a['vigencia']}] {a['cnpj']} {a['estab'] or ''} -> {b['fase']} (t={a['t1']:.0f}s)")
+    with open(os.path.join(path, "rede.jsonl"), encoding="utf-8") as f:
+        net = [json.loads(ln) for ln in f if ln.strip()]
+    print(f"{len(net)} respostas gravadas; mais lentas:")
+    for r in sorted(net, key=lambda r: -r["ms"])[:top]:
+        print(f"  {r['ms'] / 1000:6.2f}s  {r['status']} {r['metodo']} {r['url'][:100]} (t={r['t']:.0f}s)")
+
+
+def replay_sweep(path: str, debugger: str, vigencias: List[str], speed: float = 1.0) -> Dict:
+    """Roda consultar_para_todos contra a gravação e devolve o resumo de métricas."""
+    import main as bot
+    from metrics import SweepMetrics
+
+    # esperas fixas do bot também aceleram
+    bot.SLEEP_AFTER_TYPE /= speed
+    bot.SLEEP_AFTER_CONSULT /= speed
+    holder = {}
+    driver = bot.prepare_driver(debugger, on_attach=lambda d: holder.setdefault("rec", enable_replay(d, debugger, path, speed)))
+    metrics = SweepMetrics()
+    t0 = time.time()
+    try:
+        bot.consultar_para_todos(driver, anos=vigencias, metrics=metrics)
+    finally:
+        stop_fetch_sessions(driver, "reproducao")
+    snap = metrics.snapshot()
+    rec = holder.get("rec")
+    snap["reproducao"] = {
+        "segundos": round(time.time() - t0, 1),
+        "respostas_servidas": rec.served if rec else 0,
+        "sem_gravacao": len(rec.missing) if rec else 0,
+    }
+    return snap
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Gravações de sessão do portal FAP (resumo e reprodução)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("resumo", help="fases, maiores intervalos e requisições mais lentas")
+    p.add_argument("gravacao")
+    p.add_argument("--top", type=int, default=10)
+    p = sub.add_parser("reproduzir", help="roda a varredura contra a gravação")
+    p.add_argument("gravacao")
+    p.add_argument("--debugger", default="127.0.0.1:9222")
+    p.add_argument("--vigencias", nargs="+", default=["2025", "2026"])
+    p.add_argument("--velocidade", type=float, default=1.0, help="1 = tempo original; 4 = quatro vezes mais rápido")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "resumo":
+        summarize(args.gravacao, args.top)
+    elif args.cmd == "reproduzir":
+        print(json.dumps(replay_sweep(args.gravacao, args.debugger, args.vigencias, args.velocidade),
+                         ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    _cli()
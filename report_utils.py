@@ -1,6 +1,27 @@
 import os
 import csv
-from typing import List, Dict
+import json
+import time
+import atexit
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List
+
+
+# Cabeçalho padrão do relatório (Estab_Nome fica de fora por padrão)
+REPORT_HEADERS = [
+    "CNPJ_Raiz", "Razao_Social", "CNPJ_Estab",
+    "UF", "Municipio", "Vigencia", "Aliquota", "Data_Consulta",
+]
+
+
+def _only_digits(s: str) -> str:
+    """Retorna apenas os dígitos presentes na string fornecida."""
+    try:
+        return "".join(ch for ch in str(s) if ch.isdigit())
+    except Exception:
+        return ""
 
 
 def append_row_to_excel(path: str, row: Dict[str, str], headers: List[str]):
@@ -39,3 +60,492 @@ def append_row_to_excel(path: str, row: Dict[str, str], headers: List[str]):
             if not file_exists:
                 writer.writeheader()
             writer.writerow(row)
+
+
+# Largura dos CNPJs na chave: o Excel guarda CNPJ como número e come os zeros à esquerda
+_CNPJ_WIDTH = {"CNPJ_Estab": 14, "CNPJ_Raiz": 8}
+
+
+def _row_key(row: Dict[str, str], key_cols) -> tuple:
+    """Chave normalizada (CNPJ só com dígitos e zeros à esquerda repostos, demais como texto sem espaços)."""
+    out = []
+    for k in key_cols:
+        v = "" if row.get(k) is None else str(row.get(k)).strip()
+        if v.endswith(".0"):  # número vindo do Excel
+            v = v[:-2]
+        if k.startswith("CNPJ"):
+            v = "".join(ch for ch in v if ch.isdigit())
+            if v and k in _CNPJ_WIDTH:
+                v = v.zfill(_CNPJ_WIDTH[k])
+        out.append(v)
+    return tuple(out)
+
+
+class ReportUpsertWriter:
+    """
+    Relatório com upsert por chave (padrão: CNPJ_Estab + Vigencia).
+    O arquivo é aberto uma única vez; um índice em memória chave -> nº da linha
+    permite atualizar no lugar em vez de duplicar. Cabeçalhos antigos são migrados
+    numa passada só (colunas mapeadas por nome).
+
+    Como o openpyxl regrava o arquivo inteiro a cada save, os saves são agrupados:
+    no máximo um a cada `flush_every` linhas ou `flush_interval` segundos (e no close()).
+    O que estiver pendente também é gravado na saída do processo (atexit, inclusive após
+    Ctrl+C); numa queda dura as linhas continuam no histórico SQLite (export_latest).
+    Linhas repetidas (mesma chave) já presentes no arquivo ficam só na última ocorrência.
+    Sem openpyxl, usa CSV com a mesma semântica (reescrita atômica no flush).
+    """
+
+    def __init__(self, path: str, headers: List[str], key=("CNPJ_Estab", "Vigencia"),
+                 flush_every: int = 25, flush_interval: float = 60.0):
+        self.headers = list(headers)
+        self.key = tuple(key)
+        self.flush_every = max(1, int(flush_every))
+        self.flush_interval = flush_interval
+        self._index: Dict[tuple, int] = {}
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._wb = self._ws = None
+        self._rows: List[List[str]] = []  # só no modo CSV
+        try:
+            import openpyxl  # noqa: F401
+            self.path = path
+            self._open_xlsx()
+        except ImportError:
+            self.path = path[:-5] + ".csv" if path.lower().endswith(".xlsx") else path + ".csv"
+            self._open_csv()
+        atexit.register(self._flush_at_exit)
+
+    # ---- abertura ----
+    def _migrate(self, old_headers: List[str], rows) -> List[List[str]]:
+        pos = {h: i for i, h in enumerate(old_headers) if h}
+        out = []
+        for r in rows:
+            if not any(v not in (None, "") for v in r):
+                continue
+            out.append([r[pos[h]] if h in pos and pos[h] < len(r) else "" for h in self.headers])
+        return out
+
+    def _dedupe(self, data: List[List[str]]):
+        """(linhas sem as ocorrências anteriores de cada chave, índice chave -> posição, nº removidas)."""
+        key_pos = [self.headers.index(k) for k in self.key]
+        keys = [_row_key({self.headers[p]: r[p] for p in key_pos if p < len(r)}, self.key) for r in data]
+        last = {k: i for i, k in enumerate(keys) if all(k)}  # chave incompleta não é indexada
+        out, index = [], {}
+        for i, (r, k) in enumerate(zip(data, keys)):
+            if all(k) and last[k] != i:
+                continue
+            if all(k):
+                index[k] = len(out)
+            out.append(r)
+        return out, index, len(data) - len(out)
+
+    def _open_xlsx(self):
+        from openpyxl import Workbook, load_workbook
+        if not os.path.exists(self.path):
+            self._wb = Workbook()
+            self._ws = self._wb.active
+            self._ws.append(self.headers)
+            self._pending = 1
+            return
+        self._wb = load_workbook(self.path)
+        self._ws = ws = self._wb.active
+        rows = ws.iter_rows(values_only=True)
+        first = next(rows, None)
+        old_headers = [("" if v is None else str(v)) for v in (first or [])]
+        migrate = old_headers != self.headers
+        # Migração em uma passada: relê tudo pelo cabeçalho antigo e regrava a planilha
+        data = self._migrate(old_headers, rows) if migrate else [list(r) for r in rows]
+        data, index, dropped = self._dedupe(data)
+        if migrate or dropped:
+            title = ws.title
+            self._wb.remove(ws)
+            self._ws = ws = self._wb.create_sheet(title, 0)
+            self._wb.active = 0
+            ws.append(self.headers)
+            for r in data:
+                ws.append(r)
+            self._pending = 1
+        self._index = {k: i + 2 for k, i in index.items()}  # linha 1 = cabeçalho
+
+    def _open_csv(self):
+        if os.path.exists(self.path):
+            with open(self.path, newline="", encoding="utf-8-sig") as f:
+                rd = csv.reader(f)
+                old_headers = next(rd, [])
+                data = list(rd)
+            if old_headers != self.headers:
+                data = self._migrate(old_headers, data)
+                self._pending = 1
+            self._rows, self._index, dropped = self._dedupe(data)
+            if dropped:
+                self._pending = 1
+        else:
+            self._pending = 1
+
+    # ---- escrita ----
+    def upsert(self, row: Dict[str, str]) -> bool:
+        """Insere ou atualiza a linha da chave; retorna True se foi atualização."""
+        values = [row.get(h, "") for h in self.headers]
+        k = _row_key(row, self.key)
+        n = self._index.get(k)
+        if self._ws is not None:
+            if n is None:
+                self._ws.append(values)
+                self._index[k] = self._ws.max_row
+            else:
+                for i, v in enumerate(values, start=1):
+                    self._ws.cell(row=n, column=i, value=v)
+        else:
+            if n is None:
+                self._index[k] = len(self._rows)
+                self._rows.append(values)
+            else:
+                self._rows[n] = values
+        self._pending += 1
+        if self._pending >= self.flush_every or (time.monotonic() - self._last_flush) >= self.flush_interval:
+            self.flush()
+        return n is not None
+
+    def flush(self):
+        """Grava em disco (arquivo temporário + replace, para não corromper em caso de queda)."""
+        if not self._pending:
+            return
+        tmp = self.path + ".tmp"
+        if self._wb is not None:
+            self._wb.save(tmp)
+        else:
+            with open(tmp, mode="w", newline="", encoding="utf-8-sig") as f:
+                w = csv.writer(f)
+                w.writerow(self.headers)
+                w.writerows(self._rows)
+        os.replace(tmp, self.path)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def close(self):
+        atexit.unregister(self._flush_at_exit)
+        self.flush()
+        if self._wb is not None:
+            try:
+                self._wb.close()
+            except Exception:
+                pass
+
+    def __len__(self):
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------------------------------------------------------------------------
+# Shards por worker + merge em streaming
+#
+# Vários processos não podem gravar no mesmo .xlsx (o openpyxl regrava o arquivo
+# inteiro; saves concorrentes corrompem). Cada worker anexa linhas no seu próprio
+# shard (JSONL ou CSV, uma linha por write, só append) e o merge lê todos em
+# streaming, deduplica por chave numa tabela SQLite temporária (em disco, não em
+# memória) e escreve a planilha final no modo write-only do openpyxl.
+# ---------------------------------------------------------------------------
+
+SHARD_DIR = "shards"
+
+
+def shard_path(report_path: str, worker: str, ext: str = ".jsonl") -> str:
+    """'saida/relatorio_fap.xlsx', 'w1' -> 'saida/shards/relatorio_fap.w1.jsonl'."""
+    base = os.path.dirname(os.path.abspath(report_path))
+    stem = os.path.splitext(os.path.basename(report_path))[0]
+    return os.path.join(base, SHARD_DIR, f"{stem}.{worker}{ext}")
+
+
+class ShardWriter:
+    """
+    Shard só de append de um worker (.jsonl ou .csv pela extensão). Mesma interface do
+    ReportUpsertWriter (upsert/flush/close), mas sem ler nem reescrever nada: a
+    deduplicação fica para merge_shards. Uma queda deixa no máximo a última linha
+    incompleta, que o merge ignora.
+    """
+
+    def __init__(self, path: str, headers: List[str]):
+        self.path = path
+        self.headers = list(headers)
+        self.csv = path.lower().endswith(".csv")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._f = open(path, "a", newline="", encoding="utf-8")
+        self._n = 0
+        if self.csv:
+            self._w = csv.writer(self._f)
+            if new:
+                self._w.writerow(self.headers)
+
+    def upsert(self, row: Dict[str, str]) -> bool:
+        if self.csv:
+            self._w.writerow(["" if row.get(h) is None else row.get(h) for h in self.headers])
+        else:
+            self._f.write(json.dumps({h: row.get(h, "") for h in self.headers}, ensure_ascii=False) + "\n")
+        self._f.flush()
+        self._n += 1
+        return False
+
+    def flush(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        if not self._f.closed:
+            self.flush()
+            self._f.close()
+
+    def __len__(self):
+        return self._n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_shard_rows(path: str) -> Iterator[Dict[str, str]]:
+    """Linhas de um shard (.jsonl ou .csv), pulando linhas truncadas/ilegíveis."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def consulta_sort_key(value) -> str:
+    """Data_Consulta ('dd/mm/YYYY HH:MM:SS', ISO ou datetime) -> 'YYYY-MM-DD HH:MM:SS' comparável."""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    s = "" if value is None else str(value).strip()
+    for fmt in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(s[:19], fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    return ""
+
+
+def merge_rows(rows: Iterable[Dict[str, str]], out_path: str, headers: List[str] = REPORT_HEADERS,
+               key=("CNPJ_Estab", "Vigencia"), ts_col: str = "Data_Consulta") -> int:
+    """
+    Deduplica `rows` por `key` (fica a linha com `ts_col` mais recente; empate = a última
+    lida) e grava `out_path` (.xlsx write-only ou .csv). Memória limitada: as linhas
+    passam por uma tabela SQLite temporária em disco. Retorna o nº de linhas gravadas.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="fapbot-merge-")
+    db = os.path.join(tmpdir, "merge.db")
+    conn = sqlite3.connect(db)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE linhas (k TEXT PRIMARY KEY, ts TEXT, seq INTEGER, dados TEXT)")
+        sql = ("INSERT INTO linhas (k, ts, seq, dados) VALUES (?, ?, ?, ?) "
+               "ON CONFLICT(k) DO UPDATE SET ts=excluded.ts, seq=excluded.seq, dados=excluded.dados "
+               "WHERE excluded.ts >= linhas.ts")
+        batch = []
+        for seq, row in enumerate(rows):
+            k = _row_key(row, key)
+            # sem dígitos de CNPJ na chave as linhas colapsariam numa só ("", vigência): ficam de fora
+            if not any(k) or any(not v for h, v in zip(key, k) if h.startswith("CNPJ")):
+                continue
+            values = ["" if row.get(h) is None else row.get(h) for h in headers]
+            for h, v in zip(key, k):  # CNPJ da chave já normalizado (dígitos, zeros à esquerda)
+                if h.startswith("CNPJ") and h in headers:
+                    values[headers.index(h)] = v
+            batch.append(("\x1f".join(k), consulta_sort_key(row.get(ts_col)), seq,
+                          json.dumps(values, ensure_ascii=False, default=str)))
+            if len(batch) >= 5000:
+                conn.executemany(sql, batch)
+                batch = []
+        if batch:
+            conn.executemany(sql, batch)
+        conn.commit()
+        cur = conn.execute("SELECT dados FROM linhas ORDER BY k")
+        return _write_stream(out_path, headers, (json.loads(d) for (d,) in cur))
+    finally:
+        conn.close()
+        try:
+            os.remove(db)
+            os.rmdir(tmpdir)
+        except OSError:
+            pass
+
+
+def _write_stream(path: str, headers: List[str], rows: Iterable[List]) -> int:
+    """Grava linhas em streaming (openpyxl write-only; CSV se faltar openpyxl ou se .csv)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    xlsx = path.lower().endswith(".xlsx")
+    if xlsx:
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            xlsx, path = False, path[:-5] + ".csv"
+    tmp = path + ".tmp"
+    n = 0
+    if xlsx:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(headers)
+        for r in rows:
+            ws.append(r)
+            n += 1
+        wb.save(tmp)
+    else:
+        with open(tmp, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.writer(f)
+            w.writerow(headers)
+            for r in rows:
+                w.writerow(r)
+                n += 1
+    os.replace(tmp, path)
+    return n
+
+
+def merge_shards(paths: Iterable[str], out_path: str, headers: List[str] = REPORT_HEADERS,
+                 key=("CNPJ_Estab", "Vigencia")) -> int:
+    """Junta os shards em `out_path` (consulta mais recente por chave); retorna o nº de linhas."""
+    def rows():
+        for p in paths:
+            yield from iter_shard_rows(p)
+    return merge_rows(rows(), out_path, headers, key)
+
+
+# ---------------------------------------------------------------------------
+# Consolidação de relatórios antigos (cabeçalhos variados, CNPJ com/sem máscara)
+# ---------------------------------------------------------------------------
+
+# Cabeçalho normalizado (minúsculas, só letras/dígitos) -> coluna atual
+LEGACY_HEADER_ALIASES = {
+    "cnpjraiz": "CNPJ_Raiz", "raiz": "CNPJ_Raiz", "cnpjbase": "CNPJ_Raiz",
+    "razaosocial": "Razao_Social", "razao": "Razao_Social", "nome": "Razao_Social", "empresa": "Razao_Social",
+    "cnpjestab": "CNPJ_Estab", "cnpjestabelecimento": "CNPJ_Estab", "estabelecimento": "CNPJ_Estab", "cnpj": "CNPJ_Estab",
+    "estabnome": "Estab_Nome",
+    "uf": "UF", "estado": "UF",
+    "municipio": "Municipio", "cidade": "Municipio",
+    "vigencia": "Vigencia", "ano": "Vigencia",
+    "aliquota": "Aliquota", "fap": "Aliquota",
+    "dataconsulta": "Data_Consulta", "data": "Data_Consulta", "consultadoem": "Data_Consulta",
+}
+
+
+def _header_key(h) -> str:
+    s = str(h or "").lower()
+    for a, b in (("á", "a"), ("ã", "a"), ("â", "a"), ("ç", "c"), ("ê", "e"), ("é", "e"), ("í", "i"), ("ó", "o")):
+        s = s.replace(a, b)
+    return "".join(ch for ch in s if ch.isalnum())
+
+
+def map_legacy_headers(header) -> Dict[int, str]:
+    """{posição: coluna atual} para as colunas reconhecidas de um cabeçalho antigo."""
+    out: Dict[int, str] = {}
+    for i, h in enumerate(header or ()):
+        col = LEGACY_HEADER_ALIASES.get(_header_key(h))
+        if col and col not in out.values():
+            out[i] = col
+    return out
+
+
+def _cell_text(v) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)  # CNPJ/ano salvos como número pelo Excel
+    return str(v).strip()
+
+
+def normalize_report_row(row: Dict) -> Dict[str, str]:
+    """
+    Linha de um relatório antigo no formato atual: CNPJs só com dígitos (zeros à esquerda
+    que o Excel comeu são repostos), alíquota '1,0000' e Data_Consulta 'dd/mm/YYYY HH:MM:SS'.
+    Estab_Nome (coluna antiga, rótulo do dropdown) supre o CNPJ_Estab ausente.
+    """
+    estab = _only_digits(_cell_text(row.get("CNPJ_Estab"))) or _only_digits(_cell_text(row.get("Estab_Nome")))[:14]
+    raiz = _only_digits(_cell_text(row.get("CNPJ_Raiz")))
+    if estab and 8 < len(estab) < 14:
+        estab = estab.zfill(14)
+    if len(raiz) > 8:
+        raiz = raiz.zfill(14)[:8]
+    elif raiz:
+        raiz = raiz.zfill(8)
+    raiz = raiz or estab[:8]
+    aliq = row.get("Aliquota")
+    aliq = f"{aliq:.4f}".replace(".", ",") if isinstance(aliq, (int, float)) else _cell_text(aliq)
+    data = row.get("Data_Consulta")
+    data = data.strftime("%d/%m/%Y %H:%M:%S") if isinstance(data, datetime) else _cell_text(data)
+    return {
+        "CNPJ_Raiz": raiz,
+        "Razao_Social": _cell_text(row.get("Razao_Social")),
+        "CNPJ_Estab": estab,
+        "UF": _cell_text(row.get("UF")).upper(),
+        "Municipio": _cell_text(row.get("Municipio")),
+        "Vigencia": _only_digits(_cell_text(row.get("Vigencia")))[:4],
+        "Aliquota": aliq,
+        "Data_Consulta": data,
+    }
+
+
+def iter_report_rows(path: str) -> Iterator[Dict[str, str]]:
+    """
+    Linhas normalizadas de um relatório (.xlsx em modo read-only, ou .csv) em streaming.
+    Em .xlsx, lê todas as abas cujo cabeçalho tenha CNPJ_Estab (ou Estab_Nome) e Vigencia.
+    """
+    if not path.lower().endswith(".xlsx"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            head = f.readline()
+            f.seek(0)
+            rd = csv.reader(f, delimiter=";" if head.count(";") > head.count(",") else ",")
+            yield from _iter_mapped(rd)
+        return
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield from _iter_mapped(ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def _iter_mapped(rows) -> Iterator[Dict[str, str]]:
+    cols = None
+    for r in rows:
+        if not r or not any(v not in (None, "") for v in r):
+            continue
+        if cols is None:
+            cols = map_legacy_headers(r)
+            found = set(cols.values())
+            if "Vigencia" not in found or not found & {"CNPJ_Estab", "Estab_Nome"}:
+                return  # aba/arquivo sem cabeçalho de relatório
+            continue
+        row = normalize_report_row({c: r[i] for i, c in cols.items() if i < len(r)})
+        if row["CNPJ_Estab"] and row["Vigencia"]:
+            yield row
+
+
+def consolidate_reports(paths: Iterable[str], out_path: str, headers: List[str] = REPORT_HEADERS,
+                        key=("CNPJ_Estab", "Vigencia")) -> int:
+    """Junta relatórios antigos em `out_path` (consulta mais recente por chave); retorna o nº de linhas."""
+    def rows():
+        for p in paths:
+            yield from iter_report_rows(p)
+    return merge_rows(rows(), out_path, headers, key)
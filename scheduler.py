@@ -0,0 +1,148 @@
+"""
+Agendamento da varredura por custo (LPT - longest processing time first).
+
+O custo de um CNPJ raiz é estimado pelo número de estabelecimentos que ele teve na
+execução anterior (histórico SQLite) ou na descoberta. CNPJs grandes vão primeiro,
+para não sobrar um CNPJ de 200 estabelecimentos no fim da fila; etiquetas de
+prioridade (arquivo) passam na frente de tudo.
+
+    py scheduler.py plano --workers 3 --vigencia 2026 --prioridades prioridades.txt
+"""
+import heapq
+import argparse
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from store_utils import open_store, DEFAULT_DB_PATH
+
+# Tempos médios observados nos logs (s): seleção do CNPJ + coleta dos estabelecimentos,
+# e cada estabelecimento (seleção + consultar + extração)
+COST_BASE_S = 10.0
+COST_PER_ESTAB_S = 12.0
+
+
+def raiz_digits(label: str) -> str:
+    """'53.458.313 - NOME' (ou só dígitos) -> '53458313'."""
+    left = label.split(" - ")[0] if " - " in (label or "") else (label or "")
+    d = "".join(ch for ch in left if ch.isdigit())
+    return d[:8]
+
+
+def load_estab_counts(conn, vigencia: Optional[str] = None) -> Dict[str, int]:
+    """Nº de estabelecimentos por CNPJ raiz na execução mais recente em que cada um apareceu."""
+    params: list = []
+    where = ""
+    if vigencia:
+        where = "WHERE vigencia = ?"
+        params.append(str(vigencia))
+    rows = conn.execute(
+        f"""
+        SELECT r.cnpj_raiz, COUNT(DISTINCT r.cnpj_estab) AS n
+        FROM resultados r
+        JOIN (SELECT cnpj_raiz, MAX(run_id) AS run_id FROM resultados {where} GROUP BY cnpj_raiz) u
+          ON u.cnpj_raiz = r.cnpj_raiz AND u.run_id = r.run_id
+        {where.replace('vigencia', 'r.vigencia')}
+        GROUP BY r.cnpj_raiz
+        """,
+        params * 2,
+    ).fetchall()
+    return {r[0]: r[1] for r in rows if r[0]}
+
+
+def load_priorities(path: Optional[str]) -> Dict[str, int]:
+    """
+    Arquivo de prioridades: uma linha por CNPJ raiz, opcionalmente 'cnpj;nivel' (ou vírgula).
+    Sem nível, vale 1. Maior nível = antes. Linhas vazias/# são ignoradas.
+    """
+    out: Dict[str, int] = {}
+    if not path:
+        return out
+    with open(path, encoding="utf-8-sig") as f:
+        for ln in f:
+            ln = ln.strip()
+            if not ln or ln.startswith("#"):
+                continue
+            parts = [p.strip() for p in ln.replace(",", ";").split(";")]
+            d = raiz_digits(parts[0])
+            if not d:
+                continue
+            try:
+                out[d] = int(parts[1]) if len(parts) > 1 and parts[1] else 1
+            except ValueError:
+                out[d] = 1
+    return out
+
+
+def estimate_costs(labels: Iterable[str], counts: Dict[str, int]) -> Dict[str, float]:
+    """Custo estimado (s) por rótulo; CNPJs sem histórico usam a mediana dos conhecidos."""
+    labels = list(labels)
+    known = sorted(counts.values())
+    default_n = known[len(known) // 2] if known else 1
+    return {
+        lb: COST_BASE_S + COST_PER_ESTAB_S * counts.get(raiz_digits(lb), default_n)
+        for lb in labels
+    }
+
+
+def order_lpt(labels: Iterable[str], costs: Dict[str, float], priorities: Optional[Dict[str, int]] = None) -> List[str]:
+    """Ordena por prioridade (desc) e depois custo (desc); empate mantém a ordem original."""
+    priorities = priorities or {}
+    labels = list(labels)
+    pos = {lb: i for i, lb in enumerate(labels)}
+    return sorted(labels, key=lambda lb: (-priorities.get(raiz_digits(lb), 0), -costs.get(lb, 0.0), pos[lb]))
+
+
+def partition_lpt(labels: Iterable[str], costs: Dict[str, float], k: int) -> List[Tuple[float, List[str]]]:
+    """Divide em k partições pelo algoritmo LPT (sempre na partição menos carregada)."""
+    k = max(1, int(k))
+    heap = [(0.0, i) for i in range(k)]
+    bins: List[List[str]] = [[] for _ in range(k)]
+    loads = [0.0] * k
+    for lb in sorted(labels, key=lambda x: -costs.get(x, 0.0)):
+        load, i = heapq.heappop(heap)
+        bins[i].append(lb)
+        loads[i] = load + costs.get(lb, 0.0)
+        heapq.heappush(heap, (loads[i], i))
+    return [(loads[i], bins[i]) for i in range(k)]
+
+
+def priority_groups(ordered: List[str], priorities: Dict[str, int]) -> Dict[str, int]:
+    """Mapeia o ÚLTIMO rótulo de cada nível de prioridade -> nível (para fechar o grupo ao concluí-lo)."""
+    last: Dict[int, str] = {}
+    for lb in ordered:
+        lvl = priorities.get(raiz_digits(lb), 0)
+        if lvl > 0:
+            last[lvl] = lb
+    return {lb: lvl for lvl, lb in last.items()}
+
+
+def plan(labels: Iterable[str], conn=None, vigencia: Optional[str] = None,
+         priorities: Optional[Dict[str, int]] = None) -> Tuple[List[str], Dict[str, float]]:
+    """Ordem de execução + custos, usando o histórico (se houver) para estimar."""
+    counts = load_estab_counts(conn, vigencia) if conn is not None else {}
+    costs = estimate_costs(labels, counts)
+    return order_lpt(labels, costs, priorities), costs
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Plano de execução por custo (LPT) a partir do histórico")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("plano", help="mostra a divisão LPT dos CNPJs do histórico entre N workers")
+    p.add_argument("--db", default=DEFAULT_DB_PATH)
+    p.add_argument("--vigencia")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--prioridades")
+    args = ap.parse_args(argv)
+
+    conn = open_store(args.db)
+    counts = load_estab_counts(conn, args.vigencia)
+    labels = list(counts)
+    costs = estimate_costs(labels, counts)
+    prio = load_priorities(args.prioridades)
+    print(f"{len(labels)} CNPJs, custo total estimado {sum(costs.values()) / 3600:.1f} h")
+    for i, (load, items) in enumerate(partition_lpt(labels, costs, args.workers), start=1):
+        items = order_lpt(items, costs, prio)
+        print(f"worker {i}: {len(items)} CNPJs, {load / 3600:.2f} h; primeiros: {', '.join(items[:5])}")
+
+
+if __name__ == "__main__":
+    _cli()
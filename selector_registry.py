@@ -0,0 +1,207 @@
+"""
+Registro de seletores com vários candidatos por elemento lógico.
+
+Em vez de esperar o timeout de cada XPath em sequência (4 candidatos x 20 s no
+botão do certificado), todos os candidatos de um ou mais elementos são avaliados
+juntos a cada volta de um único laço de polling (um execute_script por volta);
+vence o primeiro candidato visível na ordem de preferência.
+
+A ordem de preferência aprende com o uso: o candidato que venceu por último é
+tentado primeiro (e depois os mais vitoriosos). Candidatos genéricos registrados como
+`fallback` (ex.: "button.br-button") nunca sobem: ficam sempre por último. Quando um candidato que já venceu
+deixa de ser encontrado e outro assume, o registro anota o "drift" e avisa no log,
+para o XPath quebrado ser corrigido antes de virar timeout. O histórico fica em
+`seletores.json` (vitórias, falhas, último sucesso por candidato).
+
+    py selector_registry.py            # relatório de drift a partir de seletores.json
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from dom_utils import resolve_candidates, click_element
+
+LOG = logging.getLogger("fapbot")
+
+SELECTOR_STATS_PATH = os.environ.get("FAPBOT_SELECTOR_STATS") or "seletores.json"
+POLL_INTERVAL = 0.15
+SAVE_EVERY = 25  # grava o JSON a cada N vitórias (e no save() explícito)
+
+
+def _now() -> str:
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+class SelectorRegistry:
+    """Candidatos por nome + estatísticas persistidas; thread-safe."""
+
+    def __init__(self, path: Optional[str] = SELECTOR_STATS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.candidates: Dict[str, List[str]] = {}
+        self.fallback: Dict[str, List[str]] = {}  # genéricos: sempre por último, na ordem declarada
+        # stats[nome] = {"ultimo": seletor, "candidatos": {seletor: {vitorias, falhas, ultimo_sucesso}}}
+        self.stats: Dict[str, Dict] = {}
+        self._warned: set = set()
+        self._unsaved = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.stats = json.load(f)
+            except Exception as e:
+                LOG.warning(f"Seletores: ignorando {path} ilegível ({e})")
+
+    def register(self, name: str, candidates: Iterable[str], fallback: Iterable[str] = ()) -> str:
+        with self.lock:
+            fallback = list(dict.fromkeys(fallback))
+            self.candidates[name] = [c for c in dict.fromkeys(candidates) if c not in fallback]
+            self.fallback[name] = fallback
+        return name
+
+    def ensure(self, candidates, name: Optional[str] = None) -> str:
+        """Nome de um grupo de candidatos (registra sob um nome estável se ainda não existir)."""
+        cands = [candidates] if isinstance(candidates, str) else list(candidates)
+        with self.lock:
+            for n, c in self.candidates.items():
+                if c == cands and (name is None or n == name):
+                    return n
+        return self.register(name or "xp:" + hashlib.sha1("\n".join(cands).encode()).hexdigest()[:10], cands)
+
+    def ordered(self, name: str) -> List[str]:
+        """Candidatos na ordem de tentativa: último vencedor, mais vitórias, ordem declarada; fallbacks no fim."""
+        with self.lock:
+            cands = self.candidates[name]
+            st = self.stats.get(name, {})
+            per = st.get("candidatos", {})
+            last = st.get("ultimo")
+            learned = sorted(cands, key=lambda c: (c != last, -per.get(c, {}).get("vitorias", 0), cands.index(c)))
+            return learned + self.fallback.get(name, [])
+
+    def _record(self, name: str, order: Sequence[str], idx: int):
+        winner = order[idx]
+        save = False
+        with self.lock:
+            st = self.stats.setdefault(name, {"ultimo": None, "candidatos": {}})
+            per = st["candidatos"]
+            w = per.setdefault(winner, {"vitorias": 0, "falhas": 0, "ultimo_sucesso": None})
+            w["vitorias"] += 1
+            w["ultimo_sucesso"] = _now()
+            # candidatos preferidos que não apareceram enquanto outro aparecia
+            for c in order[:idx]:
+                per.setdefault(c, {"vitorias": 0, "falhas": 0, "ultimo_sucesso": None})["falhas"] += 1
+            prev = st["ultimo"]
+            fallback = self.fallback.get(name, [])
+            # troca de vencedor, ou um fallback vencendo (mesmo na primeira vez); voltar ao preferido não avisa
+            drifted = (winner in fallback) or (prev is not None and prev != winner and prev not in fallback)
+            st["ultimo"] = winner
+            self._unsaved += 1
+            if self._unsaved >= SAVE_EVERY:
+                save = True
+            warn = drifted and (name, winner) not in self._warned
+            if warn:
+                self._warned.add((name, winner))
+        if warn:
+            LOG.warning(f"Seletor '{name}' mudou: '{prev or order[0]}' não encontrado, usando '{winner}'")
+        if save:
+            self.save()
+
+    def find(self, driver, names: Sequence[str], timeout: float = 0, require: Optional[Sequence[str]] = None,
+             detail: bool = False, accept=None) -> Dict[str, Dict]:
+        """
+        Resolve `names` num único laço de polling até `timeout` (0 = uma volta).
+        Retorna assim que os nomes de `require` (padrão: todos) forem encontrados;
+        `accept(nome, hit)` pode recusar um acerto (ex.: botão desabilitado).
+        Cada acerto: {i, el, text, value, seletor[, disabled, covered, in_view]}.
+        """
+        names = list(names)
+        need = set(names if require is None else require)
+        orders = {n: self.ordered(n) for n in names}
+        end = time.time() + timeout
+        hits: Dict[str, Dict] = {}
+        while True:
+            res = resolve_candidates(driver, [(n, orders[n]) for n in names if n not in hits], detail)
+            for n, h in res.items():
+                if accept is None or accept(n, h):
+                    h["seletor"] = orders[n][h["i"]]
+                    hits[n] = h
+                    self._record(n, orders[n], h["i"])
+            if need <= hits.keys() or len(hits) == len(names) or time.time() >= end:
+                return hits
+            time.sleep(POLL_INTERVAL)
+
+    def find_one(self, driver, name: str, timeout: float = 0, **kw) -> Optional[Dict]:
+        return self.find(driver, [name], timeout, **kw).get(name)
+
+    def click(self, driver, name: str, timeout: float = 20) -> bool:
+        """Clica no primeiro candidato visível e habilitado (scroll + clique nativo, JS como fallback)."""
+        hit = self.find_one(driver, name, timeout, detail=True, accept=lambda n, h: not h.get("disabled"))
+        return bool(hit) and click_element(driver, hit["el"])
+
+    def drift_report(self) -> List[Dict]:
+        """Candidatos que já venceram e agora falham (ou que só falham), por elemento."""
+        out = []
+        with self.lock:
+            for name, st in self.stats.items():
+                for sel, c in st.get("candidatos", {}).items():
+                    if c["falhas"] and sel != st.get("ultimo"):
+                        out.append({"nome": name, "seletor": sel, "vitorias": c["vitorias"], "falhas": c["falhas"],
+                                    "ultimo_sucesso": c["ultimo_sucesso"], "atual": st.get("ultimo")})
+        return sorted(out, key=lambda d: (-d["vitorias"], -d["falhas"]))
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = json.dumps(self.stats, ensure_ascii=False, indent=1)
+            self._unsaved = 0
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            LOG.debug(f"Seletores: falha ao gravar {self.path}: {e}")
+
+    def log_drift(self):
+        for d in self.drift_report():
+            if d["vitorias"]:
+                LOG.warning(f"Seletor '{d['nome']}' com drift: '{d['seletor']}' falhou {d['falhas']}x "
+                            f"(último sucesso {d['ultimo_sucesso']}); em uso: '{d['atual']}'")
+
+
+_REGISTRY: Optional[SelectorRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def registry() -> SelectorRegistry:
+    """Instância única por processo (todas as abas/workers aprendem juntas)."""
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = SelectorRegistry()
+        return _REGISTRY
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Relatório de drift dos seletores (seletores.json)")
+    ap.add_argument("--arquivo", default=SELECTOR_STATS_PATH)
+    args = ap.parse_args(argv)
+    reg = SelectorRegistry(args.arquivo)
+    for name, st in sorted(reg.stats.items()):
+        print(f"{name}: em uso '{st.get('ultimo')}'")
+        for sel, c in sorted(st.get("candidatos", {}).items(), key=lambda kv: -kv[1]["vitorias"]):
+            print(f"    {c['vitorias']:>6} vitórias {c['falhas']:>5} falhas  {c['ultimo_sucesso'] or '-':<19}  {sel}")
+    drift = [d for d in reg.drift_report() if d["vitorias"]]
+    print(f"\n{len(drift)} seletor(es) com drift" + (":" if drift else "."))
+    for d in drift:
+        print(f"  {d['nome']}: '{d['seletor']}' (último sucesso {d['ultimo_sucesso']})")
+
+
+if __name__ == "__main__":
+    _cli()
@@ -7,6 +7,12 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import NoSuchWindowException, TimeoutException
 import logging
 
+from cdp_utils import ensure_light_mode
+from asset_cache import ensure_fetch_sessions
+from dom_utils import option_snapshot
+from selector_registry import registry
+from page_state import classify_page, PageStateError, CAPTCHA, SSO_LOGIN, PORTAL_ERROR, TAB_GONE
+
 LOG = logging.getLogger("fapbot")
 
 
@@ -21,21 +27,17 @@ XPATH_ENTER_GOV = "/html/body/div/div[2]/div/div/div/div[2]/div/button[1]"
 CERT_MODAL_OK_XPATH = "//button[normalize-space()='OK']"
 
 
+registry().register("botao_certificado", XPATHS_CERT_BUTTON)
+
+
 def safe_click_any_xpath(driver, xpaths: Iterable[str], timeout: int = 20) -> bool:
-    """Tenta clicar no primeiro XPath clicável, com scroll/JS fallback."""
-    candidates = xpaths if isinstance(xpaths, (list, tuple, set)) else [xpaths]
-    for xp in candidates:
-        try:
-            el = WebDriverWait(driver, timeout).until(EC.element_to_be_clickable((By.XPATH, xp)))
-            driver.execute_script("arguments[0].scrollIntoView({block:'center', inline:'center'});", el)
-            try:
-                el.click()
-            except Exception:
-                driver.execute_script("arguments[0].click();", el)
-            return True
-        except Exception:
-            continue
-    return False
+    """
+    Clica no primeiro XPath visível e habilitado, com scroll/JS fallback.
+    Os candidatos disputam juntos (um laço de polling até `timeout` no total, não por XPath)
+    e o vencedor é lembrado pelo registro de seletores.
+    """
+    reg = registry()
+    return reg.click(driver, reg.ensure(xpaths), timeout=timeout)
 
 
 def click_dom_ok_if_present(driver, timeout: int = 8):
@@ -86,16 +88,14 @@ def watch_and_accept_cert_dialog(stop_event, timeout: int = 40):
         time.sleep(0.4)
 
 
+def captcha_visible(driver) -> bool:
+    """Checagem rápida (um script, sem espera): mensagem de captcha inválido ou desafio hCaptcha/reCAPTCHA na tela."""
+    return classify_page(driver)["estado"] == CAPTCHA
+
+
 def has_captcha_error(driver) -> bool:
-    try:
-        if "Captcha inválido" in (driver.page_source or ""):
-            return True
-        WebDriverWait(driver, 2).until(
-            EC.visibility_of_element_located((By.XPATH, "//*[contains(normalize-space(), 'Captcha inválido')]"))
-        )
-        return True
-    except Exception:
-        return False
+    # o classificador já lê o texto visível e os iframes de captcha; sem page_source nem espera
+    return captcha_visible(driver)
 
 
 def reset_sso_session(driver):
@@ -120,16 +120,18 @@ def reset_sso_session(driver):
 
 
 # ===== Helpers genéricos para combobox/dropdowns =====
-def _visible_option_elements(driver):
-    """Retorna elementos de opções visíveis de um dropdown (genérico para vários frameworks)."""
-    xp = (
-        "//*[(@role='option') and not(@aria-disabled='true')]"
-        " | //mat-option[not(@disabled)]"
-        " | //li[@role='option' and not(contains(@class,'disabled'))]"
-        " | //div[contains(@class,'mat-option') and not(contains(@class,'disabled'))]"
-    )
-    els = driver.find_elements(By.XPATH, xp)
-    return [e for e in els if e.is_displayed() and (e.text or '').strip()]
+# Seletores equivalentes ao union XPath antigo (role=option, mat-option, li[role=option], div.mat-option)
+SSO_OPTION_SELECTORS = [
+    "[role='option']:not([aria-disabled='true'])",
+    "mat-option:not([disabled])",
+    "li[role='option']:not([class*='disabled'])",
+    "div.mat-option:not([class*='disabled'])",
+]
+
+
+def _visible_options(driver):
+    """Snapshot das opções visíveis de um dropdown (texto + elemento) em um único round trip."""
+    return option_snapshot(driver, SSO_OPTION_SELECTORS, skip_placeholder=False)
 
 
 def open_dropdown(driver, input_xpath: str):
@@ -142,6 +144,20 @@ def open_dropdown(driver, input_xpath: str):
             return WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.XPATH, input_xpath)))
 
     for attempt in range(3):
+        # estado da aba primeiro: sessão perdida não se resolve esperando o input
+        st = classify_page(driver)
+        if st["estado"] == TAB_GONE:
+            LOG.warning("Aba do navegador fechada ao abrir dropdown; recuperando...")
+            _ensure_window(driver, revive_url="https://fap.dataprev.gov.br/consultar-fap")
+            continue
+        if st["estado"] in (SSO_LOGIN, CAPTCHA):
+            raise PageStateError(st["estado"], st.get("url", ""))
+        if st["estado"] == PORTAL_ERROR:
+            LOG.warning(f"Erro do portal ao abrir dropdown ({st.get('detalhe')}); recarregando...")
+            try:
+                driver.get("https://fap.dataprev.gov.br/consultar-fap")
+            except Exception:
+                pass
         try:
             el = _find_clickable()
             driver.execute_script("arguments[0].scrollIntoView({block:'center', inline:'center'});", el)
@@ -198,12 +214,16 @@ def _ensure_window(driver, revive_url: str = None) -> bool:
                 except Exception:
                     cur = ""
                 if ("dataprev.gov.br" in cur) or ("gov.br" in cur) or ("consultar-fap" in cur):
+                    ensure_light_mode(driver)
+                    ensure_fetch_sessions(driver)
                     return True
             except Exception:
                 continue
         # Se nenhuma “boa”, usa a última mesmo
         try:
             driver.switch_to.window(handles[-1])
+            ensure_light_mode(driver)
+            ensure_fetch_sessions(driver)
             return True
         except Exception:
             pass
@@ -217,6 +237,8 @@ def _ensure_window(driver, revive_url: str = None) -> bool:
             driver.switch_to.window(driver.window_handles[-1])
         except Exception:
             return False
+    ensure_light_mode(driver)
+    ensure_fetch_sessions(driver)
     # Navega para a tela (se fornecido)
     if revive_url:
         try:
@@ -230,10 +252,10 @@ def list_options_for_input(driver, input_xpath: str) -> List[str]:
     open_dropdown(driver, input_xpath)
     # pequena pausa para renderizar menu
     try:
-        WebDriverWait(driver, 5).until(lambda d: len(_visible_option_elements(d)) > 0)
+        WebDriverWait(driver, 5).until(lambda d: len(_visible_options(d)) > 0)
     except Exception:
         pass
-    texts = [e.text.strip() for e in _visible_option_elements(driver)]
+    texts = [o["text"] for o in _visible_options(driver)]
     # Remove itens vazios/placeholder
     return [t for t in texts if t and not t.lower().startswith("selecione ")]
 
@@ -298,12 +320,11 @@ def select_first_option(driver, input_xpath: str) -> Optional[str]:
     """Abre o dropdown e seleciona a primeira opção visível não-placa (retorna o texto)."""
     open_dropdown(driver, input_xpath)
     try:
-        WebDriverWait(driver, 5).until(lambda d: len(_visible_option_elements(d)) > 0)
+        WebDriverWait(driver, 5).until(lambda d: len(_visible_options(d)) > 0)
     except Exception:
         pass
-    opts = _visible_option_elements(driver)
-    for opt in opts:
-        txt = (opt.text or "").strip()
+    for o in _visible_options(driver):
+        txt, opt = o["text"], o["el"]
         if not txt or txt.lower().startswith("selecione "):
             continue
         try:
@@ -0,0 +1,329 @@
+import os
+import csv
+import sqlite3
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from report_utils import REPORT_HEADERS
+
+
+# Banco local com o histórico de todas as execuções (uma linha por CNPJ_Estab/Vigência/execução)
+DEFAULT_DB_PATH = "relatorio_fap.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS execucoes (
+    run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    iniciada_em TEXT NOT NULL,
+    origem      TEXT
+);
+CREATE TABLE IF NOT EXISTS resultados (
+    cnpj_estab    TEXT NOT NULL,
+    vigencia      TEXT NOT NULL,
+    run_id        INTEGER NOT NULL REFERENCES execucoes(run_id),
+    cnpj_raiz     TEXT,
+    razao_social  TEXT,
+    uf            TEXT,
+    municipio     TEXT,
+    aliquota      TEXT,
+    aliquota_num  REAL,
+    data_consulta TEXT,
+    consultado_em TEXT,
+    PRIMARY KEY (cnpj_estab, vigencia, run_id)
+);
+CREATE INDEX IF NOT EXISTS idx_resultados_raiz ON resultados(cnpj_raiz, vigencia);
+CREATE INDEX IF NOT EXISTS idx_resultados_vigencia ON resultados(vigencia, cnpj_estab);
+CREATE TABLE IF NOT EXISTS fases (
+    run_id    INTEGER REFERENCES execucoes(run_id),
+    vigencia  TEXT,
+    cnpj      TEXT,
+    estab     TEXT,
+    fase      TEXT NOT NULL,
+    inicio    TEXT NOT NULL,
+    duracao_s REAL NOT NULL,
+    origem    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_fases_run ON fases(run_id, fase);
+"""
+
+# Colunas do relatório -> colunas do banco
+_COLS = {
+    "CNPJ_Raiz": "cnpj_raiz",
+    "Razao_Social": "razao_social",
+    "CNPJ_Estab": "cnpj_estab",
+    "UF": "uf",
+    "Municipio": "municipio",
+    "Vigencia": "vigencia",
+    "Aliquota": "aliquota",
+    "Data_Consulta": "data_consulta",
+}
+
+
+def _only_digits(s) -> str:
+    return "".join(ch for ch in str(s or "") if ch.isdigit())
+
+
+def _cnpj_digits(v, width: int) -> str:
+    """CNPJ só com dígitos e zeros à esquerda repostos (mesma normalização de report_utils._row_key)."""
+    s = "" if v is None else str(v).strip()
+    if s.endswith(".0"):  # número vindo do Excel
+        s = s[:-2]
+    d = _only_digits(s)
+    return d.zfill(width) if d else ""
+
+
+def _parse_aliquota(txt) -> Optional[float]:
+    """Converte '1,0000' / '1.234,5' (formato brasileiro) ou '1.5' em float; None se não for numérico."""
+    s = str(txt or "").strip()
+    if "," in s:  # vírgula decimal: ponto só como separador de milhar
+        s = s.replace(".", "").replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _parse_data_consulta(txt) -> str:
+    """'dd/mm/aaaa hh:mm:ss' -> ISO (ordenável); se não der, usa o horário atual."""
+    try:
+        return datetime.strptime(str(txt).strip(), "%d/%m/%Y %H:%M:%S").isoformat(sep=" ")
+    except Exception:
+        return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+def open_store(path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
+    """Abre (ou cria) o banco de resultados e garante o schema/índices."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    # bancos gravados antes da normalização: CNPJ sem os zeros à esquerda (vindo do Excel)
+    with conn:
+        conn.execute("UPDATE OR REPLACE resultados SET cnpj_estab = substr('00000000000000' || cnpj_estab, -14) "
+                     "WHERE length(cnpj_estab) BETWEEN 1 AND 13")
+        conn.execute("UPDATE resultados SET cnpj_raiz = substr('00000000' || cnpj_raiz, -8) "
+                     "WHERE length(cnpj_raiz) BETWEEN 1 AND 7")
+    return conn
+
+
+def start_run(conn: sqlite3.Connection, origem: str = "main", iniciada_em: Optional[str] = None) -> int:
+    """Registra uma nova execução e retorna o run_id (`iniciada_em` ISO; padrão: agora)."""
+    cur = conn.execute(
+        "INSERT INTO execucoes (iniciada_em, origem) VALUES (?, ?)",
+        (iniciada_em or datetime.now().isoformat(sep=" ", timespec="seconds"), origem),
+    )
+    conn.commit()
+    return cur.lastrowid
+
+
+def _row_values(row: Dict[str, str], run_id: int) -> tuple:
+    return (
+        _cnpj_digits(row.get("CNPJ_Estab"), 14),
+        str(row.get("Vigencia") or ""),
+        run_id,
+        _cnpj_digits(row.get("CNPJ_Raiz"), 8),
+        row.get("Razao_Social") or "",
+        row.get("UF") or "",
+        row.get("Municipio") or "",
+        row.get("Aliquota") or "",
+        _parse_aliquota(row.get("Aliquota")),
+        row.get("Data_Consulta") or "",
+        _parse_data_consulta(row.get("Data_Consulta")),
+    )
+
+
+_INSERT = """
+INSERT OR REPLACE INTO resultados (
+    cnpj_estab, vigencia, run_id, cnpj_raiz, razao_social, uf, municipio,
+    aliquota, aliquota_num, data_consulta, consultado_em
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def save_row(conn: sqlite3.Connection, run_id: int, row: Dict[str, str]):
+    """Grava (ou substitui, se repetido na mesma execução) um resultado."""
+    conn.execute(_INSERT, _row_values(row, run_id))
+    conn.commit()
+
+
+def save_rows(conn: sqlite3.Connection, run_id: int, rows: List[Dict[str, str]]):
+    """Grava vários resultados numa única transação."""
+    with conn:
+        conn.executemany(_INSERT, [_row_values(r, run_id) for r in rows])
+
+
+def save_phases(conn: sqlite3.Connection, run_id: Optional[int], rows: List[tuple], origem: str = "ao_vivo"):
+    """Grava durações de fases: tuplas (vigencia, cnpj, estab, fase, inicio_iso, duracao_s)."""
+    with conn:
+        conn.executemany(
+            "INSERT INTO fases (run_id, vigencia, cnpj, estab, fase, inicio, duracao_s, origem) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, *r, origem) for r in rows],
+        )
+
+
+# -----------------------------------------------------------------------------
+# Consultas
+# -----------------------------------------------------------------------------
+# Última linha de cada (CNPJ_Estab, Vigência), usando o índice da PK
+_LATEST = """
+SELECT r.* FROM resultados r
+JOIN (
+    SELECT cnpj_estab, vigencia, MAX(run_id) AS run_id
+    FROM resultados {where}
+    GROUP BY cnpj_estab, vigencia
+) u USING (cnpj_estab, vigencia, run_id)
+ORDER BY r.cnpj_raiz, r.cnpj_estab, r.vigencia
+"""
+
+
+def _cnpj_filter(cnpj: Optional[str], vigencia: Optional[str]):
+    conds, params = [], []
+    d = _only_digits(cnpj)
+    if d:
+        # 14 dígitos = estabelecimento; menos que isso = raiz
+        if len(d) >= 14:
+            conds.append("cnpj_estab = ?")
+            params.append(d[:14])
+        else:
+            conds.append("cnpj_raiz = ?")
+            params.append(d[:8].zfill(8))
+    if vigencia:
+        conds.append("vigencia = ?")
+        params.append(str(vigencia))
+    where = ("WHERE " + " AND ".join(conds)) if conds else ""
+    return where, params
+
+
+def latest_sql(cnpj: Optional[str] = None, vigencia: Optional[str] = None):
+    """(sql, params) da posição mais recente; útil para leitores em lote (ex.: pandas.read_sql_query)."""
+    where, params = _cnpj_filter(cnpj, vigencia)
+    return _LATEST.format(where=where), params
+
+
+def latest_aliquota(conn: sqlite3.Connection, cnpj: Optional[str] = None, vigencia: Optional[str] = None) -> List[sqlite3.Row]:
+    """Alíquota mais recente por estabelecimento/vigência (filtra por CNPJ raiz ou estab)."""
+    sql, params = latest_sql(cnpj, vigencia)
+    return conn.execute(sql, params).fetchall()
+
+
+def history_for_estab(conn: sqlite3.Connection, cnpj_estab: str) -> List[sqlite3.Row]:
+    """Histórico completo de um estabelecimento (todas as execuções e vigências)."""
+    return conn.execute(
+        """
+        SELECT r.*, e.iniciada_em FROM resultados r
+        JOIN execucoes e USING (run_id)
+        WHERE r.cnpj_estab = ?
+        ORDER BY r.vigencia, r.run_id
+        """,
+        (_only_digits(cnpj_estab),),
+    ).fetchall()
+
+
+def aliquota_changes(conn: sqlite3.Connection, vigencia: Optional[str] = None) -> List[sqlite3.Row]:
+    """Estabelecimentos cuja alíquota mudou entre duas execuções consecutivas (mesma vigência)."""
+    where, params = _cnpj_filter(None, vigencia)
+    return conn.execute(
+        f"""
+        SELECT * FROM (
+            SELECT cnpj_raiz, cnpj_estab, vigencia, razao_social,
+                   LAG(aliquota)     OVER w AS aliquota_anterior,
+                   LAG(aliquota_num) OVER w AS num_anterior,
+                   LAG(run_id)       OVER w AS run_anterior,
+                   aliquota, aliquota_num, run_id
+            FROM resultados {where}
+            WINDOW w AS (PARTITION BY cnpj_estab, vigencia ORDER BY run_id)
+        )
+        -- compara o valor numérico ('1,0000' = '1.0000'); o texto só quando não é número
+        WHERE run_anterior IS NOT NULL
+          AND COALESCE(aliquota_num, aliquota) IS NOT COALESCE(num_anterior, aliquota_anterior)
+        ORDER BY cnpj_raiz, cnpj_estab, vigencia, run_id
+        """,
+        params,
+    ).fetchall()
+
+
+def as_report_row(r: sqlite3.Row) -> Dict[str, str]:
+    return {h: r[col] for h, col in _COLS.items()}
+
+
+def export_latest(conn: sqlite3.Connection, path: str, vigencia: Optional[str] = None,
+                  headers: Optional[List[str]] = None) -> int:
+    """Gera o relatório (.xlsx ou .csv) a partir do banco, com a linha mais recente de cada chave."""
+    headers = headers or REPORT_HEADERS
+    where, params = _cnpj_filter(None, vigencia)
+    cur = conn.execute(_LATEST.format(where=where), params)
+    n = 0
+    if path.lower().endswith(".xlsx"):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            path = path[:-5] + ".csv"
+        else:
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet()
+            ws.append(headers)
+            for r in cur:
+                row = as_report_row(r)
+                ws.append([row.get(h, "") for h in headers])
+                n += 1
+            wb.save(path)
+            return n
+    with open(path, mode="w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=headers, extrasaction="ignore")
+        writer.writeheader()
+        for r in cur:
+            writer.writerow(as_report_row(r))
+            n += 1
+    return n
+
+
+# -----------------------------------------------------------------------------
+# Linha de comando: python store_utils.py <comando> ...
+# -----------------------------------------------------------------------------
+def _print_rows(rows, cols):
+    print("\t".join(cols))
+    for r in rows:
+        print("\t".join("" if r[c] is None else str(r[c]) for c in cols))
+
+
+def _cli(argv=None):
+    ap = argparse.ArgumentParser(description="Consultas ao histórico de resultados do FAP")
+    ap.add_argument("--db", default=DEFAULT_DB_PATH)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("ultima", help="alíquota mais recente (CNPJ raiz ou estabelecimento)")
+    p.add_argument("cnpj", nargs="?")
+    p.add_argument("--vigencia")
+
+    p = sub.add_parser("historico", help="histórico de um estabelecimento")
+    p.add_argument("cnpj_estab")
+
+    p = sub.add_parser("alteracoes", help="estabelecimentos com alíquota alterada entre execuções")
+    p.add_argument("--vigencia")
+
+    p = sub.add_parser("exportar", help="gera .xlsx/.csv com a posição mais recente")
+    p.add_argument("saida")
+    p.add_argument("--vigencia")
+
+    args = ap.parse_args(argv)
+    if not os.path.exists(args.db):
+        ap.error(f"banco não encontrado: {args.db}")
+    conn = open_store(args.db)
+
+    if args.cmd == "ultima":
+        _print_rows(latest_aliquota(conn, args.cnpj, args.vigencia),
+                    ["cnpj_raiz", "cnpj_estab", "vigencia", "aliquota", "run_id", "data_consulta"])
+    elif args.cmd == "historico":
+        _print_rows(history_for_estab(conn, args.cnpj_estab),
+                    ["vigencia", "run_id", "iniciada_em", "aliquota", "data_consulta"])
+    elif args.cmd == "alteracoes":
+        _print_rows(aliquota_changes(conn, args.vigencia),
+                    ["cnpj_raiz", "cnpj_estab", "vigencia", "aliquota_anterior", "aliquota", "run_anterior", "run_id"])
+    elif args.cmd == "exportar":
+        n = export_latest(conn, args.saida, args.vigencia)
+        print(f"{n} linhas exportadas para {args.saida}")
+
+
+if __name__ == "__main__":
+    _cli()